@@ -38,6 +38,7 @@ from docopt import docopt
 import logging
 import log
 import dev as gis
+import polygon_grid
 import glob
 
 def exec_gnaf_sqlscripts(sql_script,database = None):
@@ -106,6 +107,7 @@ def data_filtering(table):
 
     vic_polygon = shapely.ops.cascaded_union(lst_polygons)
     vic_polygon_prepared = shapely.prepared.prep(vic_polygon)
+    vic_grid = polygon_grid.PolygonGrid([vic_polygon], 500)
     vicgrid_proj = pyproj.Proj(init='EPSG:3111')
     count = 0
     count_false = 0
@@ -122,8 +124,13 @@ def data_filtering(table):
         ##for enum, row in enumerate(cursor_gnaf.execute('select address_detail_pid, latitude, longitude from address_default_geocode')):
             pid, lon, lat = row
             lon_p, lat_p = vicgrid_proj(lon, lat)
-            point = shapely.geometry.Point(lon_p, lat_p)
-            if vic_polygon_prepared.intersects(point):
+            # interior/outside grid cells need no geometry test
+            owner, cell = vic_grid.lookup_xy(lon_p, lat_p)
+            if owner == polygon_grid.BOUNDARY:
+                inside = vic_polygon_prepared.intersects(shapely.geometry.Point(lon_p, lat_p))
+            else:
+                inside = owner >= 0
+            if inside:
                 count += 1
                 sbc.add_row([pid])
                 if count % 10000 == 0:
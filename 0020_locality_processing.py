@@ -27,14 +27,15 @@ import log
 import dev as gis
 import dbpy
 
+import coord_transform
+
 
 def create_locality_centroid(estamap_version):
     
     logging.info('environment')
     em = gis.ESTAMAP(estamap_version)
     arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(3111)
-    ingr_sr = gis.ingr_spatial_reference()
-    ingr_uor_sr = gis.ingr_uor_spatial_reference()
+    transform = coord_transform.IngrTransform()
     
     if arcpy.Exists(os.path.join(em.sde, 'LOCALITY_CENTROID')):
         logging.info('deleting existing locality centroid fc')
@@ -86,27 +87,33 @@ def create_locality_centroid(estamap_version):
     arcpy.FeatureToPoint_management(in_features=os.path.join(em.sde, 'LOCALITY'),
                                     out_feature_class='in_memory\\locality_centroid')
 
-    logging.info('calc coordinates...')
+    logging.info('reading centroids...')
+    centroids = []
     with arcpy.da.SearchCursor(in_table='in_memory\\locality_centroid',
-                               field_names=['PFI', 'SHAPE@']) as sc, \
-         arcpy.da.InsertCursor(in_table='in_memory\\locality_centroid_temp',
+                               field_names=['PFI', 'SHAPE@']) as sc:
+        for pfi, geom in sc:
+            centroids.append((pfi, geom, geom.centroid.X, geom.centroid.Y))
+    logging.info(len(centroids))
+
+    logging.info('calc coordinates...')
+    xs = [x for pfi, geom, x, y in centroids]
+    ys = [y for pfi, geom, x, y in centroids]
+    xs_ingr, ys_ingr, xs_ingr_uor, ys_ingr_uor = transform(xs, ys)
+
+    with arcpy.da.InsertCursor(in_table='in_memory\\locality_centroid_temp',
                                field_names=['PFI', 'SHAPE@', 
                                             'X_VICGRID', 'Y_VICGRID',
                                             'X_INGR', 'Y_INGR',
                                             'X_INGR_UOR', 'Y_INGR_UOR',
                                             ]) as ic:
 
-        for enum, (pfi, geom) in enumerate(sc):
-            if enum % 100 == 0:
-                logging.info(enum)
-            geom_ingr = geom.projectAs(ingr_sr)
-            geom_ingr_uor = geom.projectAs(ingr_uor_sr)
-
+        for (pfi, geom, x, y), x_ingr, y_ingr, x_ingr_uor, y_ingr_uor in zip(centroids,
+                                                                         xs_ingr.tolist(), ys_ingr.tolist(),
+                                                                         xs_ingr_uor.tolist(), ys_ingr_uor.tolist()):
             ic.insertRow((pfi, geom,
-                          geom.centroid.X, geom.centroid.Y,
-                          geom_ingr.centroid.X, geom_ingr.centroid.Y,
-                          geom_ingr_uor.centroid.X, geom_ingr_uor.centroid.Y))
-        logging.info(enum)
+                          x, y,
+                          x_ingr, y_ingr,
+                          x_ingr_uor, y_ingr_uor))
         
     logging.info('exporting...')
     arcpy.FeatureClassToFeatureClass_conversion(in_features='in_memory\\locality_centroid_temp',
@@ -1,5 +1,7 @@
 '''
 Calculates ENTRY/EXIT bearing and FLIPPED bearing of ROAD.
+
+Bearings are calculated over all ROAD vertices at once (road_geometry).
  
 Usage:
   calc_road_bearings.py [options]
@@ -11,20 +13,16 @@ Options:
 '''
 import os
 import sys
-import time
 import logging
-import collections
 
 from docopt import docopt
-import shapely.geometry
-import shapely.wkb
-import numpy as np
-import arcpy
 
 import log
 import dev as gis
 import dbpy
 
+import road_geometry
+
 
 def create_road_bearing_table(estamap_version):
 
@@ -41,80 +39,18 @@ def calc_road_bearing(estamap_version):
 
     logging.info('environment')
     em = gis.ESTAMAP(estamap_version)
-    cursor = em.conn.cursor()
 
     logging.info('get coords')
-    pfis = []
-    x_entry = []
-    y_entry = []
-    x_exit = []
-    y_exit = []
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
-                               field_names=['PFI', 'SHAPE@WKB'],
-                               spatial_reference=gis.ingr_spatial_reference(),
-                               sql_clause=(None, 'ORDER BY PFI')) as sc:
-        for enum, (pfi, geom_wkb) in enumerate(sc, 1):
-
-            geom = shapely.wkb.loads(str(geom_wkb))
-
-            first_point = geom.coords[0]
-            entry_point = geom.interpolate(2.5)
-            dx_entry = entry_point.x - first_point[0]
-            dy_entry = entry_point.y - first_point[1]
-
-            last_point = geom.coords[-1]
-            exit_point = geom.interpolate(geom.length - 2.5)
-            dx_exit = last_point[0] - exit_point.x
-            dy_exit = last_point[1] - exit_point.y
-
-            pfis.append(pfi)
-            x_entry.append(dx_entry)
-            y_entry.append(dy_entry)
-            x_exit.append(dx_exit)
-            y_exit.append(dy_exit)
-
-            if enum % 10000 == 0:
-                logging.info('{}'.format(enum))
-        logging.info('{}'.format(enum))
-
-    logging.info('calc bearings and insert')
+    vertices = road_geometry.RoadVertices.from_feature_class(estamap_version, gis.ingr_spatial_reference())
+
+    logging.info('calc bearings')
+    entry_bearing, exit_bearing, flipped_entry_bearing, flipped_exit_bearing = road_geometry.road_bearings(vertices)
+
+    logging.info('insert')
     with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_BEARING') as sbc:
-        
-        for enum, (pfi, entry_angle, exit_angle) in enumerate(zip(pfis,
-                                                                  np.arctan2(np.array(y_entry), np.array(x_entry)) * 180 / np.pi,
-                                                                  np.arctan2(np.array(y_exit), np.array(x_exit)) * 180 / np.pi)):
-##            if entry_angle < 0:
-##                entry_bearing = (90 - entry_angle) % 360
-##            else:
-##                entry_bearing = (450 - entry_angle) % 360
-##            if exit_angle < 0:
-##                exit_bearing = (90 - exit_angle) % 360
-##            else:
-##                exit_bearing = (450 - exit_angle) % 360
-
-##            if entry_angle < 0:
-##                entry_bearing = int((90 - entry_angle) % 360)
-##            else:
-##                entry_bearing = int((450 - entry_angle) % 360)
-##            if exit_angle < 0:
-##                exit_bearing = int((90 - exit_angle) % 360)
-##            else:
-##                exit_bearing = int((450 - exit_angle) % 360)
-
-            if entry_angle < 0:
-                entry_bearing = float((90 - entry_angle) % 360)
-            else:
-                entry_bearing = float((450 - entry_angle) % 360)
-            if exit_angle < 0:
-                exit_bearing = float((90 - exit_angle) % 360)
-            else:
-                exit_bearing = float((450 - exit_angle) % 360)
-
-            sbc.add_row((pfi, entry_bearing, exit_bearing, (exit_bearing + 180) % 360, (entry_bearing + 180) % 360))
-            if enum % 10000 == 0:
-                logging.info(enum)
-                sbc.flush()
-        logging.info(enum)
+        sbc.load_data(zip(vertices.pfis.tolist(),
+                          entry_bearing.tolist(), exit_bearing.tolist(),
+                          flipped_entry_bearing.tolist(), flipped_exit_bearing.tolist()))
     logging.info('count start: {}'.format(sbc.count_start))
     logging.info('count finish: {}'.format(sbc.count_finish))
 
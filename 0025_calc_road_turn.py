@@ -1,30 +1,44 @@
 '''
 Calculates ROAD TURN between all road segments at each intersection.
 
+Turns are generated from an in memory CSR graph of the road ends at each UFI
+(road_network), all ordered pairs per node degree at once.
+
+With --changed_pfis / --changed_ufis only the turns at the affected UFIs are
+deleted and recalculated: the changed roads' current and previous (in
+ROAD_TURN) FROM/TO UFIs and the changed ROAD_INFRASTRUCTURE UFIs. The new
+turns are loaded into ROAD_TURN_UPDATE first and swapped in with the delete in
+one transaction. Run after ROAD_BEARING (or the road geometry cache) is up to
+date.
+
 Usage:
   calc_road_turn.py [options]
 
 Options:
   --estamap_version <version>  ESTAMap Version
-  --temp_lmdb <lmdb>      LMDB location [default: c:\\temp\\turnangles_lmdb]
+  --road_geometry <file>  Road geometry cache (road_geometry.py), read in place of ROAD and ROAD_BEARING. Refused when it no longer matches ROAD.
+  --bearing_offset <metres>  Bearing offset, other than 2.5 reads ROAD_BEARING_PROFILE or the cache. [default: 2.5]
+  --connector_only <ftcs>  Comma separated FEATURE_TYPE_CODEs where only the CONPFI1/CONPFI2 roads turn into each other. [default: tunnel]
+  --changed_pfis <pfis>   Comma separated ROAD PFIs changed since the last build (incremental update).
+  --changed_ufis <ufis>   Comma separated ROAD_INFRASTRUCTURE UFIs changed since the last build (incremental update).
   --log_file <file>       Log File name. [default: calc_road_turn_angles.log]
   --log_path <folder>     Folder to store the log file. [default: c:\\temp]
 '''
 import os
 import sys
-import time
 import logging
-import itertools
-import shutil
 
 from docopt import docopt
+import numpy as np
 import arcpy
-import lmdb
 
 import log
 import dev as gis
 import dbpy
 
+import road_geometry
+import road_network
+
 
 def create_road_turn_table(estamap_version):
 
@@ -37,155 +51,175 @@ def create_road_turn_table(estamap_version):
     dbpy.exec_script(em.server, em.database_name, sql_script)
 
 
-def calc_road_turn(estamap_version, temp_lmdb='C:\\temp\\turnangles_lmdb'):
+def read_road_graph(estamap_version, roads=None, bearing_offset=road_geometry.BEARING_OFFSET):
+    # returns (graph, bearing at each road end), ENTRY at the FROM end else ENTRY_FLIP
+
+    logging.info('read roads')
+    pfis = []
+    from_ufis = []
+    to_ufis = []
+    for pfi, from_ufi, to_ufi, ftc in road_geometry.read_roads(estamap_version, roads):
+        pfis.append(pfi)
+        from_ufis.append(from_ufi)
+        to_ufis.append(to_ufi)
+    graph = road_network.RoadGraph(pfis, from_ufis, to_ufis)
+    logging.info('roads: {}, nodes: {}'.format(len(pfis), len(graph)))
+
+    logging.info('read bearings')
+    bearing_pfis = []
+    entry_bearings = []
+    entry_flip_bearings = []
+    for pfi, entry_bear, exit_bear, entry_bear_flip, exit_bear_flip in road_geometry.read_road_bearings(estamap_version, roads, bearing_offset):
+        bearing_pfis.append(pfi)
+        entry_bearings.append(entry_bear)
+        entry_flip_bearings.append(entry_bear_flip)
+    bearing_pfis = np.array(bearing_pfis, dtype=np.int64)
+    order = np.argsort(bearing_pfis)
+    pos = np.clip(np.searchsorted(bearing_pfis[order], graph.pfis), 0, max(len(order) - 1, 0))
+    found = np.zeros(len(graph.pfis), dtype=bool)
+    if len(order):
+        found = bearing_pfis[order][pos] == graph.pfis
+    if not found.all():
+        missing = graph.pfis[~found]
+        raise Exception('ROAD without bearings ({}): {}'.format(
+            len(missing), ','.join(str(pfi) for pfi in missing[:100].tolist())))
+    idx = order[pos]
+
+    # bearings to 5 decimals, as stored previously
+    entry_bearings = np.round(np.array(entry_bearings, dtype=np.float64)[idx], 5)
+    entry_flip_bearings = np.round(np.array(entry_flip_bearings, dtype=np.float64)[idx], 5)
+    end_bearings = np.where(graph.end_is_from,
+                            entry_bearings[graph.end_roads],
+                            entry_flip_bearings[graph.end_roads])
+    return graph, end_bearings
+
+
+def read_turn_restrictions(estamap_version, graph, rules=road_network.TURN_RULES):
+
+    em = gis.ESTAMAP(estamap_version)
+
+    logging.info('read road_infrastructure')
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
+                               field_names=['UFI', 'FEATURE_TYPE_CODE', 'CONPFI1', 'CONPFI2']) as sc:
+        ufis, ftcs, conpfi1s, conpfi2s = zip(*sc)
+
+    logging.info('compile turn restrictions: {}'.format(', '.join(sorted(rules))))
+    restrictions = road_network.TurnRestrictions.compile(graph, ufis, ftcs, conpfi1s, conpfi2s, rules)
+    logging.info('nodes without road_infrastructure: {}'.format(int(np.count_nonzero(~restrictions.node_known))))
+    return restrictions
+
+
+def road_turns(graph, end_bearings, restrictions, nodes=None):
+    # returns (ufis, from_pfis, to_pfis, angles, from_bearings, to_bearings)
+    # for every allowed ordered pair of distinct roads at each node (optionally only nodes)
+
+    from_ends, to_ends = graph.end_pairs(nodes)
+    allowed = restrictions.allowed(from_ends, to_ends, graph.end_nodes)
+    from_ends, to_ends = from_ends[allowed], to_ends[allowed]
+
+    from_bearings = end_bearings[from_ends]
+    to_bearings = end_bearings[to_ends]
+    angles = from_bearings - to_bearings
+    angles = np.where(angles < -180, angles + 360, np.where(angles > 180, angles - 360, angles))
+
+    return (graph.nodes[graph.end_nodes[from_ends]],
+            graph.pfis[graph.end_roads[from_ends]],
+            graph.pfis[graph.end_roads[to_ends]],
+            angles, from_bearings, to_bearings)
+
+
+def calc_road_turn(estamap_version, road_geometry_cache=None, bearing_offset=road_geometry.BEARING_OFFSET,
+                   rules=road_network.TURN_RULES):
 
     logging.info('environment')
     em = gis.ESTAMAP(estamap_version)
-    cursor = em.conn.cursor()
-    
-    logging.info('create lmdb db')
-    if os.path.exists(temp_lmdb):
-        shutil.rmtree(temp_lmdb)
-    env = lmdb.Environment(path=temp_lmdb,
-                           map_size=1000000000,
-                           readonly=False,
-                           max_dbs=4)
-    road_bearings_db = env.open_db('road_bearings', dupsort=True)
-    road_pfis_db = env.open_db('road_pfis', dupsort=True)
-    roads_at_ufi_db = env.open_db('roads_at_ufi', dupsort=True)
-    road_infrastructure_db = env.open_db('road_infrastructure')
+    roads = road_geometry.load_cache(road_geometry_cache, estamap_version)
 
+    graph, end_bearings = read_road_graph(estamap_version, roads, bearing_offset)
+    restrictions = read_turn_restrictions(estamap_version, graph, rules)
 
-    logging.info('read bearings')
-    with env.begin(write=True, db=road_bearings_db) as road_bearings_txn, \
-         arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_BEARING'),
-                               field_names=['PFI',
-                                            'ENTRY_BEARING',
-                                            'EXIT_BEARING',
-                                            'ENTRY_BEARING_FLIP',
-                                            'EXIT_BEARING_FLIP']) as sc:
+    logging.info('calc turns')
+    turns = road_turns(graph, end_bearings, restrictions)
+    logging.info('turns: {}'.format(len(turns[0])))
 
-        for enum, (pfi, entry_bear, exit_bear, entry_bear_flip, exit_bear_flip) in enumerate(sc, 1):
+    logging.info('insert')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_TURN') as sbc:
+        sbc.load_data(zip(*[column.tolist() for column in turns]))
 
-            pfi = str(pfi)
-            road_bearings_txn.put(pfi+'ENTRY', '{:.5f}'.format(entry_bear))
-            road_bearings_txn.put(pfi+'EXIT', '{:.5f}'.format(exit_bear))
-            road_bearings_txn.put(pfi+'ENTRY_FLIP', '{:.5f}'.format(entry_bear_flip))
-            road_bearings_txn.put(pfi+'EXIT_FLIP', '{:.5f}'.format(exit_bear_flip))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
 
-            if enum % 10000 == 0:
-                logging.info(enum)
 
-    logging.info('read roads')
-    with env.begin(write=True, db=road_pfis_db) as road_pfis_txn, \
-         arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
-                               field_names=['PFI', 'FROM_UFI', 'TO_UFI']) as sc:
+def affected_ufis(estamap_version, graph, changed_pfis, changed_ufis, chunk_size=1000):
 
-        for enum, (pfi, from_ufi, to_ufi) in enumerate(sc, 1):
-            road_pfis_txn.put(str(pfi), str(from_ufi) + ',' + str(to_ufi))
-            if enum % 10000 == 0:
-                logging.info(enum)
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
 
-                
-    logging.info('read road_infrastructure')
-    with env.begin(write=True, db=road_infrastructure_db) as road_infrastructure_txn, \
-         arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
-                               field_names=['UFI', 'FEATURE_TYPE_CODE', 'CONPFI1', 'CONPFI2']) as sc:
+    ufis = set(changed_ufis)
 
-        for enum, (ufi, ftc, conpfi1, conpfi2) in enumerate(sc, 1):
-            road_infrastructure_txn.put(str(ufi), str(ftc) + ',' + str(conpfi1) + ',' + str(conpfi2))
-            if enum % 10000 == 0:
-                logging.info(enum)
+    # current ends of the changed roads
+    changed = np.in1d(graph.pfis, np.array(changed_pfis, dtype=np.int64))
+    ufis.update(graph.from_ufis[changed].tolist())
+    ufis.update(graph.to_ufis[changed].tolist())
 
+    # previous ends of the changed roads (moved or deleted)
+    changed_pfis = sorted(set(changed_pfis))
+    for start in xrange(0, len(changed_pfis), chunk_size):
+        for ufi, in conn.execute('SELECT DISTINCT UFI FROM ROAD_TURN WHERE FROM_PFI IN ({})'.format(
+                ','.join(str(pfi) for pfi in changed_pfis[start:start + chunk_size]))):
+            ufis.add(int(ufi))
 
-    logging.info('find roads at ufi')
-    with env.begin(db=road_pfis_db) as road_pfis_txn, \
-         env.begin(write=True, db=roads_at_ufi_db) as roads_at_ufi_txn:
+    return sorted(ufis)
 
-        cursor_road = road_pfis_txn.cursor()
 
-        for enum_pfi, (pfi, ufis) in enumerate(cursor_road.iternext(), 1):
-            
-            from_ufi, to_ufi = ufis.split(',')
+def update_road_turn(estamap_version, changed_pfis, changed_ufis, road_geometry_cache=None,
+                     bearing_offset=road_geometry.BEARING_OFFSET, rules=road_network.TURN_RULES, chunk_size=1000):
 
-            roads_at_ufi_txn.put(from_ufi, pfi)
-            roads_at_ufi_txn.put(to_ufi, pfi)
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+    roads = road_geometry.load_cache(road_geometry_cache, estamap_version)
 
-    logging.info('iterating permutations and insert')
-    with env.begin(db=roads_at_ufi_db) as roads_at_ufi_txn, \
-         env.begin(db=road_bearings_db) as road_bearings_txn, \
-         env.begin(db=road_pfis_db) as road_pfis_txn, \
-         env.begin(db=road_infrastructure_db) as road_infrastructure_txn, \
-         dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_TURN') as sbc:
+    graph, end_bearings = read_road_graph(estamap_version, roads, bearing_offset)
+    restrictions = read_turn_restrictions(estamap_version, graph, rules)
 
-        cursor_keys = roads_at_ufi_txn.cursor()
-        cursor_values = roads_at_ufi_txn.cursor()
-        road_infrastructure_cursor = road_infrastructure_txn.cursor()
+    ufis = affected_ufis(estamap_version, graph, changed_pfis, changed_ufis, chunk_size)
+    logging.info('changed pfis: {}, changed ufis: {}, affected ufis: {}'.format(len(changed_pfis), len(changed_ufis), len(ufis)))
 
-        pfis_at_ufi = set()
-        for enum_ufi, ufi in enumerate(cursor_keys.iternext_nodup(), 1):
-            
-            try:
-                ufi_ftc, ufi_conpfi1, ufi_conpfi2 = road_infrastructure_cursor.get(ufi).split(',')
-            except:
-                print '    ', ufi
-                continue
-
-##            if ufi == '51580977':
-##                print road_infrastructure_cursor.get(ufi)
-##                print ufi_conpfi1, ufi_conpfi2
-            
-            cursor_values.set_key(ufi)
-            
-            pfis_at_ufi.clear()
-            for pfi in cursor_values.iternext_dup():
-                pfis_at_ufi.add(pfi)
-
-            # compute turn angles only if more than one unique road segment at ufi
-            if len(pfis_at_ufi) > 1:
-
-                for from_pfi, to_pfi in itertools.permutations(pfis_at_ufi, 2):
-
-                    # check if valid turn
-##                    if ufi == '51580977':
-##                        print from_pfi, to_pfi
-                    
-                    if ufi_ftc.lower() == 'tunnel':
-                        if from_pfi in (ufi_conpfi1, ufi_conpfi2):
-                            if to_pfi not in (ufi_conpfi1, ufi_conpfi2):
-                                continue
-                        if to_pfi in (ufi_conpfi1, ufi_conpfi2):
-                            if from_pfi not in (ufi_conpfi1, ufi_conpfi2):
-                                continue
-
-                    # check if current ufi is same as from_pfi's from_ufi
-                    if ufi == road_pfis_txn.get(from_pfi).split(',')[0]:
-                        from_bearing = float(road_bearings_txn.get(from_pfi+'ENTRY'))
-                    else:
-                        from_bearing = float(road_bearings_txn.get(from_pfi+'ENTRY_FLIP'))
-
-                    # check if current ufi is same as to_pfi's from_ufi
-                    if ufi == road_pfis_txn.get(to_pfi).split(',')[0]:
-                        to_bearing = float(road_bearings_txn.get(to_pfi+'ENTRY'))
-                    else:
-                        to_bearing = float(road_bearings_txn.get(to_pfi+'ENTRY_FLIP'))
-
-                    angle = from_bearing - to_bearing
-                    if angle < -180:
-                        angle = angle + 360
-                    elif angle > 180:
-                        angle = angle - 360
-
-                    sbc.add_row((ufi, from_pfi, to_pfi, angle, from_bearing, to_bearing))
-
-            if enum_ufi % 10000 == 0:
-                logging.info(enum_ufi)
-                sbc.flush()
-        logging.info(enum_ufi)
+    logging.info('calc turns')
+    nodes = graph.node_index(ufis)
+    turns = road_turns(graph, end_bearings, restrictions, nodes[nodes >= 0])
+    logging.info('turns: {}'.format(len(turns[0])))
+
+    # new turns are staged, then swapped in with the delete in one transaction
+    # so a failed load leaves ROAD_TURN as it was
+    logging.info('creating ROAD_TURN_UPDATE')
+    if dbpy.check_exists('ROAD_TURN_UPDATE', conn):
+        conn.execute('drop table ROAD_TURN_UPDATE')
+    conn.execute('SELECT TOP 0 * INTO ROAD_TURN_UPDATE FROM ROAD_TURN')
+    conn.commit()
+
+    logging.info('insert ROAD_TURN_UPDATE')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_TURN_UPDATE') as sbc:
+        sbc.load_data(zip(*[column.tolist() for column in turns]))
 
     logging.info('count start: {}'.format(sbc.count_start))
     logging.info('count finish: {}'.format(sbc.count_finish))
 
+    logging.info('replace turns at affected ufis')
+    try:
+        for start in xrange(0, len(ufis), chunk_size):
+            conn.execute('DELETE FROM ROAD_TURN WHERE UFI IN ({})'.format(
+                ','.join(str(ufi) for ufi in ufis[start:start + chunk_size])))
+        conn.execute('INSERT INTO ROAD_TURN SELECT * FROM ROAD_TURN_UPDATE')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.execute('drop table ROAD_TURN_UPDATE')
+    conn.commit()
+
 
 if __name__ == '__main__':
 
@@ -198,7 +232,11 @@ if __name__ == '__main__':
 
         logging.info('variables')
         estamap_version = args['--estamap_version']
-        temp_lmdb = args['--temp_lmdb']
+        road_geometry_cache = args['--road_geometry']
+        bearing_offset = float(args['--bearing_offset'])
+        rules = dict((ftc.strip().lower(), road_network.CONNECTOR_ONLY) for ftc in args['--connector_only'].split(',') if ftc.strip())
+        changed_pfis = [int(pfi) for pfi in (args['--changed_pfis'] or '').split(',') if pfi.strip()]
+        changed_ufis = [int(ufi) for ufi in (args['--changed_ufis'] or '').split(',') if ufi.strip()]
         log_file = args['--log_file']
         log_path = args['--log_path']
 
@@ -206,8 +244,11 @@ if __name__ == '__main__':
             logging.info('start')
             try:
 
-                create_road_turn_table(estamap_version)
-                calc_road_turn(estamap_version, temp_lmdb)
+                if changed_pfis or changed_ufis:
+                    update_road_turn(estamap_version, changed_pfis, changed_ufis, road_geometry_cache, bearing_offset, rules)
+                else:
+                    create_road_turn_table(estamap_version)
+                    calc_road_turn(estamap_version, road_geometry_cache, bearing_offset, rules)
 
             except Exception as err:
                 logging.exception('error occured running function.')
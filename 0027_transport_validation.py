@@ -1,11 +1,37 @@
 '''
 Spatial validation of ROAD and ROAD_INFRASTRUCTURE.
 
+Aspatial validation labels the connected components of ROAD (with ROAD_PATCH)
+by union-find over node arrays (road_connectivity) and loads each road PFI to
+ROAD_VALIDATION_NETWORKED or ROAD_VALIDATION_DISCONNECTED.
+
+Roads are networked when connected to any of the starting points (--seeds),
+each resolved to its nearest ROAD_INFRASTRUCTURE node with one KD-tree query
+(nearest_node.NodeIndex).
+
+Patch scenarios label the network without ROAD_PATCH once and apply the
+patches as unions of its components: ROAD_PATCH_SCENARIO has, for each
+ROAD_PATCH, the components it joins and the roads it alone connects to the
+starting node, and the log has the roads connected by all MERGE_TRANSPORT
+patches and by all patches.
+
+Topology validation replaces the geometric network trace in process
+(road_topology): road ends are snapped to ROAD_INFRASTRUCTURE on a 0.01m grid
+and ROAD_TOPOLOGY_VALIDATION / ROAD_INFRASTRUCTURE_TOPOLOGY_VALIDATION get
+the roads and nodes geometrically disconnected from the starting node, or
+whose snapped ends do not match FROM_UFI / TO_UFI. GEOM_FROM_UFI /
+GEOM_TO_UFI are NULL for ends snapped to no ROAD_INFRASTRUCTURE.
+
+ROAD_CRITICAL has the roads (bridges) and ROAD_INFRASTRUCTURE nodes
+(articulation points) of ROAD with ROAD_PATCH whose loss would split their
+component, with the number of nodes each would cut off.
+
 Usage:
   transport_spatial_validation.py [options]
 
 Options:
   --estamap_version <version>  ESTAMap Version
+  --seeds <points>        Semicolon separated x,y (VicGrid) starting points, e.g. one per region. [default: 2497133.064,2409284.931]
   --log_file <file>       Log File name. [default: transport_spatial_validation.log]
   --log_path <folder>     Folder to store the log file. [default: c:\\temp]
 '''
@@ -14,11 +40,12 @@ import sys
 import time
 import logging
 import shutil
+import itertools
 
 from docopt import docopt
 import arcpy
 import lmdb
-import networkx as nx
+import numpy as np
 
 import matplotlib.pyplot as plt
 
@@ -26,6 +53,14 @@ import log
 import dev as gis
 import dbpy
 
+import road_connectivity
+import road_topology
+import nearest_node
+
+
+# VicGrid starting points, the network connected to any of them is valid
+STARTING_POINTS = [(2497133.064, 2409284.931)]
+
 
 def import_road_patch(estamap_version):
 
@@ -47,7 +82,48 @@ def import_road_patch(estamap_version):
     logging.info('ROAD_PATCH count: {}'.format(road_patch_count))
 
 
-def transport_spatial_validation(estamap_version, with_patch=False):
+# ROAD_INFRASTRUCTURE KD-tree per estamap version, built on first use and
+# shared by the steps of one run
+NODE_INDEXES = {}
+
+
+def road_infrastructure_index(estamap_version):
+    if estamap_version not in NODE_INDEXES:
+        NODE_INDEXES[estamap_version] = nearest_node.NodeIndex.from_road_infrastructure(estamap_version)
+    return NODE_INDEXES[estamap_version]
+
+
+def find_starting_nodes(estamap_version, seeds=STARTING_POINTS, index=None):
+
+    if index is None:
+        index = road_infrastructure_index(estamap_version)
+
+    logging.info('finding starting UFIs: {}'.format(len(seeds)))
+    xs, ys = zip(*seeds)
+    ufis, dists = index.nearest(xs, ys)
+    for (x, y), ufi, dist in zip(seeds, ufis.tolist(), dists.tolist()):
+        logging.info('starting UFI: {} ({}, {}), distance: {:.3f}'.format(ufi, x, y, dist))
+    return ufis.tolist()
+
+
+def parse_seeds(seeds):
+    # 'x,y;x,y' -> [(x, y), (x, y)]
+    points = []
+    for seed in seeds.split(';'):
+        if not seed.strip():
+            continue
+        values = seed.split(',')
+        try:
+            x, y = [float(v) for v in values]
+        except ValueError:
+            raise Exception('seed must be x,y (VicGrid): {}'.format(seed.strip()))
+        points.append((x, y))
+    if not points:
+        raise Exception('no seeds: {}'.format(seeds))
+    return points
+
+
+def transport_spatial_validation(estamap_version, with_patch=False, seeds=STARTING_POINTS):
 
     logging.info('environment')
     em = gis.ESTAMAP(estamap_version)
@@ -165,8 +241,9 @@ def transport_spatial_validation(estamap_version, with_patch=False):
                                         spatial_reference=arcpy.SpatialReference(3111))
     with arcpy.da.InsertCursor(in_table=os.path.join(em.path, 'Routing', fgdb_name, 'StartingPoint'),
                                field_names=['SHAPE@']) as ic:
-        pt = arcpy.Point(2497133.064, 2409284.931)
-        ic.insertRow((pt,))
+        for x, y in seeds:
+            pt = arcpy.Point(x, y)
+            ic.insertRow((pt,))
 
 
     logging.info('Tracing Geometric Network...')
@@ -232,6 +309,87 @@ def transport_spatial_validation(estamap_version, with_patch=False):
     arcpy.Delete_management('in_memory\\geonet_trace_output')
 
 
+def transport_topology_validation(estamap_version, with_patch=False, tolerance=road_topology.TOLERANCE, seeds=STARTING_POINTS, index=None):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    starting_nodes = find_starting_nodes(estamap_version, seeds, index)
+
+    topology = road_topology.RoadTopology.from_tables(estamap_version, with_patch, tolerance)
+    geom_networked = topology.connected_roads(starting_nodes)
+    attr_networked = topology.attribute.connected_roads(starting_nodes)
+    from_mismatch = topology.from_mismatch
+    to_mismatch = topology.to_mismatch
+    roads = ~geom_networked | ~attr_networked | from_mismatch | to_mismatch
+    logging.info('unnamed nodes: {}'.format(topology.num_unnamed))
+    logging.info('disconnected roads, geometric: {}, attribute: {}'.format(
+        int(np.count_nonzero(~geom_networked)), int(np.count_nonzero(~attr_networked))))
+    logging.info('mismatched road ends, FROM: {}, TO: {}'.format(
+        int(np.count_nonzero(from_mismatch)), int(np.count_nonzero(to_mismatch))))
+
+    # ROAD_INFRASTRUCTURE geometrically disconnected, or with no road end snapped to it
+    nodes_networked = topology.connected_nodes(starting_nodes)
+    snapped_ends = np.bincount(np.concatenate([topology.from_nodes, topology.to_nodes]),
+                               minlength=len(topology.node_ufis))[:len(topology.node_ufis)]
+    nodes = ~nodes_networked | (snapped_ends == 0)
+    logging.info('disconnected nodes: {}, nodes without road ends: {}'.format(
+        int(np.count_nonzero(~nodes_networked)), int(np.count_nonzero(snapped_ends == 0))))
+
+    logging.info('dropping tables:')
+    for table in ('ROAD_TOPOLOGY_VALIDATION', 'ROAD_INFRASTRUCTURE_TOPOLOGY_VALIDATION'):
+        if dbpy.check_exists(table, conn):
+            logging.info(table)
+            conn.execute('drop table {}'.format(table))
+
+    logging.info('creating ROAD_TOPOLOGY_VALIDATION')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_TOPOLOGY_VALIDATION](
+        [PFI] [int] NOT NULL,
+        [FROM_UFI] [int] NULL,
+        [TO_UFI] [int] NULL,
+        [GEOM_FROM_UFI] [int] NULL,
+        [GEOM_TO_UFI] [int] NULL,
+        [GEOM_COMPONENT] [int] NULL,
+        [GEOM_DISCONNECTED] [bit] NULL,
+        [ATTR_DISCONNECTED] [bit] NULL,
+        [FROM_MISMATCH] [bit] NULL,
+        [TO_MISMATCH] [bit] NULL
+    ) ON [PRIMARY]
+    ''')
+    logging.info('creating ROAD_INFRASTRUCTURE_TOPOLOGY_VALIDATION')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_INFRASTRUCTURE_TOPOLOGY_VALIDATION](
+        [UFI] [int] NOT NULL,
+        [GEOM_COMPONENT] [int] NULL,
+        [GEOM_DISCONNECTED] [bit] NULL,
+        [SNAPPED_ENDS] [int] NULL
+    ) ON [PRIMARY]
+    ''')
+    conn.commit()
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_TOPOLOGY_VALIDATION') as sbc:
+        sbc.load_data(itertools.izip(topology.pfis[roads].tolist(),
+                                     np.where(topology.from_null, None, topology.from_ufis)[roads].tolist(),
+                                     np.where(topology.to_null, None, topology.to_ufis)[roads].tolist(),
+                                     np.where(topology.geom_from_ufis < 0, None, topology.geom_from_ufis)[roads].tolist(),
+                                     np.where(topology.geom_to_ufis < 0, None, topology.geom_to_ufis)[roads].tolist(),
+                                     topology.road_components[roads].tolist(),
+                                     (~geom_networked[roads]).tolist(), (~attr_networked[roads]).tolist(),
+                                     from_mismatch[roads].tolist(), to_mismatch[roads].tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_INFRASTRUCTURE_TOPOLOGY_VALIDATION') as sbc:
+        sbc.load_data(itertools.izip(topology.node_ufis[nodes].tolist(),
+                                     topology.node_components[:len(topology.node_ufis)][nodes].tolist(),
+                                     (~nodes_networked[nodes]).tolist(),
+                                     snapped_ends[nodes].tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+
 def import_transport_disconnected(estamap_version):
 
     logging.info('environment')
@@ -258,17 +416,12 @@ def import_transport_disconnected(estamap_version):
         logging.info('ROAD_INFRASTRUCTURE disconnected count: {}'.format(road_infrastructure_disconnected_count))
 
 
-def transport_aspatial_validation(estamap_version):
+def transport_aspatial_validation(estamap_version, seeds=STARTING_POINTS, index=None):
 
     logging.info('environment')
     em = gis.ESTAMAP(estamap_version)
 
-
-    logging.info('finding starting UFI')
-    cursor = em.conn.cursor()
-    starting_node = cursor.execute("select TOP 1 UFI from ROAD_INFRASTRUCTURE order by shape.STDistance(geometry::STGeomFromText('POINT (2497133.064  2409284.931)', 3111))").fetchval()
-    #2313747
-    logging.info('starting UFI: {}'.format(starting_node))
+    starting_nodes = find_starting_nodes(estamap_version, seeds, index)
     
 
     logging.info('create table: ROAD_VALIDATION_DISCONNECTED')
@@ -282,76 +435,134 @@ def transport_aspatial_validation(estamap_version):
     logging.info('running sql script: {}'.format(sql_script))
     dbpy.exec_script(em.server, em.database_name, sql_script)
 
-    logging.info('creating graph')
-    graph = nx.Graph()
+    logging.info('labelling components')
+    connectivity = road_connectivity.RoadConnectivity.from_tables(estamap_version)
+    networked = connectivity.connected_roads(starting_nodes)
+    logging.info('components: {}, networked roads: {}, disconnected roads: {}'.format(
+        len(connectivity), int(np.count_nonzero(networked)), int(np.count_nonzero(~networked))))
 
-    logging.info('loading nodes')
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
-                               field_names=['UFI',]) as sc:
-        for enum, ufi in enumerate(sc):
-            graph.add_node(ufi)
-            if enum % 10000 == 0:
-                logging.info(enum)
-        logging.info(enum)
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_VALIDATION_NETWORKED') as sbc_networked, \
+         dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_VALIDATION_DISCONNECTED') as sbc_disconnected:
 
-    logging.info('loading edges')
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
-                               field_names=['PFI', 'FROM_UFI', 'TO_UFI']) as sc:
-        for enum, (pfi, from_ufi, to_ufi) in enumerate(sc):
-            graph.add_edge(int(from_ufi), int(to_ufi))
-            # add PFI to the edge
-            graph[int(from_ufi)][int(to_ufi)][int(pfi)] = True
-            if enum % 10000 == 0:
+        logging.info('loading roads...')
+        for enum, (pfi, is_networked) in enumerate(itertools.izip(connectivity.pfis.tolist(), networked.tolist()), 1):
+            if is_networked:
+                # CONNECTED to starting node
+                sbc_networked.add_row((pfi,))
+            else:
+                # DISCONNECTED to starting node
+                sbc_disconnected.add_row((pfi,))
+            if enum % 100000 == 0:
+                sbc_networked.flush()
+                sbc_disconnected.flush()
                 logging.info(enum)
         logging.info(enum)
-    
-    logging.info('appending patch')
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_PATCH'),
-                               field_names=['FROM_UFI', 'TO_UFI'],
-                               where_clause='MERGE_TRANSPORT = 1') as sc:
-        for enum, (from_ufi, to_ufi) in enumerate(sc):
-            graph.add_edge(int(from_ufi), int(to_ufi))
-            # add PFI as -1 to the edge
-            graph[int(from_ufi)][int(to_ufi)][-1] = True
-        logging.info(enum)
 
-    logging.info('finding connected')
-    connected_nodes = nx.node_connected_component(graph, starting_node)
-    graph_connected = graph.subgraph(connected_nodes)
 
-    logging.info('finding disconnected')
-    graph_disconnected = graph.fresh_copy()
-    graph_disconnected.remove_nodes_from(connected_nodes)
-    
-    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_VALIDATION_NETWORKED') as sbc_networked, \
-         dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_VALIDATION_DISCONNECTED') as sbc_disconnected:
+def transport_patch_scenarios(estamap_version, seeds=STARTING_POINTS, index=None):
 
-        logging.info('looping network components...')
-        edges_loaded = 0
-        for enum_component, subnodes in enumerate(nx.connected_components(graph)):
-            subgraph = graph.subgraph(subnodes)
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
 
-            if starting_node in subgraph:
-                # CONNECTED to starting node
-                for u, v, d in subgraph.edges(data=True):
-                    for enum, pfi in enumerate(d.keys()):
-                        sbc_networked.add_row((pfi,))
-
-                        edges_loaded = edges_loaded + 1
-                        if edges_loaded % 10000 == 0:
-                            sbc_networked.flush()
-                            logging.info(edges_loaded)
-            else:
-                # DISCONNECTED to starting node
-                for u, v, d in subgraph.edges(data=True):
-                    for pfi in d.keys():
-                        sbc_disconnected.add_row((pfi,))
+    starting_nodes = find_starting_nodes(estamap_version, seeds, index)
+
+    logging.info('labelling base components (without ROAD_PATCH)')
+    connectivity = road_connectivity.RoadConnectivity.from_tables(estamap_version, with_patch=False)
+    component_roads = connectivity.component_roads
+    networked = np.zeros(len(connectivity), dtype=bool)
+    networked[connectivity.seed_components(starting_nodes)] = True
+    logging.info('components: {}, networked roads: {}'.format(len(connectivity), int(component_roads[networked].sum())))
+
+    logging.info('reading ROAD_PATCH')
+    patches = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD_PATCH'),
+                                         field_names=['OID@', 'FROM_UFI', 'TO_UFI', 'MERGE_TRANSPORT'],
+                                         null_value={'MERGE_TRANSPORT': 0, 'FROM_UFI': -1, 'TO_UFI': -1})
+    from_components, to_components = connectivity.patch_components(patches['FROM_UFI'], patches['TO_UFI'])
+
+    # each patch on its own: roads of the component it brings to the starting node
+    known = (from_components >= 0) & (to_components >= 0)
+    from_networked = known & networked[from_components]
+    to_networked = known & networked[to_components]
+    from_roads = np.where(known, component_roads[from_components], 0)
+    to_roads = np.where(known, component_roads[to_components], 0)
+    roads_connected = np.where(from_networked & ~to_networked, to_roads,
+                               np.where(to_networked & ~from_networked, from_roads, 0))
+    logging.info('patches: {}, joining components: {}, connecting to starting node: {}'.format(
+        len(patches), int(np.count_nonzero(known & (from_components != to_components))),
+        int(np.count_nonzero(roads_connected))))
+
+    for desc, selected in (('MERGE_TRANSPORT', patches['MERGE_TRANSPORT'] == 1),
+                           ('ALL', np.ones(len(patches), dtype=bool))):
+        scenario = road_connectivity.PatchScenario(connectivity, from_components[selected], to_components[selected])
+        logging.info('{} patches: {}, components joined: {}, roads connected: {}'.format(
+            desc, int(np.count_nonzero(selected)), len(scenario.joined()),
+            int(np.count_nonzero(scenario.newly_connected_roads(starting_nodes)))))
+
+    if dbpy.check_exists('ROAD_PATCH_SCENARIO', conn):
+        logging.info('dropping table: ROAD_PATCH_SCENARIO')
+        conn.execute('drop table ROAD_PATCH_SCENARIO')
+
+    logging.info('creating ROAD_PATCH_SCENARIO')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_PATCH_SCENARIO](
+        [PATCH_OID] [int] NOT NULL,
+        [MERGE_TRANSPORT] [int] NULL,
+        [FROM_UFI] [int] NULL,
+        [TO_UFI] [int] NULL,
+        [FROM_COMPONENT] [int] NULL,
+        [TO_COMPONENT] [int] NULL,
+        [FROM_COMPONENT_ROADS] [int] NULL,
+        [TO_COMPONENT_ROADS] [int] NULL,
+        [ROADS_CONNECTED] [int] NULL
+    ) ON [PRIMARY]
+    ''')
+    conn.commit()
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_PATCH_SCENARIO') as sbc:
+        sbc.load_data(itertools.izip(patches['OID@'].tolist(), patches['MERGE_TRANSPORT'].tolist(),
+                                     patches['FROM_UFI'].tolist(), patches['TO_UFI'].tolist(),
+                                     from_components.tolist(), to_components.tolist(),
+                                     from_roads.tolist(), to_roads.tolist(),
+                                     roads_connected.tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+
+def transport_critical_elements(estamap_version):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    connectivity = road_connectivity.RoadConnectivity.from_tables(estamap_version, with_patch=True)
 
-                        edges_loaded = edges_loaded + 1
-                        if edges_loaded % 10000 == 0:
-                            sbc_disconnected.flush()
-                            logging.info(edges_loaded)
-        logging.info(edges_loaded)
+    logging.info('finding bridges and articulation points')
+    (pfis, road_cut, road_component), (ufis, node_cut, node_component) = connectivity.critical()
+    logging.info('critical roads: {}, critical nodes: {}'.format(len(pfis), len(ufis)))
+
+    if dbpy.check_exists('ROAD_CRITICAL', conn):
+        logging.info('dropping table: ROAD_CRITICAL')
+        conn.execute('drop table ROAD_CRITICAL')
+
+    logging.info('creating ROAD_CRITICAL')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_CRITICAL](
+        [ELEMENT_TYPE] [nvarchar](4) NOT NULL,
+        [ELEMENT_ID] [int] NOT NULL,
+        [COMPONENT_NODES] [int] NULL,
+        [CUT_OFF_NODES] [int] NULL
+    ) ON [PRIMARY]
+    ''')
+    conn.commit()
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_CRITICAL') as sbc:
+        sbc.load_data(itertools.izip(itertools.repeat('ROAD'), pfis.tolist(),
+                                     road_component.tolist(), road_cut.tolist()))
+        sbc.load_data(itertools.izip(itertools.repeat('NODE'), ufis.tolist(),
+                                     node_component.tolist(), node_cut.tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
 
 
 def export_transport_validated(estamap_version):
@@ -429,6 +640,7 @@ if __name__ == '__main__':
 
         logging.info('variables')
         estamap_version = args['--estamap_version']
+        seeds = parse_seeds(args['--seeds'])
         log_file = args['--log_file']
         log_path = args['--log_path']
 
@@ -440,16 +652,25 @@ if __name__ == '__main__':
 ##                import_road_patch(estamap_version)
 ##
 ##                # initial validation
-##                transport_spatial_validation(estamap_version, with_patch=False)
+##                transport_spatial_validation(estamap_version, with_patch=False, seeds=seeds)
 ##
 ##                # validate with road patches applied
-##                transport_spatial_validation(estamap_version, with_patch=True)
+##                transport_spatial_validation(estamap_version, with_patch=True, seeds=seeds)
+##
+##                # in process topology validation (no geometric network)
+##                transport_topology_validation(estamap_version, with_patch=True, seeds=seeds)
 ##
 ##                # import disconnected
 ##                import_transport_disconnected(estamap_version)
 ##               
 ##                # aspatial validation
-##                transport_aspatial_validation(estamap_version)
+##                transport_aspatial_validation(estamap_version, seeds=seeds)
+##
+##                # patch scenarios
+##                transport_patch_scenarios(estamap_version, seeds=seeds)
+##
+##                # bridges and articulation points
+##                transport_critical_elements(estamap_version)
 ##
                 # export validated road and road_infra layers
                 export_transport_validated(estamap_version)
@@ -6,98 +6,27 @@ Usage:
 
 Options:
   --estamap_version <version>  ESTAMap Version
+  --mode <mode>           spatial or network (validated addresses take the nearer end of their road). [default: network]
   --log_file <file>       Log File name. [default: calc_address_roadinfra.log]
   --log_path <folder>     Folder to store the log file. [default: c:\\temp]
 '''
-import os
 import sys
 import logging
 
 from docopt import docopt
-import arcpy
-import rtree
 
 import log
-import dev as gis
-import dbpy
+import nearest_node
+import address_validation_engine as ave
 
 
-def calc_address_roadinfra(estamap_version):
-    logging.info('environment')
-    em = gis.ESTAMAP(estamap_version)
-    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+def calc_address_roadinfra(estamap_version, mode='network', index=None, endpoints=None):
 
-    logging.info('dropping tables:')
-    if dbpy.check_exists('ADDRESS_ROADINFRA', conn):
-        logging.info('ADDRESS_ROADINFRA')
-        conn.execute('drop table ADDRESS_ROADINFRA')
-    
-
-    logging.info('creating ADDRESS_ROADINFRA')
-    conn.execute('''
-    CREATE TABLE [dbo].[ADDRESS_ROADINFRA](
-        [PFI] [nvarchar](10) NOT NULL,
-        [UFI] [int] NULL
-    ) ON [PRIMARY]
-    ''')
-    conn.commit()
-
-    logging.info('reading ADDRESS FIDs')
-    address_fids = {}
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ADDRESS'),
-                               field_names=['PFI', 'OBJECTID']) as sc:
-        for pfi, oid in sc:
-            address_fids[oid] = pfi
-
-    logging.info('reading ROAD_INFRASTRUCTURE FIDs')
-    roadinfra_fids = {}
-    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
-                               field_names=['UFI', 'OBJECTID']) as sc:
-        for ufi, oid in sc:
-            roadinfra_fids[oid] = ufi
-
-    logging.info('Generate Near Table analysis...')
-    arcpy.GenerateNearTable_analysis(in_features=os.path.join(em.sde, 'ADDRESS'),
-                                     near_features=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
-                                     out_table='in_memory\\near_table')
-
-    logging.info('inserting')
-    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'ADDRESS_ROADINFRA') as sbc, \
-         arcpy.da.SearchCursor(in_table='in_memory\\near_table',
-                               field_names=['IN_FID', 'NEAR_FID']) as sc:
-        for enum, (address_fid, roadinfra_fid) in enumerate(sc):
-            sbc.add_row((address_fids[address_fid], roadinfra_fids[roadinfra_fid]))
-            if enum % 100000 == 0:
-                logging.info(enum)
-                sbc.flush()
-        logging.info(enum)
-        
-
-##    logging.info('creating rtree ROAD_INFRASTRUCTURE')
-##    def bulk_load_roadinfra():
-##        with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
-##                                   field_names=['UFI', 'SHAPE@X', 'SHAPE@Y']) as sc:
-##            for enum, (ufi, x, y) in enumerate(sc):
-##                if enum % 100000 == 0:
-##                    logging.info(enum)
-##                yield (int(ufi), (x, y, x, y), None)
-##            logging.info(enum)
-##            
-##    ri_rtree = rtree.Rtree(bulk_load_roadinfra())
-##
-##    logging.info('looping ADDRESS')
-##    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'ADDRESS_ROADINFRA') as sbc, \
-##         arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ADDRESS'),
-##                               field_names=['PFI', 'SHAPE@X', 'SHAPE@Y']) as sc:
-##        for enum, (pfi, x, y) in enumerate(sc):
-##            ufi = list(ri_rtree.nearest((x, y, x, y)))[0]
-##
-##            sbc.add_row((pfi, ufi))
-##            
-##            if enum % 100000 == 0:
-##                logging.info(enum)
-##                sbc.flush()
-##        logging.info(enum)
+    if index is None:
+        index = nearest_node.NodeIndex.from_road_infrastructure(estamap_version)
+    if endpoints is None and mode == 'network':
+        endpoints = nearest_node.RoadEndpoints(estamap_version)
+    nearest_node.calc_nearest_roadinfra(estamap_version, ave.VICMAP, index, endpoints=endpoints)
 
 
 if __name__ == '__main__':
@@ -111,6 +40,7 @@ if __name__ == '__main__':
 
         logging.info('variables')
         estamap_version = args['--estamap_version']
+        mode = args['--mode']
         log_file = args['--log_file']
         log_path = args['--log_path']
 
@@ -119,7 +49,7 @@ if __name__ == '__main__':
             try:
                 ###########
 
-                calc_address_roadinfra(estamap_version)
+                calc_address_roadinfra(estamap_version, mode)
                 
             
 
@@ -0,0 +1,1472 @@
+'''
+Address validation engine shared by ADDRESS (VicMap) and ADDRESS_GNAF (GNAF).
+
+Each address source is described by an AddressSource (table names, key column,
+number columns and exclusion rules). The road side tables ROAD_INFRA_LINK and
+ROAD_ALIAS_NEAR are created once (create_road_reference) and only read by
+phase 2, so sources never race on them. The ROAD_XSTREET cross street names
+used by road flip are loaded once (load_road_reference) and shared by all
+sources, which are then validated concurrently.
+
+Usage:
+  address_validation_engine.py [options]
+
+Options:
+  --estamap_version <version>  ESTAMap Version
+  --sources <sources>     Comma separated address sources. [default: VICMAP,GNAF]
+  --log_file <file>       Log File name. [default: address_validation_engine.log]
+  --log_path <folder>     Folder to store the log file. [default: c:\\temp]
+'''
+import os
+import sys
+import logging
+import shutil
+import multiprocessing.pool
+
+from docopt import docopt
+import pandas as pd
+import lmdb
+
+import log
+import dev as gis
+import dbpy
+
+
+class AddressSource(object):
+
+    def __init__(self,
+                 name,
+                 address_table,
+                 key_column,
+                 pfi_length,
+                 road_suffix,
+                 number_first,
+                 number_last,
+                 address_filter,
+                 manual_exclusions,
+                 exclusion_rules,
+                 validation_sql,
+                 duplicate_overrides,
+                 road_ranging_patch,
+                 register_sql,
+                 components_sql):
+        self.name = name
+        self.address_table = address_table
+        self.key_column = key_column
+        self.pfi_length = pfi_length
+        self.number_first = number_first
+        self.number_last = number_last
+        self.address_filter = address_filter
+        self.manual_exclusions = manual_exclusions
+        self.exclusion_rules = exclusion_rules
+        self.validation_sql = validation_sql
+        self.duplicate_overrides = duplicate_overrides
+        self.road_ranging_patch = road_ranging_patch
+        self.register_sql = register_sql
+        self.components_sql = components_sql
+
+        # address side tables
+        self.exclusion_table = address_table + '_EXCLUSION'
+        self.validation_table = address_table + '_VALIDATION'
+        self.road_validation_table = address_table + '_ROAD_VALIDATION'
+        self.rnid_table = address_table + '_RNID'
+        self.detail_table = address_table + '_DETAIL'
+        self.components_table = address_table + '_COMPONENTS'
+        self.duplicate_override_table = address_table + '_DUPLICATE_OVERRIDE'
+        self.validated_final_table = address_table + '_VALIDATED_FINAL'
+        self.roadinfra_table = address_table + '_ROADINFRA'
+
+        # road side tables
+        self.road_range_left_table = 'ROAD_RANGE_LEFT' + road_suffix
+        self.road_range_right_table = 'ROAD_RANGE_RIGHT' + road_suffix
+        self.road_ranging_table = 'ROAD_RANGING' + road_suffix
+        self.road_range_near_table = 'ROAD_RANGE_NEAR' + road_suffix
+        self.road_range_near_group_table = 'ROAD_RANGE_NEAR' + road_suffix + '_GROUP'
+        self.road_flip_validation_table = 'ROAD_FLIP_VALIDATION_' + name
+
+    def duplicate_resolution_table(self, phase):
+        return '{}_DUPLICATE_RESOLUTION_PHASE_{}'.format(self.address_table, phase)
+
+    def validated_table(self, phase):
+        return '{}_VALIDATED_PHASE_{}'.format(self.address_table, phase)
+
+    def road_ranging_phase_table(self, phase):
+        if phase is None:
+            return self.road_ranging_table
+        return '{}_PHASE_{}'.format(self.road_ranging_table, phase)
+
+
+VICMAP = AddressSource(
+    name='VICMAP',
+    address_table='ADDRESS',
+    key_column='PFI',
+    pfi_length=10,
+    road_suffix='',
+    number_first='HOUSE_NUMBER_1',
+    number_last='HOUSE_NUMBER_2',
+    address_filter='',
+    manual_exclusions=[
+        # from sql script: 300_AddressDuplicationPatches.sql
+        (220274547, 'REFERENCE', 'INC 38353'),
+    ],
+    exclusion_rules=[
+        ('CLASS_M', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT PFI, 'CLASS_M', 'ADDRESS CLASS IS M'
+        FROM ADDRESS
+        WHERE ADDRESS_CLASS = 'M'
+        '''),
+        ('AR_L50', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT ADDR_PFI, 'AR_L50', 'ADDRESS ROAD SCORE IS LESS THAN 50'
+        FROM ADDRESS_ROAD_VALIDATION
+        WHERE RULE_SCORE < 50
+        '''),
+        ('NO_NUM', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT PFI, 'NO_NUM', 'ADDRESS CLASS S HAS NO NUM'
+        FROM ADDRESS
+        WHERE HOUSE_NUMBER_1 IS NULL and ADDRESS_CLASS = 'S'
+        '''),
+        ('NO_PROPPFI', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT A.PFI, 'NO_PROPPFI', 'ADDRESS HAS NO MATCHING PROPERTY PFI'
+        FROM ADDRESS A
+        LEFT JOIN PROPERTY P
+        ON A.PROPERTY_PFI = P.PFI
+        WHERE P.VIEW_PFI IS NULL
+        '''),
+        ('PREFIX_NOT_NUM', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT PFI, 'PREFIX_NOT_NUM', 'HOUSE_PREFIX_1 IS NOT A NUMBER'
+        FROM ADDRESS
+        WHERE ISNUMERIC(HOUSE_PREFIX_1)=1
+        '''),
+        ('PAPER_ROAD_ONLY', '''
+        INSERT INTO ADDRESS_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT PFI, 'PAPER', 'ADDRESS FEATURE_QUALITY IS PAPER_ROAD_ONLY'
+        FROM ADDRESS
+        WHERE FEATURE_QUALITY_ID = 'PAPER_ROAD_ONLY'
+        '''),
+    ],
+    validation_sql='''
+    SELECT
+        A.PFI,
+        A.HOUSE_PREFIX_1,
+        A.HOUSE_NUMBER_1,
+        A.HOUSE_SUFFIX_1,
+        A.HOUSE_PREFIX_2,
+        A.HOUSE_NUMBER_2,
+        A.HOUSE_SUFFIX_2,
+        ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_1,'') as ST_NUM,
+        ISNULL(A.HOUSE_PREFIX_2,'') + CAST(A.HOUSE_NUMBER_2 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_2,'') as HI_NUM,
+        RN.ROAD_NAME,
+        RN.ROAD_TYPE,
+        RN.ROAD_SUFFIX,
+        A.LOCALITY_NAME,
+        ISNULL(A.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_1,'') as ADDRESS_STRING,
+
+        I.ROAD_NAME_ID,
+        A.IS_PRIMARY,
+        P.STATUS,
+        CAST(ISNULL(CAST(A.BLG_UNIT_ID_1 AS VARCHAR)+ ISNULL(CAST(A.BLG_UNIT_SUFFIX_1 AS VARCHAR),''), A.FLOOR_NO_1) AS VARCHAR(5)) as LV_APT,
+        PV.GRAPHIC_TYPE,
+        AVR.RULE_SCORE,
+        AVR.DIST_FROM_ROAD,
+        AVR.ROAD_PFI,
+        A.SHAPE
+
+    INTO ADDRESS_VALIDATION
+
+    FROM ADDRESS A
+
+    -- exclusions
+    LEFT JOIN ADDRESS_EXCLUSION B
+        ON A.PFI = B.PFI
+
+    -- ROAD_NAME_ID
+    LEFT JOIN ADDRESS_RNID I
+        ON A.PFI = I.PFI
+    LEFT JOIN ROAD_NAME_REGISTER RN
+        ON I.ROAD_NAME_ID = RN.ROAD_NAME_ID
+
+    -- PROPERTY GRAPHIC_TYPE
+    LEFT JOIN PROPERTY P
+        ON A.PROPERTY_PFI = P.PFI
+    LEFT JOIN PROPERTY_VIEW PV
+        ON P.VIEW_PFI = PV.PFI
+
+    -- ADDRESS_ROAD_VALIDATION RULE_SCORE
+    LEFT JOIN ADDRESS_ROAD_VALIDATION AVR
+        ON A.PFI = AVR.ADDR_PFI
+
+    WHERE B.PFI IS NULL
+    ''',
+    duplicate_overrides=[
+        ('BOX HILL_WHITEHORSE_RD__1022', 209400237, 'INC 36280'),
+        ('SOUTH YARRA_CHAPEL_ST__531', 214010233, 'INC 40689'),
+        ('BANDIANA_ANZAC_PDE__4227', 53613752, 'SPPT'),
+        ('FRANKSTON NORTH_MORNINGTON PENINSULA_FWY__1', 54663219, 'ITSM 51761 and ITSM 52972'),
+        ('BRIGHTON_KINANE_ST__18', 53008005, 'ITSM 59220'),
+        ('NUMURKAH_KATAMATITE-NATHALIA_RD__2', 126476619, 'HOSPITAL'),
+        ('LANGWARRIN_MCCLELLAND_DR__80', 51764311, 'REF0024886'),
+    ],
+    road_ranging_patch=True,
+    register_sql='''
+    INSERT INTO DBO.ADDRESS_MSLINK_REGISTER (CAD_STRING, SOURCE_DATASET, SOURCE_PK)
+    SELECT
+        ISNULL(A.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_1,'') + '_' as ADDRESS_STRING,
+        'VICMAP_{em.vicmap_version}.ADDRESS',
+        A.PFI
+    FROM ADDRESS A
+    INNER JOIN ADDRESS_VALIDATED_FINAL V
+    ON A.PFI = V.PFI
+    LEFT JOIN ADDRESS_RNID AI
+    ON A.PFI = AI.PFI
+    LEFT JOIN ROAD_NAME_REGISTER RN
+    ON AI.ROAD_NAME_ID = RN.ROAD_NAME_ID
+    WHERE
+        ISNULL(A.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_1,'') + '_'
+        NOT IN (SELECT CAD_STRING FROM ADDRESS_MSLINK_REGISTER)
+    ''',
+    components_sql='''
+    SELECT
+        A.PFI,
+
+        -- LV_APT
+        A.BLG_UNIT_ID_1,
+        A.BLG_UNIT_SUFFIX_1,
+        A.FLOOR_NO_1,
+        CAST(ISNULL(CAST(A.BLG_UNIT_ID_1 AS VARCHAR)+ ISNULL(CAST(A.BLG_UNIT_SUFFIX_1 AS VARCHAR),''), A.FLOOR_NO_1) AS VARCHAR(5)) AS LV_APT,
+
+        -- ST_NUM
+        A.HOUSE_PREFIX_1,
+        A.HOUSE_NUMBER_1,
+        A.HOUSE_SUFFIX_1,
+        ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(A.HOUSE_SUFFIX_1,'') AS ST_NUM,
+
+        -- HI_NUM
+        A.HOUSE_PREFIX_2,
+        A.HOUSE_NUMBER_2,
+        A.HOUSE_SUFFIX_2,
+        ISNULL(A.HOUSE_PREFIX_2,'') + CAST(A.HOUSE_NUMBER_2 AS VARCHAR(11)) + ISNULL(HOUSE_SUFFIX_2,'') as HI_NUM,
+
+        -- ADDRESS_STRING
+        RN.ROAD_NAME,
+        RN.ROAD_TYPE,
+        RN.ROAD_SUFFIX,
+        AD.LOCALITY_NAME,
+        ISNULL(AD.LOCALITY_NAME,'') + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +
+            ISNULL(A.HOUSE_PREFIX_1,'') + CAST(A.HOUSE_NUMBER_1 AS VARCHAR(11)) + ISNULL(A.HOUSE_SUFFIX_1,'') + '_' AS ADDRESS_STRING
+    FROM ADDRESS A
+    LEFT JOIN ADDRESS_RNID AI
+    ON A.PFI = AI.PFI
+    LEFT JOIN ROAD_NAME_REGISTER RN
+    ON AI.ROAD_NAME_ID = RN.ROAD_NAME_ID
+    LEFT JOIN ADDRESS_DETAIL AD
+    ON A.PFI = AD.PFI
+    ''')
+
+
+GNAF = AddressSource(
+    name='GNAF',
+    address_table='ADDRESS_GNAF',
+    key_column='ADDRESS_DETAIL_PID',
+    pfi_length=15,
+    road_suffix='_GNAF',
+    number_first='NUMBER_FIRST',
+    number_last='NUMBER_LAST',
+    address_filter="A.GEOCODE_SOURCE = 'ADDRESS'",
+    manual_exclusions=[],
+    exclusion_rules=[
+        ('AR_L50', '''
+        INSERT INTO ADDRESS_GNAF_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT ADDR_PFI, 'AR_L50', 'ADDRESS ROAD SCORE IS LESS THAN 50'
+        FROM ADDRESS_GNAF_ROAD_VALIDATION
+        WHERE RULE_SCORE < 50
+        '''),
+        ('NO_NUM', '''
+        INSERT INTO ADDRESS_GNAF_EXCLUSION (PFI, RULE_CODE, RULE_DESC)
+        SELECT ADDRESS_DETAIL_PID, 'NO_NUM', 'ADDRESS CLASS S HAS NO NUM'
+        FROM ADDRESS_GNAF
+        WHERE NUMBER_FIRST IS NULL
+        '''),
+    ],
+    validation_sql='''
+    SELECT
+        A.ADDRESS_DETAIL_PID AS PFI,
+        A.NUMBER_FIRST_PREFIX AS HOUSE_PREFIX_1,
+        A.NUMBER_FIRST AS HOUSE_NUMBER_1,
+        A.NUMBER_FIRST_SUFFIX AS HOUSE_SUFFIX_1,
+        A.NUMBER_LAST_PREFIX AS HOUSE_PREFIX_2,
+        A.NUMBER_LAST AS HOUSE_NUMBER_2,
+        A.NUMBER_LAST_SUFFIX AS HOUSE_SUFFIX_2,
+        ISNULL(A.NUMBER_FIRST_PREFIX,'') + CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(A.NUMBER_FIRST_SUFFIX,'') as ST_NUM,
+        ISNULL(A.NUMBER_LAST_PREFIX,'') + CAST(A.NUMBER_LAST AS VARCHAR(11)) + ISNULL(A.NUMBER_LAST_SUFFIX,'') as HI_NUM,
+        RN.ROAD_NAME,
+        RN.ROAD_TYPE,
+        RN.ROAD_SUFFIX,
+        AD.LOCALITY_NAME,
+        ISNULL(AD.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(NUMBER_FIRST_SUFFIX,'') + '_' AS ADDRESS_STRING,
+
+        I.ROAD_NAME_ID,
+        CASE
+            WHEN A.GEOCODE_SOURCE = 'ADDRESS'
+            THEN 'Y'
+            ELSE 'N'
+        END AS IS_PRIMARY,
+        CAST('A' AS NVARCHAR(1)) AS STATUS,
+        CAST(ISNULL(CAST(A.FLAT_NUMBER AS VARCHAR)+ ISNULL(CAST(A.FLAT_NUMBER_SUFFIX AS VARCHAR),''), A.LEVEL_NUMBER) AS VARCHAR(5)) AS LV_APT,
+        CAST('B' AS NVARCHAR(1)) AS GRAPHIC_TYPE,
+        AVR.RULE_SCORE,
+        AVR.DIST_FROM_ROAD,
+        AVR.ROAD_PFI,
+        A.GEOG AS SHAPE
+
+    INTO ADDRESS_GNAF_VALIDATION
+
+    FROM ADDRESS_GNAF A
+
+    -- exclusions
+    LEFT JOIN ADDRESS_GNAF_EXCLUSION B
+        ON A.ADDRESS_DETAIL_PID = B.PFI
+
+    -- locality
+    LEFT JOIN ADDRESS_GNAF_DETAIL AD
+        ON A.ADDRESS_DETAIL_PID = AD.ADDRESS_DETAIL_PID
+
+    -- ROAD_NAME_ID
+    LEFT JOIN ADDRESS_GNAF_RNID I
+        ON A.ADDRESS_DETAIL_PID = I.ADDRESS_DETAIL_PID
+    LEFT JOIN ROAD_NAME_REGISTER RN
+        ON I.ROAD_NAME_ID = RN.ROAD_NAME_ID
+
+    -- ADDRESS_ROAD_VALIDATION RULE_SCORE
+    LEFT JOIN ADDRESS_GNAF_ROAD_VALIDATION AVR
+        ON A.ADDRESS_DETAIL_PID = AVR.ADDR_PFI
+
+    WHERE B.PFI IS NULL
+    ''',
+    duplicate_overrides=[],
+    road_ranging_patch=False,
+    register_sql='''
+    INSERT INTO DBO.ADDRESS_MSLINK_REGISTER (CAD_STRING, SOURCE_DATASET, SOURCE_PK)
+    SELECT
+        ISNULL(AD.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(NUMBER_FIRST_SUFFIX,'') + '_' AS ADDRESS_STRING,
+        'GNAF_{em.gnaf_version}.ADDRESS_GNAF',
+        A.ADDRESS_DETAIL_PID
+    FROM ADDRESS_GNAF A
+    INNER JOIN ADDRESS_GNAF_VALIDATED_FINAL V
+    ON A.ADDRESS_DETAIL_PID = V.PFI
+    LEFT JOIN ADDRESS_GNAF_DETAIL AD
+    ON A.ADDRESS_DETAIL_PID = AD.ADDRESS_DETAIL_PID
+    LEFT JOIN ADDRESS_GNAF_RNID AI
+    ON A.ADDRESS_DETAIL_PID = AI.ADDRESS_DETAIL_PID
+    LEFT JOIN ROAD_NAME_REGISTER RN
+    ON AI.ROAD_NAME_ID = RN.ROAD_NAME_ID
+
+    LEFT JOIN ADDRESS_MSLINK_REGISTER AMR
+    ON AMR.CAD_STRING = ISNULL(AD.LOCALITY_NAME,'')  + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +  CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(NUMBER_FIRST_SUFFIX,'') + '_'
+
+    WHERE AMR.MSLINK IS NULL
+    ''',
+    components_sql='''
+    SELECT
+        A.ADDRESS_DETAIL_PID AS PFI,
+
+        -- LV_APT
+        A.FLAT_NUMBER AS BLG_UNIT_ID_1,
+        A.FLAT_NUMBER_SUFFIX AS BLG_UNIT_SUFFIX_1,
+        A.LEVEL_NUMBER AS FLOOR_NO_1,
+        CAST(ISNULL(CAST(A.FLAT_NUMBER AS VARCHAR)+ ISNULL(CAST(A.FLAT_NUMBER_SUFFIX AS VARCHAR),''), A.LEVEL_NUMBER) AS VARCHAR(5)) AS LV_APT,
+
+        -- ST_NUM
+        NULL AS HOUSE_PREFIX_1,
+        A.NUMBER_FIRST AS HOUSE_NUMBER_1,
+        A.NUMBER_FIRST_SUFFIX AS HOUSE_SUFFIX_1,
+        CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(A.NUMBER_FIRST_SUFFIX,'') AS ST_NUM,
+
+        -- HI_NUM
+        A.NUMBER_LAST_PREFIX AS HOUSE_PREFIX_2,
+        A.NUMBER_LAST AS HOUSE_NUMBER_2,
+        A.NUMBER_LAST_SUFFIX AS HOUSE_SUFFIX_2,
+        ISNULL(A.NUMBER_LAST_PREFIX,'') + CAST(A.NUMBER_LAST AS VARCHAR(11)) + ISNULL(A.NUMBER_LAST_SUFFIX,'') as HI_NUM,
+
+        -- ADDRESS_STRING
+        RN.ROAD_NAME,
+        RN.ROAD_TYPE,
+        RN.ROAD_SUFFIX,
+        AD.LOCALITY_NAME,
+        ISNULL(AD.LOCALITY_NAME,'') + '_' + ISNULL(RN.ROAD_NAME,'') + '_' + ISNULL(RN.ROAD_TYPE,'') + '_' + ISNULL(RN.ROAD_SUFFIX,'') + '_' +
+            CAST(A.NUMBER_FIRST AS VARCHAR(11)) + ISNULL(A.NUMBER_FIRST_SUFFIX,'') + '_' AS ADDRESS_STRING
+    FROM ADDRESS_GNAF A
+    LEFT JOIN ADDRESS_GNAF_RNID AI
+    ON A.ADDRESS_DETAIL_PID = AI.ADDRESS_DETAIL_PID
+    LEFT JOIN ROAD_NAME_REGISTER RN
+    ON AI.ROAD_NAME_ID = RN.ROAD_NAME_ID
+    LEFT JOIN ADDRESS_GNAF_DETAIL AD
+    ON A.ADDRESS_DETAIL_PID = AD.ADDRESS_DETAIL_PID
+    ''')
+
+
+SOURCES = {
+    'VICMAP': VICMAP,
+    'GNAF': GNAF,
+}
+
+
+class RoadReference(object):
+
+    def __init__(self, xstreet_rnids):
+        # PFI -> (FROM_NODE_ROAD_NAME_ID, TO_NODE_ROAD_NAME_ID)
+        self.xstreet_rnids = xstreet_rnids
+
+
+def drop_tables(conn, tables):
+    for table in tables:
+        if dbpy.check_exists(table, conn):
+            logging.info(table)
+            conn.execute('drop table {}'.format(table))
+
+
+def create_road_reference(estamap_version):
+    # ROAD_INFRA_LINK and ROAD_ALIAS_NEAR are shared by all sources,
+    # created once here before any source is validated
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    logging.info('dropping tables:')
+    drop_tables(conn, ['ROAD_INFRA_LINK', 'ROAD_ALIAS_NEAR'])
+
+    logging.info('creating ROAD_INFRA_LINK')
+    with conn.begin():
+        conn.execute('''
+        SELECT
+            PFI AS ROAD_PFI,
+            UFI AS ROAD_INFRA_UFI
+        INTO ROAD_INFRA_LINK
+        FROM
+            (SELECT PFI, FROM_UFI AS UFI FROM ROAD
+             UNION ALL
+             SELECT PFI, TO_UFI AS UFI FROM ROAD) T
+        ''')
+
+    # roads sharing a node and a ROAD_NAME_ID, ranged per source in ROAD_RANGE_NEAR
+    logging.info('creating ROAD_ALIAS_NEAR')
+    with conn.begin():
+        conn.execute('''
+        SELECT DISTINCT
+            RA.PFI,
+            RA.ROAD_NAME_ID,
+            RI2.ROAD_PFI AS NEAR_PFI
+
+        INTO ROAD_ALIAS_NEAR
+
+        FROM ROAD_ALIAS RA
+        INNER JOIN ROAD_INFRA_LINK RI
+            ON RA.PFI = RI.ROAD_PFI
+        INNER JOIN ROAD_INFRA_LINK RI2
+            ON RI.ROAD_INFRA_UFI = RI2.ROAD_INFRA_UFI
+        INNER JOIN ROAD_ALIAS RA2
+            ON RI2.ROAD_PFI = RA2.PFI AND
+            RA.ROAD_NAME_ID = RA2.ROAD_NAME_ID
+        ''')
+
+
+def check_road_reference(conn):
+    for table in ['ROAD_INFRA_LINK', 'ROAD_ALIAS_NEAR']:
+        if not dbpy.check_exists(table, conn):
+            raise Exception('{} does not exist, run create_road_reference first'.format(table))
+
+
+def load_road_reference(estamap_version):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    check_road_reference(conn)
+
+    logging.info('reading ROAD_XSTREET')
+    xstreet_rnids = {}
+    for pfi, from_rnid, to_rnid in conn.execute('''
+        SELECT
+            PFI,
+            ISNULL(FROM_NODE_ROAD_NAME_ID, -1),
+            ISNULL(TO_NODE_ROAD_NAME_ID, -1)
+        FROM ROAD_XSTREET
+        '''):
+        xstreet_rnids[pfi] = (from_rnid, to_rnid)
+    logging.info(len(xstreet_rnids))
+
+    return RoadReference(xstreet_rnids)
+
+
+def address_validation_phase_1(estamap_version, source):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [source.duplicate_resolution_table(1),
+                       source.validation_table,
+                       source.exclusion_table,
+                       source.validated_table(1),
+                       source.duplicate_resolution_table(1) + '_SUMMARY',
+                       source.duplicate_resolution_table(1) + '_SUMMARY_UNIQUE'])
+
+    logging.info('create {}'.format(source.exclusion_table))
+    conn.execute('''
+    CREATE TABLE [dbo].[{s.exclusion_table}](
+        [PFI] [nvarchar]({s.pfi_length}) NOT NULL,
+        [RULE_CODE] [nvarchar](20) NULL,
+        [RULE_DESC] [nvarchar](255) NULL
+    ) ON [PRIMARY]
+    '''.format(s=source))
+
+    # ----------
+    logging.info('address exclusion')
+    for pfi, rule_code, rule_desc in source.manual_exclusions:
+        conn.execute('''INSERT INTO {} (PFI, RULE_CODE, RULE_DESC) VALUES ({}, '{}', '{}'); '''.format(source.exclusion_table, pfi, rule_code, rule_desc))
+
+    # ----------
+    logging.info('finding excludes')
+    for rule_code, rule_sql in source.exclusion_rules:
+        num_results = conn.execute(rule_sql)
+        logging.info('{}: {}'.format(rule_code, num_results.rowcount))
+
+    # ----------
+    logging.info('setup {}'.format(source.validation_table))
+    conn.execute(source.validation_sql)
+
+    logging.info('reading {}'.format(source.validation_table))
+    address_data = pd.read_sql('''SELECT * FROM {}'''.format(source.validation_table), conn)
+    logging.info('setting index on PFI')
+    address_data.set_index('PFI', drop=False, inplace=True)
+
+
+    # ----------
+    logging.info('find duplicates')
+
+    address_duplicates = address_data.duplicated(subset=[
+        'ST_NUM',
+        'ROAD_NAME',
+        'ROAD_TYPE',
+        'ROAD_SUFFIX',
+        'LOCALITY_NAME'],
+        keep=False)
+    address_duplicates_pfis = address_duplicates[address_duplicates == True]
+    logging.info('{} DUPLICATES: {}'.format(source.address_table, len(address_duplicates_pfis)))
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, source.exclusion_table) as sbc_excl:
+        sbc_excl.load_data(((pfi, 'DUPLICATE', 'ADDRESS HAS DUPLICATES') for pfi in address_duplicates_pfis.index.values))
+
+
+    # ----------
+    logging.info('create {}'.format(source.duplicate_resolution_table(1)))
+    conn.execute('''
+    CREATE TABLE [dbo].[{table}](
+        [PFI] [nvarchar]({s.pfi_length}) NOT NULL,
+        [RESOLUTION_PFI] [nvarchar]({s.pfi_length}) NULL,
+        [RESOLUTION_CODE] [nvarchar](20) NULL,
+        [RESOLUTION_DESC] [nvarchar](255) NULL,
+        [ADDRESS_STRING] [nvarchar](255) NULL
+    ) ON [PRIMARY]
+    '''.format(s=source, table=source.duplicate_resolution_table(1)))
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, source.duplicate_resolution_table(1)) as sbc_res:
+        logging.info('resolving duplicates - phase 1')
+        address_duplicates_data = address_data[address_duplicates]
+
+        grouped = address_duplicates_data.groupby(by=[
+            'ST_NUM',
+            'ROAD_NAME',
+            'ROAD_TYPE',
+            'ROAD_SUFFIX',
+            'LOCALITY_NAME'])
+
+        logging.info('groups: {}'.format(len(grouped.groups)))
+        for enum, (item, pfis) in enumerate(grouped.groups.iteritems()):
+
+            # get address data
+            data = address_duplicates_data.ix[pfis].sort_values(by=['IS_PRIMARY', 'RULE_SCORE', 'DIST_FROM_ROAD', 'HOUSE_NUMBER_2', 'LV_APT', 'PFI'],
+                                                                ascending=[False, False, True, False, True, False])
+
+            # rule #1: single IS_PRIMARY
+            if len(data[data['IS_PRIMARY'] == 'Y']) == 1:
+                resolution_pfi = data[data['IS_PRIMARY'] == 'Y'].index.values[0]
+                resolution_code = 'IS_PRIMARY'
+                resolution_desc = 'SINGLE IS_PRIMARY'
+
+            # rule #2: single BASE_PROP
+            elif len(data[data['GRAPHIC_TYPE'] == 'B']) == 1:
+                resolution_pfi = data[data['GRAPHIC_TYPE'] == 'B'].index.values[0]
+                resolution_code = 'BASE_PROP'
+                resolution_desc = 'SINGLE BASE_PROP'
+
+            # rule #3: single APPROVED PROPERTY_STATUS
+            elif len(data[data['STATUS'] == 'A']) == 1:
+                resolution_pfi = data[data['STATUS'] == 'A'].index.values[0]
+                resolution_code = 'APPROVED'
+                resolution_desc = 'SINGLE APPROVED'
+
+            # rule 4: single COMMON PROPERTY
+            elif len(data[data['LV_APT'].isnull()]) == 1:
+                resolution_pfi = data[data['LV_APT'].isnull()].index.values[0]
+                resolution_code = 'BASE_ADD'
+                resolution_desc = 'SINGLE COMMON PROPERTY'
+
+            # rule 5: same location
+            elif len(pd.unique([s.ToString() for s in data['SHAPE']])) == 1:
+                resolution_pfi = data.index.values[0]
+                resolution_code = 'SAME_POINT'
+                resolution_desc = 'ADDRESS LOCATION ALL THE SAME'
+
+            # rule 6: same ROAD_PFI
+            elif len(pd.unique(data['ROAD_PFI'])) == 1:
+
+                sub_data = data[data['IS_PRIMARY'] == 'Y']
+
+                if len(sub_data) > 0:
+                    # sub-rule 1: has IS_PRIMARY
+                    resolution_pfi = sub_data.index.values[0]
+                    resolution_code = 'RD_SING_PR'
+                    resolution_desc = 'SAME ROAD SELECT IS_PRIMARY'
+
+                else:
+                    resolution_pfi = data.index.values[0]
+                    resolution_code = 'RD_SINGANY'
+                    resolution_desc = 'SAME ROAD ANY'
+
+            else:
+                resolution_pfi = None
+                resolution_code = 'UNRESOLVED'
+                resolution_desc = 'PHASE 1 UNRESOLVED'
+
+            # load data into DUPLICATE_RESOLUTION
+            for pfi in data.index.values:
+                sbc_res.add_row((pfi, resolution_pfi, resolution_code, resolution_desc, data['ADDRESS_STRING'].values[0]))
+
+            if enum % 10000 == 0:
+                logging.info(enum)
+                sbc_res.flush()
+        logging.info(enum)
+
+    create_duplicate_resolution_summary(conn, source, 1)
+
+    logging.info('create {}'.format(source.validated_table(1)))
+    with conn.begin():
+        conn.execute('''
+        SELECT DISTINCT {s.key_column} AS PFI
+        INTO {validated}
+        FROM {s.address_table}
+        EXCEPT
+        (
+            SELECT DISTINCT PFI FROM {s.exclusion_table}
+            UNION
+            SELECT DISTINCT PFI FROM {resolution}
+            EXCEPT
+            SELECT DISTINCT RESOLUTION_PFI AS PFI
+            FROM {resolution}
+            WHERE RESOLUTION_CODE <> 'UNRESOLVED'
+        )
+        '''.format(s=source,
+                   validated=source.validated_table(1),
+                   resolution=source.duplicate_resolution_table(1)))
+
+
+def create_duplicate_resolution_summary(conn, source, phase):
+
+    resolution_table = source.duplicate_resolution_table(phase)
+
+    logging.info('creating summary: {}_SUMMARY'.format(resolution_table))
+    with conn.begin():
+        conn.execute('''
+        SELECT
+            RESOLUTION_CODE,
+            COUNT(*) AS COUNT
+        INTO {table}_SUMMARY
+        FROM {table}
+        GROUP BY RESOLUTION_CODE
+        '''.format(table=resolution_table))
+
+    logging.info('creating summary: {}_SUMMARY_UNIQUE'.format(resolution_table))
+    with conn.begin():
+        conn.execute('''
+        SELECT
+            RESOLUTION_CODE,
+            COUNT(DISTINCT RESOLUTION_PFI) AS COUNT
+        INTO {table}_SUMMARY_UNIQUE
+        FROM {table}
+        GROUP BY RESOLUTION_CODE
+        '''.format(table=resolution_table))
+
+
+def calc_road_ranges(estamap_version, source, phase=None):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    phase_suffix = '_PHASE_{}'.format(phase) if phase else ''
+    range_left_table = source.road_range_left_table + phase_suffix
+    range_right_table = source.road_range_right_table + phase_suffix
+    ranging_table = source.road_ranging_phase_table(phase)
+    validated_table = source.validated_table(phase) if phase else source.validated_final_table
+    address_join = 'AR.ADDR_PFI = A.{}'.format(source.key_column)
+    if source.address_filter:
+        address_join = address_join + ' AND ' + source.address_filter
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [range_left_table, range_right_table, ranging_table])
+
+    for side, side_code, range_table in (('LEFT', 'L', range_left_table),
+                                         ('RIGHT', 'R', range_right_table)):
+        logging.info('creating {}'.format(range_table))
+        with conn.begin():
+            conn.execute('''
+            SELECT
+                R.PFI,
+                R.ROAD_NAME,
+                R.ROAD_TYPE,
+                R.ROAD_SUFFIX,
+                R.LEFT_LOCALITY,
+                R.RIGHT_LOCALITY,
+                MIN(A.{s.number_first}) AS ADDRESS_{side}_MIN,
+                MAX(ISNULL(A.{s.number_last}, A.{s.number_first})) AS ADDRESS_{side}_MAX,
+                MIN(A.{s.number_first} % 2) AS ADDRESS_{side}_ODD_MIN,
+                MAX(A.{s.number_first} % 2) AS ADDRESS_{side}_ODD_MAX
+            INTO {range_table}
+            FROM ROAD R
+            LEFT JOIN {s.road_validation_table} AR
+            ON R.PFI = AR.ROAD_PFI and
+               AR.SIDE_OF_ROAD = '{side_code}'
+            INNER JOIN {validated_table} A1 ON
+                AR.ADDR_PFI = A1.PFI
+            INNER JOIN {s.address_table} A
+            ON {address_join}
+            WHERE
+                AR.RULE_SCORE >= 50
+            GROUP BY
+                R.PFI,
+                R.ROAD_NAME,
+                R.ROAD_TYPE,
+                R.ROAD_SUFFIX,
+                R.LEFT_LOCALITY,
+                R.RIGHT_LOCALITY
+            '''.format(s=source,
+                       side=side,
+                       side_code=side_code,
+                       range_table=range_table,
+                       validated_table=validated_table,
+                       address_join=address_join))
+
+    logging.info('creating {}'.format(ranging_table))
+    conn.execute('''
+    CREATE TABLE [dbo].[{}](
+        [PFI] [int] NOT NULL,
+        [ADDRESS_LEFT_MIN] [int] NULL,
+        [ADDRESS_LEFT_MAX] [int] NULL,
+        [ADDRESS_RIGHT_MIN] [int] NULL,
+        [ADDRESS_RIGHT_MAX] [int] NULL,
+        [ADDRESS_LEFT_ODD_MIN] [int] NULL,
+        [ADDRESS_LEFT_ODD_MAX] [int] NULL,
+        [ADDRESS_RIGHT_ODD_MIN] [int] NULL,
+        [ADDRESS_RIGHT_ODD_MAX] [int] NULL,
+        [ADDRESS_TYPE] [int] NULL
+    ) ON [PRIMARY]
+    '''.format(ranging_table))
+
+    logging.info('insert initial')
+    with conn.begin():
+        conn.execute('INSERT INTO {} (PFI) SELECT PFI FROM ROAD'.format(ranging_table))
+
+    for side, range_table in (('LEFT', range_left_table),
+                              ('RIGHT', range_right_table)):
+        logging.info('updating {}'.format(side))
+        with conn.begin():
+            conn.execute('''
+            UPDATE RD SET
+                RD.ADDRESS_{side}_MIN = RRS.ADDRESS_{side}_MIN,
+                RD.ADDRESS_{side}_MAX = RRS.ADDRESS_{side}_MAX,
+                RD.ADDRESS_{side}_ODD_MIN = RRS.ADDRESS_{side}_ODD_MIN,
+                RD.ADDRESS_{side}_ODD_MAX = RRS.ADDRESS_{side}_ODD_MAX
+            FROM
+                {ranging_table} RD
+                INNER JOIN {range_table} RRS
+                ON RD.PFI = RRS.PFI
+            '''.format(side=side, ranging_table=ranging_table, range_table=range_table))
+
+    if source.road_ranging_patch:
+        logging.info('patching')
+        with conn.begin():
+            conn.execute('''
+            -- MANUAL FIX FOR SPRINGVALE ROAD NUNAWADING ESTA CR 1024
+            -- LOGGED ON DSE NES #7070. Status = pending @ 20090721
+            UPDATE RD SET
+                RD.ADDRESS_LEFT_MIN = 1,
+                RD.ADDRESS_LEFT_MAX = 3,
+                RD.ADDRESS_RIGHT_MIN = 14,
+                RD.ADDRESS_RIGHT_MAX = 18,
+                RD.ADDRESS_LEFT_ODD_MIN = 1,
+                RD.ADDRESS_LEFT_ODD_MAX = 1,
+                RD.ADDRESS_RIGHT_ODD_MIN = 0,
+                RD.ADDRESS_RIGHT_ODD_MAX = 0
+            FROM
+                {} RD
+            WHERE PFI = 5671261
+            '''.format(ranging_table))
+
+    logging.info('updating ADDRESS_TYPE')
+    with conn.begin():
+        conn.execute('''
+        UPDATE {} SET
+            ADDRESS_TYPE =
+            CASE
+
+            --LEFT SIDE IS THE SAME PARITY AND --RIGHT SIDE HAS NO VALUE
+            WHEN
+                (ADDRESS_LEFT_ODD_MIN = ADDRESS_LEFT_ODD_MAX) AND
+                (ADDRESS_RIGHT_ODD_MIN IS NULL AND ADDRESS_RIGHT_ODD_MAX IS NULL)
+            THEN 0
+
+            --RIGHT SIDE IS THE SAME PARITY AND --LEFT SIDE HAS NO VALUE
+            WHEN
+                (ADDRESS_RIGHT_ODD_MIN = ADDRESS_RIGHT_ODD_MAX) AND
+                (ADDRESS_LEFT_ODD_MIN IS NULL AND ADDRESS_LEFT_ODD_MAX IS NULL)
+            THEN 0
+
+            -- LEFT AND RIGHT SIDE IS THE SAME PARITY AND DIFFERENT PARITY
+            WHEN
+                (ADDRESS_LEFT_ODD_MIN = ADDRESS_LEFT_ODD_MAX) AND --LEFT SIDE IS THE SAME PARITY
+                (ADDRESS_RIGHT_ODD_MIN = ADDRESS_RIGHT_ODD_MAX) AND --RIGHT SIDE IS THE SAME PARITY
+                (ADDRESS_LEFT_ODD_MIN <> ADDRESS_RIGHT_ODD_MIN) -- LEFT AND RIGHT SIDE HAS DIFFERENT PARITY
+            THEN 0
+
+            -- NO ADDRESS DATA
+            WHEN
+                ADDRESS_LEFT_ODD_MIN IS NULL OR
+                ADDRESS_LEFT_ODD_MAX IS NULL OR
+                ADDRESS_RIGHT_ODD_MIN IS NULL OR
+                ADDRESS_RIGHT_ODD_MAX IS NULL
+            THEN 1
+
+            -- ALL OTHER TYPES
+            ELSE 1
+            END
+        '''.format(ranging_table))
+
+
+def address_validation_phase_2(estamap_version, source):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+    check_road_reference(conn)
+
+    resolution_table = source.duplicate_resolution_table(2)
+    ranging_table = source.road_ranging_phase_table(1)
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [source.road_range_near_table,
+                       source.road_range_near_group_table,
+                       resolution_table,
+                       resolution_table + '_SUMMARY',
+                       resolution_table + '_SUMMARY_UNIQUE',
+                       source.validated_table(2)])
+
+    logging.info('creating {}'.format(source.road_range_near_table))
+    with conn.begin():
+        conn.execute('''
+        SELECT DISTINCT
+            AN.PFI,
+            AN.ROAD_NAME_ID,
+
+            -- MIN NUMBER
+            CASE
+            WHEN ISNULL(RR.ADDRESS_LEFT_MIN, 99999999) < ISNULL(RR.ADDRESS_RIGHT_MIN, 99999999)
+            THEN RR.ADDRESS_LEFT_MIN
+            ELSE RR.ADDRESS_RIGHT_MIN
+            END AS NUMBER_MIN,
+
+            -- MAX NUMBER
+            CASE
+            WHEN ISNULL(RR.ADDRESS_LEFT_MAX, 0) > ISNULL(RR.ADDRESS_RIGHT_MAX, 0)
+            THEN RR.ADDRESS_LEFT_MAX
+            ELSE RR.ADDRESS_RIGHT_MAX
+            END AS NUMBER_MAX
+
+        INTO {near_table}
+
+        FROM ROAD_ALIAS_NEAR AN
+        INNER JOIN {ranging_table} RR
+            ON AN.NEAR_PFI = RR.PFI
+        '''.format(near_table=source.road_range_near_table,
+                   ranging_table=ranging_table))
+
+    logging.info('creating {}'.format(source.road_range_near_group_table))
+    with conn.begin():
+        conn.execute('''
+        SELECT
+            PFI,
+            ROAD_NAME_ID,
+            MIN(NUMBER_MIN) AS NUMBER_MIN,
+            MAX(NUMBER_MAX) AS NUMBER_MAX
+
+        INTO {}
+
+        FROM {}
+        GROUP BY
+            PFI, ROAD_NAME_ID
+        '''.format(source.road_range_near_group_table, source.road_range_near_table))
+
+    logging.info('creating {}'.format(resolution_table))
+    with conn.begin():
+        conn.execute('''
+        CREATE TABLE [dbo].[{table}](
+            [PFI] [nvarchar]({s.pfi_length}) NOT NULL,
+            [RESOLUTION_PFI] [nvarchar]({s.pfi_length}) NULL,
+            [RESOLUTION_CODE] [nvarchar](20) NULL,
+            [RESOLUTION_DESC] [nvarchar](255) NULL,
+            [ADDRESS_STRING] [nvarchar](255) NULL,
+            [ROAD_PFI] [nvarchar](255) NULL
+        ) ON [PRIMARY]
+        '''.format(s=source, table=resolution_table))
+
+
+    logging.info('reading {}'.format(source.road_range_near_group_table))
+    rrng_data = pd.read_sql('''
+    SELECT
+        PFI,
+        ROAD_NAME_ID,
+        NUMBER_MIN,
+        NUMBER_MAX
+    FROM
+    {}
+    '''.format(source.road_range_near_group_table), conn)
+    logging.info('setting index on PFI')
+    rrng_data.set_index('PFI', drop=False, inplace=True)
+
+    logging.info('reading {}'.format(source.validation_table))
+    address_duplicates_data = pd.read_sql('''
+    SELECT
+        AV.*,
+        RR.ADDRESS_LEFT_MIN,
+        RR.ADDRESS_LEFT_MAX,
+        RR.ADDRESS_RIGHT_MIN,
+        RR.ADDRESS_RIGHT_MAX,
+        RR.ADDRESS_LEFT_ODD_MIN,
+        RR.ADDRESS_LEFT_ODD_MAX,
+        RR.ADDRESS_RIGHT_ODD_MIN,
+        RR.ADDRESS_RIGHT_ODD_MAX,
+        RR.ADDRESS_TYPE
+    FROM {validation_table} AV
+    LEFT JOIN {resolution_table} D
+    ON AV.PFI = D.PFI
+    LEFT JOIN {ranging_table} RR
+    ON AV.ROAD_PFI = RR.PFI
+    WHERE D.RESOLUTION_CODE = 'UNRESOLVED'
+    '''.format(validation_table=source.validation_table,
+               resolution_table=source.duplicate_resolution_table(1),
+               ranging_table=ranging_table), conn)
+    logging.info('setting index on PFI')
+    address_duplicates_data.set_index('PFI', drop=False, inplace=True)
+
+    logging.info('UNRESOLVED: {}'.format(len(address_duplicates_data)))
+
+    grouped = address_duplicates_data.groupby(by=[
+        'ST_NUM',
+        'ROAD_NAME',
+        'ROAD_TYPE',
+        'ROAD_SUFFIX',
+        'LOCALITY_NAME'])
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, resolution_table) as sbc:
+
+        logging.info('groups: {}'.format(len(grouped.groups)))
+        for enum, (item, pfis) in enumerate(grouped.groups.iteritems()):
+
+            # get address data
+            data = address_duplicates_data.ix[pfis].sort_values(by=['IS_PRIMARY', 'RULE_SCORE', 'DIST_FROM_ROAD', 'HOUSE_NUMBER_2', 'LV_APT', 'PFI'],
+                                                                ascending=[False, False, True, False, True, False])
+            # get road pfi
+            road_data = rrng_data.ix[data['ROAD_PFI']]
+
+            # conditions
+            c_address_parity = data['ADDRESS_TYPE'] == 0
+            c_left_min_bound = data['ADDRESS_LEFT_MIN'] <= data['HOUSE_NUMBER_1']
+            c_left_max_bound = data['ADDRESS_LEFT_MAX'] >= data['HOUSE_NUMBER_1']
+            c_left_parity = data['ADDRESS_LEFT_MIN'] % 2 == data['HOUSE_NUMBER_1'] % 2
+            c_right_min_bound = data['ADDRESS_RIGHT_MIN'] <= data['HOUSE_NUMBER_1']
+            c_right_max_bound = data['ADDRESS_RIGHT_MAX'] >= data['HOUSE_NUMBER_1']
+            c_right_parity = data['ADDRESS_RIGHT_MIN'] % 2 == data['HOUSE_NUMBER_1'] % 2
+            c_same_rnid = data['ROAD_NAME_ID'] == data['ROAD_NAME_ID'].unique()[0]
+            c_left_min_isnull = data['ADDRESS_LEFT_MIN'].isnull()
+            c_left_max_isnull = data['ADDRESS_LEFT_MAX'].isnull()
+            c_diff_right_parity = data['ADDRESS_RIGHT_MIN'] % 2 != data['HOUSE_NUMBER_1'] % 2
+            c_right_min_isnull = data['ADDRESS_RIGHT_MIN'].isnull()
+            c_right_max_isnull = data['ADDRESS_RIGHT_MAX'].isnull()
+            c_diff_left_parity = data['ADDRESS_LEFT_MIN'] % 2 != data['HOUSE_NUMBER_1'] % 2
+
+            c_road_min_bound = road_data['NUMBER_MIN'] <= data['HOUSE_NUMBER_1'].unique()[0]
+            c_road_max_bound = road_data['NUMBER_MAX'] >= data['HOUSE_NUMBER_1'].unique()[0]
+            c_road_same_rnid = road_data['ROAD_NAME_ID'] == data['ROAD_NAME_ID'].unique()[0]
+            c_road_min_bound_within10 = road_data['NUMBER_MIN'] <= data['HOUSE_NUMBER_1'].unique()[0] + 10
+            c_road_max_bound_within10 = road_data['NUMBER_MAX'] >= data['HOUSE_NUMBER_1'].unique()[0] - 10
+
+            if len(data.ix[c_address_parity &
+                           ((c_left_min_bound &
+                             c_left_max_bound &
+                             c_left_parity) |
+                            (c_right_min_bound &
+                             c_right_max_bound &
+                             c_right_parity))]) > 0:
+                resolution_code = 'R*_NULL'
+                road_pfi = data.ix[c_address_parity &
+                                   ((c_left_min_bound &
+                                     c_left_max_bound &
+                                     c_left_parity) |
+                                    (c_right_min_bound &
+                                     c_right_max_bound &
+                                     c_right_parity))]['ROAD_PFI'].values[0]
+
+            elif len(data.ix[(c_left_min_bound & c_left_max_bound) |
+                             (c_right_min_bound & c_right_max_bound)]) > 0:
+
+                resolution_code = 'R*_RNG'
+                road_pfi = data.ix[(c_left_min_bound & c_left_max_bound) |
+                                   (c_right_min_bound & c_right_max_bound)]['ROAD_PFI'].values[0]
+
+            elif len(road_data.ix[c_road_same_rnid &
+                                  (c_road_min_bound & c_road_max_bound)]) > 0:
+                resolution_code = 'R*_RNGNEAR'
+                road_pfi = road_data.ix[c_road_same_rnid &
+                                        (c_road_min_bound & c_road_max_bound)]['PFI'].values[0]
+
+            elif len(data.ix[c_address_parity &
+                             (c_left_min_isnull & c_left_max_isnull & c_diff_right_parity) |
+                             (c_right_min_isnull & c_right_max_isnull & c_diff_left_parity)]) > 0:
+                resolution_code = 'R*_1S_TY'
+                road_pfi = data.ix[c_address_parity &
+                                   (c_left_min_isnull & c_left_max_isnull & c_diff_right_parity) |
+                                   (c_right_min_isnull & c_right_max_isnull & c_diff_left_parity)
+                                   ]['ROAD_PFI'].values[0]
+
+            elif len(data.ix[(c_left_min_isnull & c_left_max_isnull & c_diff_right_parity) |
+                             (c_right_min_isnull & c_right_max_isnull & c_diff_left_parity)]) > 0:
+                resolution_code = 'R*_1S'
+                road_pfi = data.ix[(c_left_min_isnull & c_left_max_isnull & c_diff_right_parity) |
+                                   (c_right_min_isnull & c_right_max_isnull & c_diff_left_parity)
+                                   ]['ROAD_PFI'].values[0]
+            elif len(data.ix[c_left_min_isnull & c_left_max_isnull &
+                             c_right_min_isnull & c_right_max_isnull]) > 0:
+                resolution_code = 'R*_ALL_NUL'
+                road_pfi = data.ix[c_left_min_isnull & c_left_max_isnull &
+                                   c_right_min_isnull & c_right_max_isnull]['ROAD_PFI'].values[0]
+
+            elif len(road_data.ix[c_road_same_rnid & (c_road_min_bound_within10 & c_road_max_bound_within10)]) > 0:
+                resolution_code = 'R*_RNG_OFF'
+                road_pfi = road_data.ix[c_road_same_rnid & (c_road_min_bound_within10 & c_road_max_bound_within10)]['PFI'].values[0]
+
+            else:
+                resolution_code = None
+                road_pfi = None
+
+            resolution_data = data.ix[data['ROAD_PFI'] == road_pfi]
+            resolution_pfi = None
+            if len(resolution_data) > 0:
+                resolution_pfi = resolution_data['PFI'].values[0]
+
+            if resolution_code is None:
+                resolution_code = 'RANDOM'
+                resolution_pfi = data['PFI'].values[0]
+                road_pfi = data['ROAD_PFI'].values[0]
+            resolution_desc = ''
+
+            # load data into DUPLICATE_RESOLUTION
+            for pfi in data.index.values:
+
+                # road_pfi is numpy.int64, thus using int() on it.
+                sbc.add_row((pfi, resolution_pfi, resolution_code, resolution_desc, data['ADDRESS_STRING'].values[0], int(road_pfi)))
+
+            if enum % 100 == 0:
+                logging.info(enum)
+                sbc.flush()
+        logging.info(enum)
+
+    create_duplicate_resolution_summary(conn, source, 2)
+
+    logging.info('create {}'.format(source.validated_table(2)))
+    with conn.begin():
+        conn.execute('''
+        SELECT DISTINCT {s.key_column} AS PFI
+        INTO {validated}
+        FROM {s.address_table}
+        EXCEPT
+        (
+            SELECT DISTINCT PFI FROM {s.exclusion_table}
+            UNION
+            SELECT DISTINCT PFI FROM {resolution_1}
+            EXCEPT
+            SELECT DISTINCT RESOLUTION_PFI AS PFI
+            FROM {resolution_1}
+            WHERE RESOLUTION_CODE <> 'UNRESOLVED'
+            EXCEPT
+            SELECT DISTINCT RESOLUTION_PFI AS PFI
+            FROM {resolution_2}
+         )
+         '''.format(s=source,
+                    validated=source.validated_table(2),
+                    resolution_1=source.duplicate_resolution_table(1),
+                    resolution_2=resolution_table))
+
+
+def export_address_validated(estamap_version, source):
+    # from sql script: 300_AddressDuplicationPatches.sql
+    # hard coded in AddressSource.duplicate_overrides, look at alternative to hardcoded patching.
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [source.validated_final_table, source.duplicate_override_table])
+
+    logging.info('creating {}'.format(source.duplicate_override_table))
+    with conn.begin():
+        conn.execute('''
+        CREATE TABLE [dbo].[{}](
+            [ADDRESS_STRING] [nvarchar](255) NULL,
+            [OVERRIDE_PFI] [nvarchar] (20) NULL,
+            [REFERENCE] [nvarchar](255) NULL
+        ) ON [PRIMARY]
+        '''.format(source.duplicate_override_table))
+
+    if source.duplicate_overrides:
+        with dbpy.SQL_BULK_COPY(em.server, em.database_name, source.duplicate_override_table) as sbc:
+            for override in source.duplicate_overrides:
+                sbc.add_row(override)
+
+    logging.info('create {}'.format(source.validated_final_table))
+    with conn.begin():
+        conn.execute('''
+        SELECT DISTINCT {s.key_column} AS PFI
+        INTO {s.validated_final_table}
+        FROM {s.address_table}
+        WHERE
+            {s.key_column} IN
+            (
+            SELECT DISTINCT PFI FROM {validated}
+            UNION
+            SELECT OVERRIDE_PFI FROM {s.duplicate_override_table}
+            )
+        '''.format(s=source, validated=source.validated_table(2)))
+
+    logging.info('creating index on {}'.format(source.validated_final_table))
+    with conn.begin():
+        conn.execute('''
+        CREATE CLUSTERED INDEX [IX_{s.validated_final_table}_PFI] ON [dbo].[{s.validated_final_table}]
+        (
+                [PFI] ASC
+        )WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, SORT_IN_TEMPDB = OFF, DROP_EXISTING = OFF, ONLINE = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+        '''.format(s=source))
+
+
+def register_new_address(estamap_version, source):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    count_before = conn.execute('SELECT COUNT(*) FROM ADDRESS_MSLINK_REGISTER').fetchval()
+
+    logging.info('register new {}'.format(source.address_table))
+    conn.execute(source.register_sql.format(em=em))
+
+    count_after = conn.execute('SELECT COUNT(*) FROM ADDRESS_MSLINK_REGISTER').fetchval()
+
+    logging.info('count before: {}'.format(count_before))
+    logging.info('count after: {}'.format(count_after))
+    logging.info('new addresses: {}'.format(count_after - count_before))
+    conn.commit()
+
+
+def calc_road_flip(estamap_version, source, reference=None):
+
+    if reference is None:
+        reference = load_road_reference(estamap_version)
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    # one lmdb per source so sources can run side by side
+    temp_lmdb = 'c:\\temp\\road_flip_{}_{}'.format(source.name.lower(), estamap_version)
+    logging.info('creating lmdb: {}'.format(temp_lmdb))
+    if os.path.exists(temp_lmdb):
+        shutil.rmtree(temp_lmdb)
+    env = lmdb.Environment(path=temp_lmdb,
+                           map_size=1000000000,
+                           readonly=False,
+                           max_dbs=10)
+    arv_db = env.open_db('address_road_validation', dupsort=True)
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [source.road_flip_validation_table])
+
+    logging.info('loading into lmdb')
+    with env.begin(write=True, db=arv_db) as txn:
+        for enum, (hn1, hn2, addr_pfi, road_pfi, dist, side) in enumerate(conn.execute('''
+            SELECT
+                A.{s.number_first},
+                A.{s.number_last},
+                AR.ADDR_PFI,
+                AR.ROAD_PFI,
+                AR.DIST_ALONG_ROAD,
+                AR.SIDE_OF_ROAD
+            FROM {s.road_validation_table} AR
+            INNER JOIN {s.validated_final_table} AF
+            ON AR.ADDR_PFI = AF.PFI
+            LEFT JOIN {s.address_table} A
+            ON AF.PFI = A.{s.key_column}
+            '''.format(s=source))):
+            txn.put(str(road_pfi), ','.join([str(hn1), # house number 1
+                                             str(hn2), # house number 2
+                                             str(addr_pfi), # address pfi
+                                             str(road_pfi), # road pfi
+                                             '{:.4f}'.format(dist), # distance along road
+                                             str(side)])) # side of road
+            if enum % 100000 == 0:
+                logging.info(enum)
+    logging.info(enum)
+
+    logging.info('creating {}'.format(source.road_flip_validation_table))
+    conn.execute('''
+    CREATE TABLE [dbo].[{}](
+        [PFI] [int] NOT NULL,
+        [LEFT_NUM_MIN] [int] NULL,
+        [LEFT_NUM_MAX] [int] NULL,
+        [LEFT_INVERSED] [int] NULL,
+        [RIGHT_NUM_MIN] [int] NULL,
+        [RIGHT_NUM_MAX] [int] NULL,
+        [RIGHT_INVERSED] [int] NULL,
+        [FLIP_STATUS] [int] NULL
+    ) ON [PRIMARY]
+    '''.format(source.road_flip_validation_table))
+
+    logging.info('looping road flip data')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, source.road_flip_validation_table) as sbc, \
+         env.begin(db=arv_db) as arv_txn:
+
+        arv_cursor = arv_txn.cursor()
+
+        for enum, (road_pfi, left_min, left_max, right_min, right_max, addr_type) \
+            in enumerate(conn.execute('''
+            SELECT
+                PFI,
+                ISNULL(ADDRESS_LEFT_MIN, -1) AS ADDRESS_LEFT_MIN,
+                ISNULL(ADDRESS_LEFT_MAX, -1) AS ADDRESS_LEFT_MAX,
+                ISNULL(ADDRESS_RIGHT_MIN, -1) AS ADDRESS_RIGHT_MIN,
+                ISNULL(ADDRESS_RIGHT_MAX, -1) AS ADDRESS_RIGHT_MAX,
+                ADDRESS_TYPE
+            FROM {}
+            WHERE
+                (ADDRESS_LEFT_MIN IS NOT NULL OR
+                 ADDRESS_LEFT_MAX IS NOT NULL OR
+                 ADDRESS_RIGHT_MIN IS NOT NULL OR
+                 ADDRESS_RIGHT_MAX IS NOT NULL)
+                AND ADDRESS_TYPE in (0,1)
+            ORDER BY PFI
+            '''.format(source.road_ranging_table))):
+
+            from_rnid, to_rnid = reference.xstreet_rnids.get(road_pfi, (-1, -1))
+
+            # load address road data
+            left_data = []
+            right_data = []
+            arv_cursor.set_key(str(road_pfi))
+            for road_data in arv_cursor.iternext_dup():
+                hn1, hn2, addr_pfi, _, dist, side = road_data.split(',')
+                hn1 = int(hn1)
+                hn2 = int(hn2) if hn2 != 'None' else -1
+                dist = float(dist)
+
+                if side == 'L':
+                    left_data.append([hn1, hn2, addr_pfi, road_pfi, dist, side])
+                else:
+                    right_data.append([hn1, hn2, addr_pfi, road_pfi, dist, side])
+            left_data = sorted(left_data, key=lambda x: x[4])  # sort by dist
+            right_data = sorted(right_data, key=lambda x: x[4])  # sort by dist
+
+            # determine LEFT
+            if left_data:
+                left_same = left_data[0][0] == left_data[-1][0]
+                left_inversed = left_data[-1][0] < left_data[0][0]
+            else:
+                left_same = 1
+                left_inversed = False
+
+            # determine RIGHT
+            if right_data:
+                right_same = right_data[0][0] == right_data[-1][0]
+                right_inversed = right_data[-1][0] < right_data[0][0]
+            else:
+                right_same = 1
+                right_inversed = False
+
+            # flip_status
+            flip_status = int(left_inversed) + int(right_inversed)
+
+            # not required to flip if not connected
+            if flip_status == 1 and addr_type == 1:
+                if from_rnid == -1 or to_rnid == -1:
+                    if to_rnid == -1 and \
+                       (left_same is False and right_same is False) and \
+                       (left_min is not None and right_min is not None):
+                        flip_status = -1
+
+            # load into db
+            sbc.add_row((road_pfi,
+                         left_min, left_max, left_inversed,
+                         right_min, right_max, right_inversed,
+                         flip_status))
+
+            if enum % 10000 == 0:
+                logging.info(enum)
+
+
+def calc_address_components(estamap_version, source):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_sqlalchemy(em.server, em.database_name, init_geomtype='clr')
+
+    logging.info('dropping tables:')
+    drop_tables(conn, [source.components_table])
+
+    logging.info('creating {}'.format(source.components_table))
+    with conn.begin():
+        conn.execute('''
+        CREATE TABLE [dbo].[{}](
+            [PFI] [nvarchar](15) NOT NULL,
+
+            -- LV_APT
+            [BLG_UNIT_ID_1] [int] NULL,
+            [BLG_UNIT_SUFFIX_1] [nvarchar](2) NULL,
+            [FLOOR_NO_1] [int] NULL,
+            [LV_APT] [nvarchar](5) NULL,
+
+            -- ST_NUM
+            [HOUSE_PREFIX_1] [nvarchar](2) NULL,
+            [HOUSE_NUMBER_1] [int] NULL,
+            [HOUSE_SUFFIX_1] [nvarchar](2) NULL,
+            [ST_NUM] [nvarchar](11) NULL,
+
+            -- HI_NUM
+            [HOUSE_PREFIX_2] [nvarchar](2) NULL,
+            [HOUSE_NUMBER_2] [int] NULL,
+            [HOUSE_SUFFIX_2] [nvarchar](2) NULL,
+            [HI_NUM] [nvarchar](5) NULL,
+
+            -- ADDRESS_STRING
+            [ROAD_NAME] [nvarchar](45) NULL,
+            [ROAD_TYPE] [nvarchar](15) NULL,
+            [ROAD_SUFFIX] [nvarchar](2) NULL,
+            [LOCALITY_NAME] [nvarchar](255) NULL,
+            [ADDRESS_STRING] [nvarchar](255) NULL
+
+        ) ON [PRIMARY]
+        '''.format(source.components_table))
+
+    logging.info('insert into {}'.format(source.components_table))
+    with conn.begin():
+        conn.execute('''
+        INSERT INTO {}
+            (PFI,
+            BLG_UNIT_ID_1,
+            BLG_UNIT_SUFFIX_1,
+            FLOOR_NO_1,
+            LV_APT,
+            HOUSE_PREFIX_1,
+            HOUSE_NUMBER_1,
+            HOUSE_SUFFIX_1,
+            ST_NUM,
+            HOUSE_PREFIX_2,
+            HOUSE_NUMBER_2,
+            HOUSE_SUFFIX_2,
+            HI_NUM,
+            ROAD_NAME,
+            ROAD_TYPE,
+            ROAD_SUFFIX,
+            LOCALITY_NAME,
+            ADDRESS_STRING
+            )
+        '''.format(source.components_table) + source.components_sql)
+
+    logging.info('creating index on {}'.format(source.components_table))
+    with conn.begin():
+        conn.execute('''
+        CREATE UNIQUE CLUSTERED INDEX [IX_{table}_PFI] ON [dbo].[{table}]
+        (
+            [PFI] ASC
+        )WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, SORT_IN_TEMPDB = OFF, IGNORE_DUP_KEY = OFF, DROP_EXISTING = OFF, ONLINE = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+        '''.format(table=source.components_table))
+
+
+def validate_source(estamap_version, source, reference):
+
+    address_validation_phase_1(estamap_version, source)
+    calc_road_ranges(estamap_version, source, phase=1)
+    address_validation_phase_2(estamap_version, source)
+    export_address_validated(estamap_version, source)
+    calc_road_ranges(estamap_version, source)
+    calc_road_flip(estamap_version, source, reference)
+
+
+def validate_sources(estamap_version, sources):
+
+    logging.info('creating road reference')
+    create_road_reference(estamap_version)
+    logging.info('loading road reference')
+    reference = load_road_reference(estamap_version)
+
+    logging.info('validating sources: {}'.format(', '.join(source.name for source in sources)))
+    pool = multiprocessing.pool.ThreadPool(len(sources))
+    try:
+        pool.map(lambda source: validate_source(estamap_version, source, reference), sources)
+    finally:
+        pool.close()
+        pool.join()
+
+    # ADDRESS_MSLINK_REGISTER is shared, register in source order so
+    # CAD_STRING ownership matches running the sources one after another
+    for source in sources:
+        register_new_address(estamap_version, source)
+
+
+if __name__ == '__main__':
+
+    sys.argv.append('--estamap_version=DEV')
+
+    with log.LogConsole():
+
+        logging.info('parsing args')
+        args = docopt(__doc__)
+
+        logging.info('variables')
+        estamap_version = args['--estamap_version']
+        sources = [SOURCES[name.strip().upper()] for name in args['--sources'].split(',')]
+        log_file = args['--log_file']
+        log_path = args['--log_path']
+
+        with log.LogFile(log_file, log_path):
+            logging.info('start')
+            try:
+
+                validate_sources(estamap_version, sources)
+
+            except Exception as err:
+                logging.exception('error occured running function.')
+                raise
+            logging.info('finished')
@@ -0,0 +1,91 @@
+'''
+VicGrid (EPSG:3111) to INGR / INGR UOR coordinate transformation.
+
+Transforms whole coordinate arrays in one call instead of reading a table a
+second time with an INGR spatial_reference or projecting each geometry.
+
+The INGR and INGR UOR spatial references are planar transformations of
+VicGrid, so an affine transform is fitted (least squares) to a grid of control
+points projected with arcpy over the VicGrid extent of Victoria. The fit is
+checked against a second set of check points; when the residual is above the
+tolerance the transform falls back to projecting each point with arcpy.
+'''
+import logging
+
+import numpy as np
+import arcpy
+
+import dev as gis
+
+
+VICGRID_EXTENT = (2000000.0, 2200000.0, 3000000.0, 2900000.0)
+
+
+def project_points(xs, ys, from_sr, to_sr):
+    xs_out = np.empty(len(xs), dtype=np.float64)
+    ys_out = np.empty(len(ys), dtype=np.float64)
+    for enum, (x, y) in enumerate(zip(xs, ys)):
+        point = arcpy.PointGeometry(arcpy.Point(x, y), from_sr).projectAs(to_sr).firstPoint
+        xs_out[enum] = point.X
+        ys_out[enum] = point.Y
+    return xs_out, ys_out
+
+
+class AffineTransform(object):
+
+    def __init__(self, from_sr, to_sr, extent=VICGRID_EXTENT, control_points=11, tolerance=0.001):
+
+        self.from_sr = from_sr
+        self.to_sr = to_sr
+
+        xmin, ymin, xmax, ymax = extent
+        grid_x, grid_y = np.meshgrid(np.linspace(xmin, xmax, control_points),
+                                     np.linspace(ymin, ymax, control_points))
+        xs = grid_x.ravel()
+        ys = grid_y.ravel()
+        xs_to, ys_to = project_points(xs, ys, from_sr, to_sr)
+
+        design = np.column_stack([xs, ys, np.ones(len(xs))])
+        self.coef_x = np.linalg.lstsq(design, xs_to, rcond=-1)[0]
+        self.coef_y = np.linalg.lstsq(design, ys_to, rcond=-1)[0]
+
+        # check points, offset half a step from the control points
+        step_x = (xmax - xmin) / (control_points - 1)
+        step_y = (ymax - ymin) / (control_points - 1)
+        check_x, check_y = np.meshgrid(np.linspace(xmin + step_x / 2.0, xmax - step_x / 2.0, control_points - 1),
+                                       np.linspace(ymin + step_y / 2.0, ymax - step_y / 2.0, control_points - 1))
+        check_x = check_x.ravel()
+        check_y = check_y.ravel()
+        check_x_to, check_y_to = project_points(check_x, check_y, from_sr, to_sr)
+        fit_x, fit_y = self.apply(check_x, check_y)
+        self.residual = float(np.hypot(fit_x - check_x_to, fit_y - check_y_to).max())
+
+        self.is_affine = self.residual <= tolerance
+        logging.info('{} affine residual: {} ({})'.format(to_sr.name, self.residual,
+                                                        'affine' if self.is_affine else 'arcpy fallback'))
+
+    def apply(self, xs, ys):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        return (self.coef_x[0] * xs + self.coef_x[1] * ys + self.coef_x[2],
+                self.coef_y[0] * xs + self.coef_y[1] * ys + self.coef_y[2])
+
+    def __call__(self, xs, ys):
+        if self.is_affine:
+            return self.apply(xs, ys)
+        return project_points(xs, ys, self.from_sr, self.to_sr)
+
+
+class IngrTransform(object):
+
+    def __init__(self, extent=VICGRID_EXTENT):
+
+        vicgrid_sr = arcpy.SpatialReference(3111)
+        self.ingr = AffineTransform(vicgrid_sr, gis.ingr_spatial_reference(), extent)
+        self.ingr_uor = AffineTransform(vicgrid_sr, gis.ingr_uor_spatial_reference(), extent)
+
+    def __call__(self, xs, ys):
+        # returns (xs_ingr, ys_ingr, xs_ingr_uor, ys_ingr_uor)
+        xs_ingr, ys_ingr = self.ingr(xs, ys)
+        xs_ingr_uor, ys_ingr_uor = self.ingr_uor(xs, ys)
+        return xs_ingr, ys_ingr, xs_ingr_uor, ys_ingr_uor
@@ -0,0 +1,244 @@
+'''
+Nearest ROAD_INFRASTRUCTURE node lookup.
+
+Builds a static KD-tree over the ROAD_INFRASTRUCTURE coordinates once and
+answers nearest node queries in batches. Used to calc ADDRESS_ROADINFRA and
+ADDRESS_GNAF_ROADINFRA in the same run.
+
+In network mode addresses with a validated ROAD_PFI (ADDRESS_ROAD_VALIDATION)
+take the FROM_UFI/TO_UFI of that road closest along the road (DIST_ALONG_ROAD),
+only unvalidated addresses fall back to the spatial nearest.
+
+Usage:
+  nearest_node.py [options]
+
+Options:
+  --estamap_version <version>  ESTAMap Version
+  --sources <sources>     Comma separated address sources. [default: VICMAP,GNAF]
+  --batch_size <size>     Number of points per nearest query. [default: 500000]
+  --mode <mode>           spatial or network. [default: network]
+  --log_file <file>       Log File name. [default: nearest_node.log]
+  --log_path <folder>     Folder to store the log file. [default: c:\\temp]
+'''
+import os
+import sys
+import logging
+
+from docopt import docopt
+import numpy as np
+import scipy.spatial
+import arcpy
+
+import log
+import dev as gis
+import dbpy
+
+import address_validation_engine as ave
+
+
+class NodeIndex(object):
+
+    def __init__(self, ufis, xs, ys):
+        self.ufis = np.asarray(ufis, dtype=np.int64)
+        self.xy = np.column_stack([np.asarray(xs, dtype=np.float64),
+                                   np.asarray(ys, dtype=np.float64)])
+        self.tree = scipy.spatial.cKDTree(self.xy)
+
+    def __len__(self):
+        return len(self.ufis)
+
+    @classmethod
+    def from_road_infrastructure(cls, estamap_version):
+
+        em = gis.ESTAMAP(estamap_version)
+
+        logging.info('reading ROAD_INFRASTRUCTURE')
+        ufis = []
+        xs = []
+        ys = []
+        with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
+                                   field_names=['UFI', 'SHAPE@X', 'SHAPE@Y']) as sc:
+            for ufi, x, y in sc:
+                ufis.append(ufi)
+                xs.append(x)
+                ys.append(y)
+        logging.info('building kdtree: {}'.format(len(ufis)))
+        return cls(ufis, xs, ys)
+
+    def nearest(self, xs, ys, k=1, distance_upper_bound=np.inf):
+        # returns (ufis, distances), shape (n,) for k=1 else (n, k).
+        # missing neighbours (beyond distance_upper_bound) have ufi -1.
+        xy = np.column_stack([np.asarray(xs, dtype=np.float64),
+                              np.asarray(ys, dtype=np.float64)])
+        dists, idx = self.tree.query(xy, k=k, distance_upper_bound=distance_upper_bound)
+        found = idx < len(self.ufis)
+        ufis = np.full(idx.shape, -1, dtype=np.int64)
+        ufis[found] = self.ufis[idx[found]]
+        return ufis, dists
+
+    def nearest_batches(self, rows, batch_size=500000, k=1):
+        # rows: iterable of (key, x, y). yields (keys, ufis, distances) per batch.
+        keys = []
+        xs = []
+        ys = []
+        for key, x, y in rows:
+            keys.append(key)
+            xs.append(x)
+            ys.append(y)
+            if len(keys) == batch_size:
+                ufis, dists = self.nearest(xs, ys, k=k)
+                yield keys, ufis, dists
+                keys = []
+                xs = []
+                ys = []
+        if keys:
+            ufis, dists = self.nearest(xs, ys, k=k)
+            yield keys, ufis, dists
+
+
+class RoadEndpoints(object):
+
+    def __init__(self, estamap_version):
+
+        em = gis.ESTAMAP(estamap_version)
+        conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+        logging.info('reading ROAD endpoints')
+        # PFI -> (FROM_UFI, TO_UFI, LENGTH)
+        self.roads = {}
+        for pfi, from_ufi, to_ufi, length in conn.execute('''
+            SELECT
+                PFI,
+                FROM_UFI,
+                TO_UFI,
+                SHAPE.STLength()
+            FROM ROAD
+            '''):
+            self.roads[pfi] = (from_ufi, to_ufi, length)
+        logging.info(len(self.roads))
+
+    def nearest(self, road_pfi, dist_along_road):
+        # the other end when the nearer FROM_UFI / TO_UFI is null,
+        # None when the road is not in ROAD or both ends are null
+        if road_pfi not in self.roads:
+            return None
+        from_ufi, to_ufi, length = self.roads[road_pfi]
+        if dist_along_road <= length / 2.0:
+            return from_ufi if from_ufi is not None else to_ufi
+        return to_ufi if to_ufi is not None else from_ufi
+
+
+def read_validated_roads(estamap_version, source):
+
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    logging.info('reading {}'.format(source.road_validation_table))
+    # ADDR_PFI -> (ROAD_PFI, DIST_ALONG_ROAD)
+    validated = {}
+    for addr_pfi, road_pfi, dist_along_road in conn.execute('''
+        SELECT
+            ADDR_PFI,
+            ROAD_PFI,
+            DIST_ALONG_ROAD
+        FROM {}
+        WHERE RULE_SCORE >= 50
+        '''.format(source.road_validation_table)):
+        validated[str(addr_pfi)] = (int(road_pfi), dist_along_road)
+    logging.info(len(validated))
+    return validated
+
+
+def calc_nearest_roadinfra(estamap_version, source, index, batch_size=500000, endpoints=None):
+
+    logging.info('environment: {}'.format(source.name))
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    logging.info('dropping tables:')
+    if dbpy.check_exists(source.roadinfra_table, conn):
+        logging.info(source.roadinfra_table)
+        conn.execute('drop table {}'.format(source.roadinfra_table))
+
+    logging.info('creating {}'.format(source.roadinfra_table))
+    conn.execute('''
+    CREATE TABLE [dbo].[{s.roadinfra_table}](
+        [PFI] [nvarchar]({s.pfi_length}) NOT NULL,
+        [UFI] [int] NULL
+    ) ON [PRIMARY]
+    '''.format(s=source))
+    conn.commit()
+
+    validated = {}
+    if endpoints is not None:
+        validated = read_validated_roads(estamap_version, source)
+
+    logging.info('looping {}'.format(source.address_table))
+    counts = {'network': 0, 'spatial': 0, 'missing road': 0, 'null endpoints': 0}
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, source.roadinfra_table) as sbc, \
+         arcpy.da.SearchCursor(in_table=os.path.join(em.sde, source.address_table),
+                               field_names=[source.key_column, 'SHAPE@X', 'SHAPE@Y']) as sc:
+
+        def unvalidated_rows():
+            for key, x, y in sc:
+                ufi = None
+                if str(key) in validated:
+                    road_pfi, dist_along_road = validated[str(key)]
+                    ufi = endpoints.nearest(road_pfi, dist_along_road)
+                    # validated ROAD_PFI no longer in ROAD, or without FROM_UFI / TO_UFI,
+                    # spatial nearest instead
+                    if road_pfi not in endpoints.roads:
+                        counts['missing road'] += 1
+                    elif ufi is None:
+                        counts['null endpoints'] += 1
+                if ufi is not None:
+                    sbc.add_row((key, ufi))
+                    counts['network'] += 1
+                    if counts['network'] % 100000 == 0:
+                        logging.info(counts)
+                        sbc.flush()
+                else:
+                    yield key, x, y
+
+        for keys, ufis, dists in index.nearest_batches(unvalidated_rows(), batch_size):
+            sbc.load_data(zip(keys, ufis.tolist()))
+            counts['spatial'] += len(keys)
+            logging.info(counts)
+    logging.info(counts)
+
+
+def calc_address_roadinfra(estamap_version, sources, batch_size=500000, mode='network'):
+
+    index = NodeIndex.from_road_infrastructure(estamap_version)
+    endpoints = RoadEndpoints(estamap_version) if mode == 'network' else None
+    for source in sources:
+        calc_nearest_roadinfra(estamap_version, source, index, batch_size, endpoints)
+
+
+if __name__ == '__main__':
+
+    sys.argv.append('--estamap_version=DEV')
+
+    with log.LogConsole():
+
+        logging.info('parsing args')
+        args = docopt(__doc__)
+
+        logging.info('variables')
+        estamap_version = args['--estamap_version']
+        sources = [ave.SOURCES[name.strip().upper()] for name in args['--sources'].split(',')]
+        batch_size = int(args['--batch_size'])
+        mode = args['--mode']
+        log_file = args['--log_file']
+        log_path = args['--log_path']
+
+        with log.LogFile(log_file, log_path):
+            logging.info('start')
+            try:
+
+                calc_address_roadinfra(estamap_version, sources, batch_size, mode)
+
+            except Exception as err:
+                logging.exception('error occured running function.')
+                raise
+            logging.info('finished')
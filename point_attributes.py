@@ -0,0 +1,586 @@
+'''
+Point attribute engine for ROAD_INFRASTRUCTURE, ADDRESS and ADDRESS_GNAF.
+
+LOCALITY and LGA polygons are read and indexed once, then each point layer is
+attributed (locality, lga, vicgrid / ingr / ingr uor coordinates) into its
+own detail table.
+
+Points are classified in chunks: coordinates are pulled into numpy arrays and
+queried against the polygons in bulk (shapely 2 STRtree 'within' predicate,
+rtree + prepared contains with older shapely), giving (point, polygon) pairs.
+A PolygonGrid answers points in interior cells with an array lookup, only
+boundary cell points are tested, against the candidate polygons of their cell.
+
+INGR / INGR UOR coordinates come from coord_transform on the same arrays, each
+layer is read with a single cursor.
+
+Points within more than one locality are tie-broken on the polygon boundary
+segments near the point: when the boundary crossing the 2.5m buffer is a
+straight line the share is the closed form half-plane / circle area, only
+other boundaries fall back to intersecting the full polygon.
+
+With --processes > 1 the points of a layer are split into square tiles
+(--tile_size), each tile is classified in a worker process against the
+LOCALITY / LGA polygons overlapping the tile, clipped to the tile (plus a
+buffer wider than the tie-break buffer), and the results are merged back into
+one bulk copy in key order.
+
+Usage:
+  point_attributes.py [options]
+
+Options:
+  --estamap_version <version>   ESTAMap Version
+  --layers <layers>        Comma separated point layers. [default: ADDRESS,ROAD_INFRASTRUCTURE,ADDRESS_GNAF]
+  --chunk_size <size>      Number of points classified per bulk query. [default: 100000]
+  --grid_cell <metres>     Interior/boundary grid cell size, 0 to disable. [default: 250]
+  --processes <num>        Worker processes, 1 to run in process. [default: 1]
+  --tile_size <metres>     Tile size when running in worker processes. [default: 25000]
+  --log_file <file>        Log File name. [default: point_attributes.log]
+  --log_path <folder>      Folder to store the log file. [default: c:\\temp]
+'''
+import os
+import sys
+import math
+import logging
+import itertools
+import multiprocessing
+
+from docopt import docopt
+import numpy as np
+import rtree
+import shapely
+import shapely.prepared
+import shapely.geometry
+import shapely.wkb
+import arcpy
+
+import log
+import dev as gis
+import dbpy
+
+import polygon_grid
+import coord_transform
+
+SHAPELY_2 = int(shapely.__version__.split('.')[0]) >= 2
+if SHAPELY_2:
+    import shapely.strtree
+
+
+class PointLayer(object):
+
+    def __init__(self, name, key_field, detail_table, sql_script, intersect_count, flush_count):
+        self.name = name
+        self.key_field = key_field
+        self.detail_table = detail_table
+        self.sql_script = sql_script
+        # detail table has an INTERSECT_COUNT column (count of containing localities)
+        self.intersect_count = intersect_count
+        self.flush_count = flush_count
+
+
+ADDRESS = PointLayer(name='ADDRESS',
+                     key_field='PFI',
+                     detail_table='ADDRESS_DETAIL',
+                     sql_script='create_address_detail.sql',
+                     intersect_count=True,
+                     flush_count=100000)
+
+ROAD_INFRASTRUCTURE = PointLayer(name='ROAD_INFRASTRUCTURE',
+                                 key_field='UFI',
+                                 detail_table='ROAD_INFRASTRUCTURE_DETAIL',
+                                 sql_script='create_road_infrastructure_detail.sql',
+                                 intersect_count=False,
+                                 flush_count=100000)
+
+ADDRESS_GNAF = PointLayer(name='ADDRESS_GNAF',
+                          key_field='ADDRESS_DETAIL_PID',
+                          detail_table='ADDRESS_GNAF_DETAIL',
+                          sql_script='create_address_gnaf_detail.sql',
+                          intersect_count=True,
+                          flush_count=10000)
+
+LAYERS = {
+    'ADDRESS': ADDRESS,
+    'ROAD_INFRASTRUCTURE': ROAD_INFRASTRUCTURE,
+    'ADDRESS_GNAF': ADDRESS_GNAF,
+}
+
+
+# clip buffer around a tile, wider than TIE_BREAK_BUFFER so the clip edges
+# never fall in the tie-break circle of a tile point
+TILE_BUFFER = 100.0
+
+
+def clip_polygon(geom, bounds):
+    # polygonal part of geom within bounds, None when empty
+    clipped = geom.intersection(shapely.geometry.box(*bounds))
+    if clipped.geom_type == 'Polygon':
+        parts = [clipped]
+    elif clipped.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        parts = [part for part in clipped.geoms if part.geom_type == 'Polygon']
+    else:
+        parts = []
+    parts = [part for part in parts if not part.is_empty]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return shapely.geometry.MultiPolygon(parts)
+
+
+class PolygonLayer(object):
+
+    def __init__(self, name, pfis, names, geoms, grid_cell=250):
+        self.name = name
+        self.pfis = pfis
+        self.names = names
+        self.geoms = geoms
+        self.prepared = [shapely.prepared.prep(geom) for geom in geoms]
+
+        def stream_load():
+            for i, geom in enumerate(geoms):
+                yield (i, geom.bounds, None)
+        self.rtree = rtree.index.Index(stream_load())
+        if SHAPELY_2:
+            self.strtree = shapely.strtree.STRtree(geoms)
+            self.geoms_array = np.array(geoms, dtype=object)
+            shapely.prepare(self.geoms_array)
+        self.names_array = np.array(names, dtype=object)
+        self._edges = {}
+        self.grid = None
+        if grid_cell:
+            self.grid = polygon_grid.PolygonGrid(geoms, grid_cell)
+
+    def __len__(self):
+        return len(self.pfis)
+
+    @classmethod
+    def from_feature_class(cls, estamap_version, name, grid_cell=250):
+
+        em = gis.ESTAMAP(estamap_version)
+
+        logging.info('reading {} geoms'.format(name))
+        pfis = []
+        names = []
+        geoms = []
+        with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, name),
+                                   field_names=['PFI', 'NAME', 'SHAPE@WKB']) as sc:
+            for pfi, polygon_name, wkb in sc:
+                pfis.append(pfi)
+                names.append(polygon_name)
+                geoms.append(shapely.wkb.loads(str(wkb)))
+        logging.info(len(pfis))
+
+        logging.info('building {} rtree'.format(name))
+        return cls(name, pfis, names, geoms, grid_cell)
+
+    def edges(self, i):
+        if i not in self._edges:
+            self._edges[i] = polygon_grid.polygon_edges(self.geoms[i])
+        return self._edges[i]
+
+    def subset(self, bounds, buffer=TILE_BUFFER):
+        # (name, pfis, names, geoms) of the polygons overlapping bounds, clipped to bounds
+        # plus buffer, to ship to a worker
+        xmin, ymin, xmax, ymax = bounds
+        bounds = (xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer)
+        pfis = []
+        names = []
+        geoms = []
+        for i in sorted(self.rtree.intersection(bounds)):
+            geom = clip_polygon(self.geoms[i], bounds)
+            if geom is not None:
+                pfis.append(self.pfis[i])
+                names.append(self.names[i])
+                geoms.append(geom)
+        return self.name, pfis, names, geoms
+
+    def containing(self, geom):
+        return [i for i in self.rtree.intersection(geom.bounds) if self.prepared[i].contains(geom)]
+
+    def query_points(self, xs, ys):
+        # returns array([point indices], [polygon indices]) for points within polygons
+        if self.grid is None:
+            return self.query_points_exact(xs, ys)
+
+        owner = self.grid.lookup(xs, ys)
+        interior = np.flatnonzero(owner >= 0)
+        boundary = np.flatnonzero(owner == polygon_grid.BOUNDARY)
+        point_idx, poly_idx = self.grid.candidate_pairs(self.grid.cells(xs[boundary], ys[boundary]))
+        point_idx = boundary[point_idx]
+        within = self.contains_pairs(poly_idx, xs[point_idx], ys[point_idx])
+        return np.array([np.concatenate([interior, point_idx[within]]),
+                         np.concatenate([owner[interior], poly_idx[within]])], dtype=np.int64)
+
+    def contains_pairs(self, poly_idx, xs, ys):
+        # per (polygon, point) pair, the polygon contains the point
+        if SHAPELY_2:
+            return shapely.contains_xy(self.geoms_array[poly_idx], xs, ys)
+        return np.array([self.prepared[i].contains(shapely.geometry.Point(x, y))
+                         for i, x, y in itertools.izip(poly_idx, xs, ys)], dtype=bool)
+
+    def query_points_exact(self, xs, ys):
+        if SHAPELY_2:
+            return self.strtree.query(shapely.points(xs, ys), predicate='within')
+
+        point_idx = []
+        poly_idx = []
+        for n, (x, y) in enumerate(itertools.izip(xs, ys)):
+            geom = shapely.geometry.Point(x, y)
+            for i in self.containing(geom):
+                point_idx.append(n)
+                poly_idx.append(i)
+        return np.array([point_idx, poly_idx], dtype=np.int64).reshape(2, -1)
+
+
+class Candidates(object):
+
+    def __init__(self, pairs, num_points):
+        # by point, then polygon so ties resolve the same for any query order
+        order = np.lexsort((pairs[1], pairs[0]))
+        self.poly_idx = pairs[1][order]
+        self.counts = np.bincount(pairs[0], minlength=num_points)
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def single(self):
+        mask = self.counts == 1
+        return mask, self.poly_idx[self.starts[mask]]
+
+    def multiple(self):
+        for n in np.flatnonzero(self.counts > 1):
+            yield n, self.poly_idx[self.starts[n]:self.starts[n] + self.counts[n]].tolist()
+
+
+class PolygonIndex(object):
+
+    def __init__(self, localities, lgas):
+        self.localities = localities
+        self.lgas = lgas
+
+    @classmethod
+    def load(cls, estamap_version, grid_cell=250):
+        return cls(PolygonLayer.from_feature_class(estamap_version, 'LOCALITY', grid_cell),
+                   PolygonLayer.from_feature_class(estamap_version, 'LGA', grid_cell))
+
+
+TIE_BREAK_BUFFER = 2.5
+TIE_BREAK_AREA = shapely.geometry.Point(0, 0).buffer(TIE_BREAK_BUFFER).area
+TIE_BREAK_TOLERANCE = 0.001
+
+
+def boundary_share(edges, x, y, radius=TIE_BREAK_BUFFER, tolerance=TIE_BREAK_TOLERANCE):
+    # share of the radius circle around (x, y) inside the polygon containing (x, y),
+    # from the polygon boundary segments near the point.
+    # returns None when the boundary within the circle is not a straight line.
+
+    near = ((np.minimum(edges[:, 0], edges[:, 2]) <= x + radius) &
+            (np.maximum(edges[:, 0], edges[:, 2]) >= x - radius) &
+            (np.minimum(edges[:, 1], edges[:, 3]) <= y + radius) &
+            (np.maximum(edges[:, 1], edges[:, 3]) >= y - radius))
+    e = edges[near]
+    dx = e[:, 2] - e[:, 0]
+    dy = e[:, 3] - e[:, 1]
+    length = np.hypot(dx, dy)
+    e, dx, dy, length = e[length > 0], dx[length > 0], dy[length > 0], length[length > 0]
+
+    # point to segment distances
+    t = np.clip(((x - e[:, 0]) * dx + (y - e[:, 1]) * dy) / (length * length), 0.0, 1.0)
+    within = np.hypot(e[:, 0] + t * dx - x, e[:, 1] + t * dy - y) < radius
+    if not within.any():
+        return 1.0
+    e, dx, dy, length = e[within], dx[within], dy[within], length[within]
+
+    # all nearby segments on the line of the longest one
+    j = np.argmax(length)
+    ux = dx[j] / length[j]
+    uy = dy[j] / length[j]
+    offsets = (e[:, [0, 2]] - e[j, 0]) * uy - (e[:, [1, 3]] - e[j, 1]) * ux
+    if np.abs(offsets).max() > tolerance:
+        return None
+
+    d = min(abs((x - e[j, 0]) * uy - (y - e[j, 1]) * ux), radius)
+    cap = radius * radius * math.acos(d / radius) - d * math.sqrt(radius * radius - d * d)
+    return 1.0 - cap / (math.pi * radius * radius)
+
+
+def locality_attributes(geom, localities, candidates):
+
+    if len(candidates) == 1:
+        return localities.names[candidates[0]], 100.0
+
+    if len(candidates) > 1:
+        # determine largest locality by area if contained within multiple
+        geom_buffer = None
+        localities_ranked = []
+        for i in candidates:
+            share = boundary_share(localities.edges(i), geom.x, geom.y)
+            if share is None:
+                if geom_buffer is None:
+                    geom_buffer = geom.buffer(TIE_BREAK_BUFFER)
+                share = localities.geoms[i].intersection(geom_buffer).area / TIE_BREAK_AREA
+            localities_ranked.append((localities.names[i], share))
+        return max(localities_ranked, key=lambda x: x[-1])
+
+    return 'UNKNOWN', 0.0
+
+
+def lga_attributes(lgas, candidates):
+
+    if candidates:
+        return sorted(lgas.names[i] for i in candidates)[0]
+    return 'UNKNOWN'
+
+
+def classify_localities(xs, ys, localities):
+
+    candidates = Candidates(localities.query_points(xs, ys), len(xs))
+
+    names = np.full(len(xs), 'UNKNOWN', dtype=object)
+    percents = np.zeros(len(xs), dtype=np.float64)
+
+    mask, poly_idx = candidates.single()
+    names[mask] = localities.names_array[poly_idx]
+    percents[mask] = 100.0
+
+    for n, poly_idx in candidates.multiple():
+        geom = shapely.geometry.Point(xs[n], ys[n])
+        names[n], percents[n] = locality_attributes(geom, localities, poly_idx)
+
+    return names, percents, candidates.counts
+
+
+def classify_lgas(xs, ys, lgas):
+
+    candidates = Candidates(lgas.query_points(xs, ys), len(xs))
+
+    names = np.full(len(xs), 'UNKNOWN', dtype=object)
+
+    mask, poly_idx = candidates.single()
+    names[mask] = lgas.names_array[poly_idx]
+
+    for n, poly_idx in candidates.multiple():
+        names[n] = lga_attributes(lgas, poly_idx)
+
+    return names
+
+
+def read_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def tile_points(xs, ys, tile_size):
+    # yields (tile bounds, point indices) for each tile containing points
+    if len(xs) == 0:
+        return
+    cols = np.floor(xs / tile_size).astype(np.int64)
+    rows = np.floor(ys / tile_size).astype(np.int64)
+    tiles, inverse = np.unique(cols * (rows.max() - rows.min() + 1) + (rows - rows.min()), return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    counts = np.bincount(inverse)
+    for idx in np.split(order, np.cumsum(counts)[:-1]):
+        col = cols[idx[0]]
+        row = rows[idx[0]]
+        yield (col * tile_size, row * tile_size, (col + 1) * tile_size, (row + 1) * tile_size), idx
+
+
+def classify_tile(task):
+    xs, ys, localities, lgas, grid_cell = task
+
+    locality_names = np.full(len(xs), 'UNKNOWN', dtype=object)
+    locality_percents = np.zeros(len(xs), dtype=np.float64)
+    locality_counts = np.zeros(len(xs), dtype=np.int64)
+    lga_names = np.full(len(xs), 'UNKNOWN', dtype=object)
+
+    # tiles outside every polygon (offshore) have nothing to index
+    if localities[1]:
+        locality_names, locality_percents, locality_counts = classify_localities(xs, ys, PolygonLayer(*localities, grid_cell=grid_cell))
+    if lgas[1]:
+        lga_names = classify_lgas(xs, ys, PolygonLayer(*lgas, grid_cell=grid_cell))
+    return locality_names, locality_percents, locality_counts, lga_names
+
+
+def load_detail_rows(sbc, layer, columns, intersect_counts):
+
+    if layer.intersect_count:
+        # number of localities containing the point, from the locality query
+        columns.append(intersect_counts.tolist())
+
+    for enum, row in enumerate(itertools.izip(*columns), 1):
+        sbc.add_row(row)
+        if enum % layer.flush_count == 0:
+            sbc.flush()
+    sbc.flush()
+
+
+def create_detail_table(estamap_version, layer):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+
+    sql_script = os.path.join(em.path, 'sql', 'detail_tables', layer.sql_script)
+    logging.info('running sql script: {}'.format(sql_script))
+
+    dbpy.exec_script(em.server, em.database_name, sql_script)
+
+
+def calc_point_attributes(estamap_version, layer, polygons, chunk_size=100000, transform=None):
+
+    logging.info('environment: {}'.format(layer.name))
+    em = gis.ESTAMAP(estamap_version)
+    if transform is None:
+        transform = coord_transform.IngrTransform()
+
+    logging.info('looping {}...'.format(layer.name))
+    count = 0
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, layer.name),
+                               field_names=[layer.key_field, 'SHAPE@X', 'SHAPE@Y'],
+                               sql_clause=(None, 'ORDER BY {}'.format(layer.key_field))) as sc, \
+         dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.' + layer.detail_table) as sbc:
+
+        for chunk in read_chunks(sc, chunk_size):
+
+            keys = [row[0] for row in chunk]
+            xs = np.array([row[1] for row in chunk], dtype=np.float64)
+            ys = np.array([row[2] for row in chunk], dtype=np.float64)
+            xs_ingr, ys_ingr, xs_ingr_uor, ys_ingr_uor = transform(xs, ys)
+
+            # locality
+            locality_names, locality_percents, locality_counts = classify_localities(xs, ys, polygons.localities)
+            logging.info('within 2 localities: {}'.format(int(np.count_nonzero(locality_counts > 1))))
+
+            # lga
+            lga_names = classify_lgas(xs, ys, polygons.lgas)
+
+            load_detail_rows(sbc, layer,
+                             [keys,
+                              locality_names.tolist(), locality_percents.tolist(),
+                              xs.tolist(), ys.tolist(),
+                              xs_ingr.tolist(), ys_ingr.tolist(),
+                              xs_ingr_uor.tolist(), ys_ingr_uor.tolist(),
+                              lga_names.tolist()],
+                             locality_counts)
+
+            count += len(keys)
+            logging.info(count)
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+
+def calc_point_attributes_tiled(estamap_version, layer, polygons, processes, tile_size=25000, grid_cell=250, transform=None):
+
+    logging.info('environment: {}'.format(layer.name))
+    em = gis.ESTAMAP(estamap_version)
+    if transform is None:
+        transform = coord_transform.IngrTransform()
+
+    logging.info('reading {}...'.format(layer.name))
+    keys = []
+    xs = []
+    ys = []
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, layer.name),
+                               field_names=[layer.key_field, 'SHAPE@X', 'SHAPE@Y'],
+                               sql_clause=(None, 'ORDER BY {}'.format(layer.key_field))) as sc:
+        for key, x, y in sc:
+            keys.append(key)
+            xs.append(x)
+            ys.append(y)
+    xs = np.array(xs, dtype=np.float64)
+    ys = np.array(ys, dtype=np.float64)
+    logging.info(len(keys))
+    xs_ingr, ys_ingr, xs_ingr_uor, ys_ingr_uor = transform(xs, ys)
+
+    locality_names = np.full(len(keys), 'UNKNOWN', dtype=object)
+    locality_percents = np.zeros(len(keys), dtype=np.float64)
+    locality_counts = np.zeros(len(keys), dtype=np.int64)
+    lga_names = np.full(len(keys), 'UNKNOWN', dtype=object)
+
+    tiles = list(tile_points(xs, ys, tile_size))
+    logging.info('classifying {} tiles, processes: {}'.format(len(tiles), processes))
+
+    def tasks():
+        for bounds, idx in tiles:
+            yield (xs[idx], ys[idx],
+                   polygons.localities.subset(bounds),
+                   polygons.lgas.subset(bounds),
+                   grid_cell)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        enum = 0
+        for enum, ((bounds, idx), result) in enumerate(itertools.izip(tiles, pool.imap(classify_tile, tasks())), 1):
+            locality_names[idx], locality_percents[idx], locality_counts[idx], lga_names[idx] = result
+            if enum % 100 == 0:
+                logging.info(enum)
+        logging.info(enum)
+    finally:
+        pool.close()
+        pool.join()
+    logging.info('within 2 localities: {}'.format(int(np.count_nonzero(locality_counts > 1))))
+
+    logging.info('loading {}...'.format(layer.detail_table))
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.' + layer.detail_table) as sbc:
+        load_detail_rows(sbc, layer,
+                         [keys,
+                          locality_names.tolist(), locality_percents.tolist(),
+                          xs.tolist(), ys.tolist(),
+                          xs_ingr.tolist(), ys_ingr.tolist(),
+                          xs_ingr_uor.tolist(), ys_ingr_uor.tolist(),
+                          lga_names.tolist()],
+                         locality_counts)
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+
+def calc_point_layers(estamap_version, layers, polygons=None, chunk_size=100000, grid_cell=250,
+                      processes=1, tile_size=25000):
+
+    if polygons is None:
+        # workers build their own grids over the tile polygons
+        polygons = PolygonIndex.load(estamap_version, grid_cell if processes <= 1 else 0)
+    transform = coord_transform.IngrTransform()
+
+    for layer in layers:
+        create_detail_table(estamap_version, layer)
+        if processes > 1:
+            calc_point_attributes_tiled(estamap_version, layer, polygons, processes, tile_size, grid_cell, transform)
+        else:
+            calc_point_attributes(estamap_version, layer, polygons, chunk_size, transform)
+
+
+if __name__ == '__main__':
+
+    sys.argv.append('--estamap_version=DEV')
+
+    with log.LogConsole():
+
+        logging.info('parsing args')
+        args = docopt(__doc__)
+
+        logging.info('variables')
+        estamap_version = args['--estamap_version']
+        layers = [LAYERS[name.strip().upper()] for name in args['--layers'].split(',')]
+        chunk_size = int(args['--chunk_size'])
+        grid_cell = float(args['--grid_cell'])
+        processes = int(args['--processes'])
+        tile_size = float(args['--tile_size'])
+        log_file = args['--log_file']
+        log_path = args['--log_path']
+
+        with log.LogFile(log_file, log_path):
+            logging.info('start')
+            try:
+
+                calc_point_layers(estamap_version, layers, chunk_size=chunk_size, grid_cell=grid_cell,
+                                  processes=processes, tile_size=tile_size)
+
+            except Exception as err:
+                logging.exception('error occured running function.')
+                raise
+            logging.info('finished')
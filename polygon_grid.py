@@ -0,0 +1,194 @@
+'''
+Interior / boundary grid over a set of polygons (VicGrid metres).
+
+Each cell of a regular grid is marked as:
+  >= 0  wholly inside that polygon (index into the polygon list)
+    -1  outside every polygon
+    -2  boundary cell, touched by a polygon boundary or covered by more than
+        one polygon. The candidate polygons are kept per cell.
+
+Points falling in interior or outside cells are resolved with one array
+lookup, only boundary cell points need an exact geometry test, against the
+candidate polygons of their cell.
+
+The owner array is int16 when the polygon count allows; at the default 250m
+cell the grid over Victoria is about 10M cells (20MB) per layer.
+
+Cells are classified without per cell geometry tests: boundary cells are the
+cells touched by the polygon edges (edges split into pieces no longer than a
+cell), the remaining cells are filled per row with a scanline of the cell
+centres.
+'''
+import math
+import logging
+
+import numpy as np
+
+
+OUTSIDE = -1
+BOUNDARY = -2
+
+
+def polygon_rings(geom):
+    if geom.geom_type == 'Polygon':
+        parts = [geom]
+    else:
+        parts = list(geom.geoms)
+    for part in parts:
+        yield part.exterior.coords
+        for interior in part.interiors:
+            yield interior.coords
+
+
+def polygon_edges(geom):
+    edges = []
+    for ring in polygon_rings(geom):
+        coords = np.asarray(ring, dtype=np.float64)[:, :2]
+        if len(coords) > 1:
+            edges.append(np.hstack([coords[:-1], coords[1:]]))
+    if not edges:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.vstack(edges)
+
+
+class PolygonGrid(object):
+
+    def __init__(self, geoms, cell_size=250.0):
+
+        self.cell_size = float(cell_size)
+
+        bounds = np.array([geom.bounds for geom in geoms], dtype=np.float64)
+        self.x0 = math.floor(bounds[:, 0].min() / self.cell_size) * self.cell_size - self.cell_size
+        self.y0 = math.floor(bounds[:, 1].min() / self.cell_size) * self.cell_size - self.cell_size
+        self.nx = int(math.ceil((bounds[:, 2].max() - self.x0) / self.cell_size)) + 2
+        self.ny = int(math.ceil((bounds[:, 3].max() - self.y0) / self.cell_size)) + 2
+
+        logging.info('building grid: {} x {} cells of {}m'.format(self.nx, self.ny, self.cell_size))
+        dtype = np.int16 if len(geoms) <= np.iinfo(np.int16).max else np.int32
+        self.owner = np.full(self.nx * self.ny, OUTSIDE, dtype=dtype)
+        pair_cells = []
+        pair_polys = []
+
+        for i, geom in enumerate(geoms):
+            edges = polygon_edges(geom)
+
+            # boundary cells
+            cells = self._boundary_cells(edges)
+            interior_owned = cells[self.owner[cells] >= 0]
+            pair_cells.append(interior_owned)
+            pair_polys.append(self.owner[interior_owned])
+            pair_cells.append(cells)
+            pair_polys.append(np.full(len(cells), i, dtype=np.int32))
+            self.owner[cells] = BOUNDARY
+
+            # interior cells, by cell centre
+            cells = self._interior_cells(edges, bounds[i])
+            owner = self.owner[cells]
+            owned = owner >= 0
+            overlap = cells[owner != OUTSIDE]
+            self.owner[cells[owner == OUTSIDE]] = i
+            pair_cells.append(cells[owned])
+            pair_polys.append(owner[owned])
+            pair_cells.append(overlap)
+            pair_polys.append(np.full(len(overlap), i, dtype=np.int32))
+            self.owner[overlap] = BOUNDARY
+
+        # candidates per boundary cell, deduplicated and sorted by cell
+        num_polys = max(len(geoms), 1)
+        keys = np.unique(np.concatenate(pair_cells).astype(np.int64) * num_polys +
+                         np.concatenate(pair_polys).astype(np.int64))
+        cell_dtype = np.int32 if self.nx * self.ny <= np.iinfo(np.int32).max else np.int64
+        self.candidate_cells = (keys // num_polys).astype(cell_dtype)
+        self.candidate_polys = (keys % num_polys).astype(dtype)
+        logging.info('boundary cells: {}'.format(int(np.count_nonzero(self.owner == BOUNDARY))))
+
+    def _boundary_cells(self, edges):
+
+        if len(edges) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # split edges so each piece spans at most 2 cells per axis
+        lengths = np.hypot(edges[:, 2] - edges[:, 0], edges[:, 3] - edges[:, 1])
+        pieces = np.maximum(1, np.ceil(lengths / self.cell_size)).astype(np.int64)
+        edge_idx = np.repeat(np.arange(len(edges)), pieces)
+        step = np.arange(len(edge_idx)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0 = step / pieces[edge_idx].astype(np.float64)
+        t1 = (step + 1) / pieces[edge_idx].astype(np.float64)
+        e = edges[edge_idx]
+        xa = e[:, 0] + (e[:, 2] - e[:, 0]) * t0
+        ya = e[:, 1] + (e[:, 3] - e[:, 1]) * t0
+        xb = e[:, 0] + (e[:, 2] - e[:, 0]) * t1
+        yb = e[:, 1] + (e[:, 3] - e[:, 1]) * t1
+
+        col_min = np.floor((np.minimum(xa, xb) - self.x0) / self.cell_size).astype(np.int64)
+        col_max = np.floor((np.maximum(xa, xb) - self.x0) / self.cell_size).astype(np.int64)
+        row_min = np.floor((np.minimum(ya, yb) - self.y0) / self.cell_size).astype(np.int64)
+        row_max = np.floor((np.maximum(ya, yb) - self.y0) / self.cell_size).astype(np.int64)
+
+        cells = np.concatenate([row_min * self.nx + col_min,
+                                row_min * self.nx + col_max,
+                                row_max * self.nx + col_min,
+                                row_max * self.nx + col_max])
+        return np.unique(cells)
+
+    def _interior_cells(self, edges, bounds):
+
+        if len(edges) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        xmin, ymin, xmax, ymax = bounds
+        row_first = int(math.floor((ymin - self.y0) / self.cell_size))
+        row_last = int(math.floor((ymax - self.y0) / self.cell_size))
+
+        y1 = edges[:, 1]
+        y2 = edges[:, 3]
+        cells = []
+        for row in xrange(row_first, row_last + 1):
+            yc = self.y0 + (row + 0.5) * self.cell_size
+
+            # scanline crossings, half open so shared vertices count once
+            crossing = ((y1 <= yc) & (yc < y2)) | ((y2 <= yc) & (yc < y1))
+            if not crossing.any():
+                continue
+            e = edges[crossing]
+            xs = np.sort(e[:, 0] + (yc - e[:, 1]) * (e[:, 2] - e[:, 0]) / (e[:, 3] - e[:, 1]))
+
+            for xa, xb in zip(xs[0::2], xs[1::2]):
+                col_a = int(math.ceil((xa - self.x0) / self.cell_size - 0.5))
+                col_b = int(math.floor((xb - self.x0) / self.cell_size - 0.5))
+                if col_b >= col_a:
+                    cells.append(np.arange(row * self.nx + col_a, row * self.nx + col_b + 1, dtype=np.int64))
+
+        if not cells:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(cells)
+
+    def cells(self, xs, ys):
+        cols = np.floor((np.asarray(xs, dtype=np.float64) - self.x0) / self.cell_size).astype(np.int64)
+        rows = np.floor((np.asarray(ys, dtype=np.float64) - self.y0) / self.cell_size).astype(np.int64)
+        valid = (cols >= 0) & (cols < self.nx) & (rows >= 0) & (rows < self.ny)
+        return np.where(valid, rows * self.nx + cols, -1)
+
+    def lookup(self, xs, ys):
+        cells = self.cells(xs, ys)
+        owner = np.full(len(cells), OUTSIDE, dtype=np.int32)
+        valid = cells >= 0
+        owner[valid] = self.owner[cells[valid]]
+        return owner
+
+    def lookup_xy(self, x, y):
+        col = int(math.floor((x - self.x0) / self.cell_size))
+        row = int(math.floor((y - self.y0) / self.cell_size))
+        if col < 0 or col >= self.nx or row < 0 or row >= self.ny:
+            return OUTSIDE, -1
+        cell = row * self.nx + col
+        return int(self.owner[cell]), cell
+
+    def candidate_pairs(self, cells):
+        # (index into cells, polygon index) for every candidate polygon of each boundary cell
+        cells = np.asarray(cells, dtype=np.int64)
+        start = np.searchsorted(self.candidate_cells, cells, side='left')
+        counts = np.searchsorted(self.candidate_cells, cells, side='right') - start
+        idx = np.repeat(np.arange(len(cells)), counts)
+        pos = np.arange(len(idx)) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        return idx, self.candidate_polys[pos]
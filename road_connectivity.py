@@ -0,0 +1,309 @@
+'''
+ROAD network connectivity over integer arrays.
+
+Nodes are the UFIs of ROAD_INFRASTRUCTURE and of the road ends, edges are the
+roads (PFI, FROM_UFI, TO_UFI) and the ROAD_PATCH connections (MERGE_TRANSPORT
+= 1), both held as node index arrays. Components are labelled in one pass over
+the edges with a union-find (union by size, path halving).
+
+Patch scenarios: components of the base network (without ROAD_PATCH) are
+labelled once, a candidate set of patch edges is then applied as unions of
+base components only (PatchScenario), giving the components each patch set
+joins and the roads it connects to the seed nodes without relabelling the
+network.
+
+Critical elements: bridges (roads) and articulation points (nodes) whose loss
+splits a component, found in one iterative Tarjan depth first search over the
+network in CSR form (ROAD and ROAD_PATCH edges), with the number of nodes each
+would cut off from the rest of its component.
+'''
+import os
+import logging
+import itertools
+
+import numpy as np
+import arcpy
+
+import dev as gis
+
+
+class UnionFind(object):
+
+    def __init__(self, size):
+        self.parent = list(xrange(size))
+        self.sizes = [1] * size
+
+    def __len__(self):
+        return len(self.parent)
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.sizes[a] < self.sizes[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.sizes[a] += self.sizes[b]
+        return a
+
+    def union_edges(self, us, vs):
+        for u, v in itertools.izip(us, vs):
+            self.union(u, v)
+
+    def roots(self):
+        return np.array([self.find(x) for x in xrange(len(self.parent))], dtype=np.int64)
+
+
+def critical_elements(num_nodes, edge_from, edge_to):
+    # bridges and articulation points of an undirected multigraph (parallel edges are not bridges).
+    # returns (bridge edges, cut off nodes, component nodes), (articulation nodes, cut off nodes, component nodes)
+    edge_from = np.asarray(edge_from, dtype=np.int64)
+    edge_to = np.asarray(edge_to, dtype=np.int64)
+    edges = np.flatnonzero(edge_from != edge_to)
+
+    # CSR adjacency, both directions of every edge
+    src = np.concatenate([edge_from[edges], edge_to[edges]])
+    order = np.argsort(src, kind='mergesort')
+    offsets = np.searchsorted(src[order], np.arange(num_nodes + 1)).tolist()
+    neighbours = np.concatenate([edge_to[edges], edge_from[edges]])[order].tolist()
+    neighbour_edges = np.concatenate([edges, edges])[order].tolist()
+
+    disc = [-1] * num_nodes
+    low = [0] * num_nodes
+    sizes = [1] * num_nodes
+    parent_edge = [-1] * num_nodes
+    components = [0] * num_nodes
+    component_sizes = []
+    bridges = []
+    separated = {}
+
+    time = 0
+    for root in xrange(num_nodes):
+        if disc[root] >= 0:
+            continue
+        start = time
+        component = len(component_sizes)
+        disc[root] = low[root] = time
+        components[root] = component
+        time += 1
+        stack = [[root, offsets[root]]]
+        while stack:
+            top = stack[-1]
+            node = top[0]
+            i = top[1]
+            if i < offsets[node + 1]:
+                top[1] = i + 1
+                if neighbour_edges[i] == parent_edge[node]:
+                    continue
+                neighbour = neighbours[i]
+                if disc[neighbour] < 0:
+                    parent_edge[neighbour] = neighbour_edges[i]
+                    disc[neighbour] = low[neighbour] = time
+                    components[neighbour] = component
+                    time += 1
+                    stack.append([neighbour, offsets[neighbour]])
+                elif disc[neighbour] < low[node]:
+                    low[node] = disc[neighbour]
+            else:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    sizes[parent] += sizes[node]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+                    if low[node] > disc[parent]:
+                        bridges.append((parent_edge[node], node))
+                    if low[node] >= disc[parent]:
+                        separated.setdefault(parent, []).append(sizes[node])
+        component_sizes.append(time - start)
+
+    bridge_edges, bridge_cut, bridge_component = [], [], []
+    for edge, child in bridges:
+        component_size = component_sizes[components[child]]
+        bridge_edges.append(edge)
+        bridge_cut.append(min(sizes[child], component_size - sizes[child]))
+        bridge_component.append(component_size)
+
+    # pieces left without an articulation node: its separated subtrees and the rest of the component
+    art_nodes, art_cut, art_component = [], [], []
+    for node, subtrees in sorted(separated.items()):
+        component_size = component_sizes[components[node]]
+        rest = component_size - 1 - sum(subtrees)
+        cut = component_size - 1 - max(max(subtrees), rest)
+        if cut > 0:
+            art_nodes.append(node)
+            art_cut.append(cut)
+            art_component.append(component_size)
+
+    return ((np.array(bridge_edges, dtype=np.int64), np.array(bridge_cut, dtype=np.int64),
+             np.array(bridge_component, dtype=np.int64)),
+            (np.array(art_nodes, dtype=np.int64), np.array(art_cut, dtype=np.int64),
+             np.array(art_component, dtype=np.int64)))
+
+
+class RoadConnectivity(object):
+
+    def __init__(self, ufis, pfis, from_ufis, to_ufis, patch_from_ufis=(), patch_to_ufis=()):
+
+        self.pfis = np.asarray(pfis, dtype=np.int64)
+        from_ufis = np.asarray(from_ufis, dtype=np.int64)
+        to_ufis = np.asarray(to_ufis, dtype=np.int64)
+        patch_from_ufis = np.asarray(patch_from_ufis, dtype=np.int64)
+        patch_to_ufis = np.asarray(patch_to_ufis, dtype=np.int64)
+
+        self.nodes = np.unique(np.concatenate([np.asarray(ufis, dtype=np.int64),
+                                               from_ufis, to_ufis,
+                                               patch_from_ufis, patch_to_ufis]))
+        self.road_from = self.node_index(from_ufis)
+        self.road_to = self.node_index(to_ufis)
+        self.patch_from = self.node_index(patch_from_ufis)
+        self.patch_to = self.node_index(patch_to_ufis)
+
+        union_find = UnionFind(len(self.nodes))
+        union_find.union_edges(self.road_from.tolist(), self.road_to.tolist())
+        union_find.union_edges(self.patch_from.tolist(), self.patch_to.tolist())
+
+        # components numbered 0.. in node order
+        _, self.node_components = np.unique(union_find.roots(), return_inverse=True)
+        self.component_sizes = np.bincount(self.node_components)
+
+    def __len__(self):
+        return len(self.component_sizes)
+
+    def node_index(self, ufis):
+        # index of each ufi in nodes, -1 when not a node
+        ufis = np.asarray(ufis, dtype=np.int64)
+        idx = np.clip(np.searchsorted(self.nodes, ufis), 0, max(len(self.nodes) - 1, 0))
+        found = (len(self.nodes) > 0) & (self.nodes[idx] == ufis)
+        return np.where(found, idx, -1)
+
+    @property
+    def road_components(self):
+        return self.node_components[self.road_from]
+
+    @property
+    def component_roads(self):
+        # number of roads in each component
+        return np.bincount(self.road_components, minlength=len(self))
+
+    def seed_components(self, seed_ufis):
+        seeds = self.node_index(seed_ufis)
+        return np.unique(self.node_components[seeds[seeds >= 0]])
+
+    def patch_components(self, patch_from_ufis, patch_to_ufis):
+        # (from component, to component) of each patch edge, -1 when the patch node is not in the network
+        from_nodes = self.node_index(patch_from_ufis)
+        to_nodes = self.node_index(patch_to_ufis)
+        return (np.where(from_nodes >= 0, self.node_components[from_nodes], -1),
+                np.where(to_nodes >= 0, self.node_components[to_nodes], -1))
+
+    def patch_scenario(self, patch_from_ufis, patch_to_ufis):
+        return PatchScenario(self, *self.patch_components(patch_from_ufis, patch_to_ufis))
+
+    def critical(self):
+        # (road PFIs, cut off nodes, component nodes), (node UFIs, cut off nodes, component nodes),
+        # patch edges are part of the network but not reported
+        (edges, edge_cut, edge_component), (nodes, node_cut, node_component) = critical_elements(
+            len(self.nodes),
+            np.concatenate([self.road_from, self.patch_from]),
+            np.concatenate([self.road_to, self.patch_to]))
+        roads = edges < len(self.pfis)
+        return ((self.pfis[edges[roads]], edge_cut[roads], edge_component[roads]),
+                (self.nodes[nodes], node_cut, node_component))
+
+    def connected_nodes(self, seed_ufis):
+        # per node, in the component of any seed UFI
+        components = np.zeros(len(self), dtype=bool)
+        components[self.seed_components(seed_ufis)] = True
+        return components[self.node_components]
+
+    def connected_roads(self, seed_ufis):
+        # per road, in the component of any seed UFI
+        return self.connected_nodes(seed_ufis)[self.road_from]
+
+    @classmethod
+    def from_tables(cls, estamap_version, with_patch=True):
+
+        em = gis.ESTAMAP(estamap_version)
+
+        logging.info('reading ROAD_INFRASTRUCTURE')
+        nodes = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
+                                           field_names=['UFI'])
+        logging.info('reading ROAD')
+        roads = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD'),
+                                           field_names=['PFI', 'FROM_UFI', 'TO_UFI'],
+                                           sql_clause=(None, 'ORDER BY PFI'))
+        patch_from_ufis, patch_to_ufis = (), ()
+        if with_patch:
+            logging.info('reading ROAD_PATCH')
+            patches = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD_PATCH'),
+                                                 field_names=['FROM_UFI', 'TO_UFI'],
+                                                 where_clause='MERGE_TRANSPORT = 1')
+            patch_from_ufis, patch_to_ufis = patches['FROM_UFI'], patches['TO_UFI']
+
+        logging.info('nodes: {}, roads: {}, patches: {}'.format(len(nodes), len(roads), len(patch_from_ufis)))
+        return cls(nodes['UFI'], roads['PFI'], roads['FROM_UFI'], roads['TO_UFI'],
+                   patch_from_ufis, patch_to_ufis)
+
+
+class PatchScenario(object):
+
+    def __init__(self, connectivity, from_components, to_components):
+
+        self.connectivity = connectivity
+        self.from_components = np.asarray(from_components, dtype=np.int64)
+        self.to_components = np.asarray(to_components, dtype=np.int64)
+
+        # union-find over the base components touched by the patches only
+        self.parent = {}
+        for a, b in itertools.izip(self.from_components.tolist(), self.to_components.tolist()):
+            if a >= 0 and b >= 0:
+                self.union(a, b)
+
+    def find(self, component):
+        parent = self.parent
+        root = component
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while component != root:
+            parent[component], component = root, parent[component]
+        return root
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def joined(self):
+        # lists of base components joined into one, smallest component first
+        groups = {}
+        for component in list(self.parent):
+            root = self.find(component)
+            groups.setdefault(root, set([root])).add(component)
+        return sorted(sorted(group) for group in groups.values())
+
+    def connected_components(self, seed_ufis):
+        # per base component, connected to any seed UFI with the patches applied
+        components = np.zeros(len(self.connectivity), dtype=bool)
+        seed_roots = set(self.find(component) for component in self.connectivity.seed_components(seed_ufis).tolist())
+        components[list(seed_roots)] = True
+        for component in self.parent:
+            if self.find(component) in seed_roots:
+                components[component] = True
+        return components
+
+    def connected_roads(self, seed_ufis):
+        return self.connected_components(seed_ufis)[self.connectivity.road_components]
+
+    def newly_connected_roads(self, seed_ufis):
+        # per road, connected to the seeds only with the patches applied
+        return self.connected_roads(seed_ufis) & ~self.connectivity.connected_roads(seed_ufis)
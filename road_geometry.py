@@ -0,0 +1,415 @@
+'''
+ROAD geometry as flat (ragged) coordinate arrays.
+
+All ROAD vertices are read in one FeatureClassToNumPyArray call (exploded to
+points, ordered by PFI), each road is a slice of the flat arrays given by
+offsets. Interpolation along the roads and bearings are whole-array numpy
+instead of a shapely geometry per road.
+
+The fused stage (calc_road_geometry) reads ROAD once, in VicGrid, and:
+  - loads ROAD_DETAIL (length, segment count)
+  - loads ROAD_BEARING (INGR bearings, vertices transformed by coord_transform)
+  - saves a road geometry cache (numpy .npz of vertices, nodes, feature type
+    and bearings) read by 0025 calc_road_turn and 0026 calc_road_xstreet in
+    place of their own ROAD / ROAD_BEARING reads, when given --road_geometry.
+    The cache records the estamap version, ROAD count and a checksum of ROAD;
+    a cache that no longer matches ROAD is refused.
+  - optionally loads ROAD_BEARING_PROFILE (bearings at each of
+    --profile_offsets) and ROAD_CURVATURE (total absolute turning along each
+    road), so turn angles can use another offset without re-reading ROAD.
+
+Usage:
+  road_geometry.py [options]
+
+Options:
+  --estamap_version <version>  ESTAMap Version
+  --cache <file>          Road geometry cache. [default: c:\\temp\\road_geometry.npz]
+  --profile_offsets <offsets>  Comma separated bearing profile offsets (metres), none to skip. [default: 2.5,10,25]
+  --log_file <file>       Log File name. [default: road_geometry.log]
+  --log_path <folder>     Folder to store the log file. [default: c:\\temp]
+'''
+import os
+import sys
+import logging
+import itertools
+
+from docopt import docopt
+import numpy as np
+import shapely.geometry
+import arcpy
+
+import log
+import dev as gis
+import dbpy
+
+import coord_transform
+
+
+BEARING_OFFSET = 2.5
+PROFILE_OFFSETS = (2.5, 10.0, 25.0)
+
+
+class RoadVertices(object):
+
+    def __init__(self, pfis, offsets, xs, ys):
+        self.pfis = np.asarray(pfis)
+        # road n is vertices offsets[n]:offsets[n + 1]
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.first = self.offsets[:-1]
+        self.last = self.offsets[1:] - 1
+
+        # cumulative length over the flat arrays, segments between two roads have no length
+        seg_lengths = np.hypot(np.diff(self.xs), np.diff(self.ys))
+        seg_lengths[self.offsets[1:-1] - 1] = 0.0
+        self.cum_lengths = np.concatenate([[0.0], np.cumsum(seg_lengths)])
+        self.lengths = self.cum_lengths[self.last] - self.cum_lengths[self.first]
+
+    def __len__(self):
+        return len(self.pfis)
+
+    @classmethod
+    def from_feature_class(cls, estamap_version, spatial_reference=None):
+
+        em = gis.ESTAMAP(estamap_version)
+
+        logging.info('reading ROAD vertices')
+        vertices = arcpy.da.FeatureClassToNumPyArray(in_table=os.path.join(em.sde, 'ROAD'),
+                                                     field_names=['PFI', 'SHAPE@X', 'SHAPE@Y'],
+                                                     spatial_reference=spatial_reference,
+                                                     explode_to_points=True,
+                                                     sql_clause=(None, 'ORDER BY PFI'))
+        pfis = vertices['PFI']
+        starts = np.flatnonzero(pfis[1:] != pfis[:-1]) + 1
+        offsets = np.concatenate([[0], starts, [len(pfis)]])
+        logging.info('roads: {}, vertices: {}'.format(len(offsets) - 1, len(pfis)))
+        return cls(pfis[offsets[:-1]], offsets, vertices['SHAPE@X'], vertices['SHAPE@Y'])
+
+    def interpolate(self, distances):
+        # (xs, ys) at distance along each road, as shapely interpolate:
+        # negative distances are from the end, clamped to the road
+        distances = np.where(distances < 0, self.lengths + distances, distances)
+        targets = self.cum_lengths[self.first] + np.clip(distances, 0.0, self.lengths)
+        i = np.searchsorted(self.cum_lengths, targets, side='right') - 1
+        i = np.clip(i, self.first, np.maximum(self.last - 1, self.first))
+        j = np.minimum(i + 1, self.last)
+        seg_lengths = self.cum_lengths[j] - self.cum_lengths[i]
+        t = np.where(seg_lengths > 0, (targets - self.cum_lengths[i]) / np.where(seg_lengths > 0, seg_lengths, 1.0), 0.0)
+        return (self.xs[i] + t * (self.xs[j] - self.xs[i]),
+                self.ys[i] + t * (self.ys[j] - self.ys[i]))
+
+
+def bearing(dx, dy):
+    angle = np.arctan2(dy, dx) * 180 / np.pi
+    return np.where(angle < 0, (90 - angle) % 360, (450 - angle) % 360)
+
+
+def road_bearings(vertices, offset=BEARING_OFFSET):
+    # returns (entry, exit, flipped entry, flipped exit) bearings per road
+
+    x_entry, y_entry = vertices.interpolate(np.full(len(vertices), offset))
+    entry_bearing = bearing(x_entry - vertices.xs[vertices.first], y_entry - vertices.ys[vertices.first])
+
+    x_exit, y_exit = vertices.interpolate(vertices.lengths - offset)
+    exit_bearing = bearing(vertices.xs[vertices.last] - x_exit, vertices.ys[vertices.last] - y_exit)
+
+    return entry_bearing, exit_bearing, (exit_bearing + 180) % 360, (entry_bearing + 180) % 360
+
+
+def road_curvature(vertices):
+    # total absolute change of direction (degrees) along each road, zero length segments ignored
+    dx = np.diff(vertices.xs)
+    dy = np.diff(vertices.ys)
+    seg_roads = np.searchsorted(vertices.offsets, np.arange(len(dx)), side='right') - 1
+    valid = (np.hypot(dx, dy) > 0) & (np.arange(len(dx)) != vertices.last[seg_roads])
+    headings = np.arctan2(dy[valid], dx[valid]) * 180 / np.pi
+    seg_roads = seg_roads[valid]
+
+    turns = (np.diff(headings) + 180) % 360 - 180
+    same_road = seg_roads[1:] == seg_roads[:-1]
+    return np.bincount(seg_roads[1:][same_road], weights=np.abs(turns[same_road]), minlength=len(vertices))
+
+
+def road_signature(estamap_version):
+    # (estamap version, ROAD count, ROAD checksum) identifying the ROAD a cache was built from
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+    count, checksum = conn.execute('''
+        SELECT
+            COUNT(*),
+            CHECKSUM_AGG(CHECKSUM(PFI, FROM_UFI, TO_UFI, FEATURE_TYPE_CODE, SHAPE.STLength()))
+        FROM ROAD
+        ''').fetchone()
+    return str(estamap_version), int(count), int(checksum or 0)
+
+
+class RoadGeometry(object):
+
+    def __init__(self, pfis, from_ufis, to_ufis, ftcs, offsets, xs, ys, xs_ingr, ys_ingr, signature=None):
+        self.pfis = np.asarray(pfis)
+        self.from_ufis = np.asarray(from_ufis)
+        self.to_ufis = np.asarray(to_ufis)
+        self.ftcs = np.asarray(ftcs)
+        self.vertices = RoadVertices(pfis, offsets, xs, ys)
+        # bearings are in INGR
+        self.ingr_vertices = RoadVertices(pfis, offsets, xs_ingr, ys_ingr)
+        # (entry, exit, flipped entry, flipped exit)
+        self.bearings = self.bearings_at(BEARING_OFFSET)
+        # road_signature of the ROAD read, None when unknown
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.pfis)
+
+    @property
+    def segment_counts(self):
+        return np.diff(self.vertices.offsets) - 1
+
+    def bearings_at(self, offset):
+        return road_bearings(self.ingr_vertices, offset)
+
+    @property
+    def curvature(self):
+        return road_curvature(self.ingr_vertices)
+
+    @classmethod
+    def from_feature_class(cls, estamap_version, transform=None):
+
+        em = gis.ESTAMAP(estamap_version)
+        if transform is None:
+            transform = coord_transform.IngrTransform()
+
+        logging.info('reading ROAD')
+        rows = arcpy.da.FeatureClassToNumPyArray(in_table=os.path.join(em.sde, 'ROAD'),
+                                                 field_names=['PFI', 'FROM_UFI', 'TO_UFI', 'FEATURE_TYPE_CODE',
+                                                              'SHAPE@X', 'SHAPE@Y'],
+                                                 explode_to_points=True,
+                                                 sql_clause=(None, 'ORDER BY PFI'))
+        pfis = rows['PFI']
+        starts = np.flatnonzero(pfis[1:] != pfis[:-1]) + 1
+        offsets = np.concatenate([[0], starts, [len(pfis)]])
+        first = offsets[:-1]
+        logging.info('roads: {}, vertices: {}'.format(len(first), len(pfis)))
+
+        logging.info('transform INGR')
+        xs_ingr, ys_ingr, _, _ = transform(rows['SHAPE@X'], rows['SHAPE@Y'])
+
+        logging.info('calc bearings')
+        return cls(pfis[first], rows['FROM_UFI'][first], rows['TO_UFI'][first], rows['FEATURE_TYPE_CODE'][first],
+                   offsets, rows['SHAPE@X'], rows['SHAPE@Y'], xs_ingr, ys_ingr)
+
+    def save(self, path):
+        logging.info('saving road geometry cache: {}'.format(path))
+        with open(path, 'wb') as f:
+            estamap_version, road_count, road_checksum = self.signature or ('', -1, 0)
+            np.savez(f,
+                     pfis=self.pfis, from_ufis=self.from_ufis, to_ufis=self.to_ufis, ftcs=self.ftcs,
+                     offsets=self.vertices.offsets, xs=self.vertices.xs, ys=self.vertices.ys,
+                     xs_ingr=self.ingr_vertices.xs, ys_ingr=self.ingr_vertices.ys,
+                     estamap_version=estamap_version, road_count=road_count, road_checksum=road_checksum)
+
+    @classmethod
+    def load(cls, path):
+        logging.info('loading road geometry cache: {}'.format(path))
+        data = np.load(path)
+        signature = None
+        if 'estamap_version' in data.files:
+            signature = (str(data['estamap_version']), int(data['road_count']), int(data['road_checksum']))
+        return cls(data['pfis'], data['from_ufis'], data['to_ufis'], data['ftcs'],
+                   data['offsets'], data['xs'], data['ys'], data['xs_ingr'], data['ys_ingr'], signature)
+
+    def coords(self, n):
+        start, end = self.vertices.offsets[n], self.vertices.offsets[n + 1]
+        return zip(self.vertices.xs[start:end].tolist(), self.vertices.ys[start:end].tolist())
+
+
+def read_roads(estamap_version, cache=None):
+    # (PFI, FROM_UFI, TO_UFI, FEATURE_TYPE_CODE) from the cache, else ROAD
+    if cache is not None:
+        for row in itertools.izip(cache.pfis.tolist(), cache.from_ufis.tolist(),
+                                  cache.to_ufis.tolist(), cache.ftcs.tolist()):
+            yield row
+        return
+
+    em = gis.ESTAMAP(estamap_version)
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
+                               field_names=['PFI', 'FROM_UFI', 'TO_UFI', 'FEATURE_TYPE_CODE']) as sc:
+        for row in sc:
+            yield row
+
+
+def read_road_wkbs(estamap_version, cache=None):
+    # (PFI, WKB) from the cache, else ROAD
+    if cache is not None:
+        for n, pfi in enumerate(cache.pfis.tolist()):
+            yield pfi, shapely.geometry.LineString(cache.coords(n)).wkb
+        return
+
+    em = gis.ESTAMAP(estamap_version)
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
+                               field_names=['PFI', 'SHAPE@WKB']) as sc:
+        for row in sc:
+            yield row
+
+
+def read_road_lengths(estamap_version, cache=None):
+    # (PFI, length) from the cache, else ROAD
+    if cache is not None:
+        for row in itertools.izip(cache.pfis.tolist(), cache.vertices.lengths.tolist()):
+            yield row
+        return
+
+    em = gis.ESTAMAP(estamap_version)
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, 'ROAD'),
+                               field_names=['PFI', 'SHAPE@LENGTH']) as sc:
+        for row in sc:
+            yield row
+
+
+def read_road_bearings(estamap_version, cache=None, offset=BEARING_OFFSET):
+    # (PFI, ENTRY_BEARING, EXIT_BEARING, ENTRY_BEARING_FLIP, EXIT_BEARING_FLIP) from the cache,
+    # else ROAD_BEARING (or ROAD_BEARING_PROFILE for other offsets)
+    if cache is not None:
+        bearings = cache.bearings if offset == BEARING_OFFSET else cache.bearings_at(offset)
+        for row in itertools.izip(cache.pfis.tolist(), *[b.tolist() for b in bearings]):
+            yield row
+        return
+
+    em = gis.ESTAMAP(estamap_version)
+    table = 'ROAD_BEARING'
+    where_clause = None
+    if offset != BEARING_OFFSET:
+        table = 'ROAD_BEARING_PROFILE'
+        where_clause = 'BEARING_OFFSET = {}'.format(offset)
+    with arcpy.da.SearchCursor(in_table=os.path.join(em.sde, table),
+                               field_names=['PFI',
+                                            'ENTRY_BEARING',
+                                            'EXIT_BEARING',
+                                            'ENTRY_BEARING_FLIP',
+                                            'EXIT_BEARING_FLIP'],
+                               where_clause=where_clause) as sc:
+        for row in sc:
+            yield row
+
+
+def load_cache(cache_path, estamap_version):
+    # the cache when given and built from the current ROAD of estamap_version, None to read live
+    if not cache_path:
+        return None
+    if not os.path.exists(cache_path):
+        logging.info('road geometry cache not found, reading ROAD: {}'.format(cache_path))
+        return None
+    roads = RoadGeometry.load(cache_path)
+    signature = road_signature(estamap_version)
+    logging.info('cache: {}, ROAD: {}'.format(roads.signature, signature))
+    if roads.signature != signature:
+        raise Exception('road geometry cache {} does not match ROAD, rerun road_geometry.py'.format(cache_path))
+    return roads
+
+
+def calc_road_geometry(estamap_version, cache_path='c:\\temp\\road_geometry.npz'):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+
+    for sql_script in (os.path.join(em.path, 'sql', 'detail_tables', 'create_road_detail.sql'),
+                       os.path.join(em.path, 'sql', 'transport', 'create_road_bearing.sql')):
+        logging.info('running sql script: {}'.format(sql_script))
+        dbpy.exec_script(em.server, em.database_name, sql_script)
+
+    roads = RoadGeometry.from_feature_class(estamap_version)
+    roads.signature = road_signature(estamap_version)
+
+    logging.info('insert ROAD_DETAIL')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_DETAIL') as sbc:
+        sbc.load_data(zip(roads.pfis.tolist(), roads.vertices.lengths.tolist(), roads.segment_counts.tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+    logging.info('insert ROAD_BEARING')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_BEARING') as sbc:
+        sbc.load_data(zip(roads.pfis.tolist(), *[b.tolist() for b in roads.bearings]))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+    if cache_path:
+        roads.save(cache_path)
+    return roads
+
+
+def calc_road_bearing_profile(estamap_version, roads, offsets=PROFILE_OFFSETS):
+
+    logging.info('environment')
+    em = gis.ESTAMAP(estamap_version)
+    conn = dbpy.create_conn_pyodbc(em.server, em.database_name)
+
+    logging.info('dropping tables:')
+    for table in ('ROAD_BEARING_PROFILE', 'ROAD_CURVATURE'):
+        if dbpy.check_exists(table, conn):
+            logging.info(table)
+            conn.execute('drop table {}'.format(table))
+
+    logging.info('creating ROAD_BEARING_PROFILE')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_BEARING_PROFILE](
+        [PFI] [int] NOT NULL,
+        [BEARING_OFFSET] [float] NOT NULL,
+        [ENTRY_BEARING] [float] NULL,
+        [EXIT_BEARING] [float] NULL,
+        [ENTRY_BEARING_FLIP] [float] NULL,
+        [EXIT_BEARING_FLIP] [float] NULL
+    ) ON [PRIMARY]
+    ''')
+    logging.info('creating ROAD_CURVATURE')
+    conn.execute('''
+    CREATE TABLE [dbo].[ROAD_CURVATURE](
+        [PFI] [int] NOT NULL,
+        [TOTAL_CURVATURE] [float] NULL
+    ) ON [PRIMARY]
+    ''')
+    conn.commit()
+
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_BEARING_PROFILE') as sbc:
+        for offset in offsets:
+            logging.info('insert ROAD_BEARING_PROFILE: {}'.format(offset))
+            sbc.load_data(zip(roads.pfis.tolist(), itertools.repeat(offset),
+                              *[b.tolist() for b in roads.bearings_at(offset)]))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+    logging.info('insert ROAD_CURVATURE')
+    with dbpy.SQL_BULK_COPY(em.server, em.database_name, 'dbo.ROAD_CURVATURE') as sbc:
+        sbc.load_data(zip(roads.pfis.tolist(), roads.curvature.tolist()))
+    logging.info('count start: {}'.format(sbc.count_start))
+    logging.info('count finish: {}'.format(sbc.count_finish))
+
+
+if __name__ == '__main__':
+
+    sys.argv.append('--estamap_version=DEV')
+
+    with log.LogConsole():
+
+        logging.info('parsing args')
+        args = docopt(__doc__)
+
+        logging.info('variables')
+        estamap_version = args['--estamap_version']
+        cache_path = args['--cache']
+        profile_offsets = [float(offset) for offset in args['--profile_offsets'].split(',') if offset.strip() not in ('', 'none')]
+        log_file = args['--log_file']
+        log_path = args['--log_path']
+
+        with log.LogFile(log_file, log_path):
+            logging.info('start')
+            try:
+
+                roads = calc_road_geometry(estamap_version, cache_path)
+                if profile_offsets:
+                    calc_road_bearing_profile(estamap_version, roads, profile_offsets)
+
+            except Exception as err:
+                logging.exception('error occured running function.')
+                raise
+            logging.info('finished')
@@ -0,0 +1,121 @@
+'''
+In memory ROAD network in CSR (compressed sparse row) form.
+
+Built with numpy from ROAD PFI / FROM_UFI / TO_UFI. Road ends are grouped by
+node (UFI): node n has the road ends offsets[n]:offsets[n + 1], each end with
+its road index and whether it is the FROM end of the road. A road starting and
+ending at the same node has one end there (its FROM end).
+
+Turn restrictions are compiled once per node from ROAD_INFRASTRUCTURE into a
+rule bitmask, and once per road end into a connector flag, then applied to
+all turns as array masks.
+'''
+import itertools
+
+import numpy as np
+
+
+class RoadGraph(object):
+
+    def __init__(self, pfis, from_ufis, to_ufis):
+
+        self.pfis = np.asarray(pfis, dtype=np.int64)
+        self.from_ufis = np.asarray(from_ufis, dtype=np.int64)
+        self.to_ufis = np.asarray(to_ufis, dtype=np.int64)
+        num_roads = len(self.pfis)
+
+        roads = np.concatenate([np.arange(num_roads), np.arange(num_roads)])
+        ufis = np.concatenate([self.from_ufis, self.to_ufis])
+        is_from = np.concatenate([np.ones(num_roads, dtype=bool), np.zeros(num_roads, dtype=bool)])
+        keep = np.concatenate([np.ones(num_roads, dtype=bool), self.from_ufis != self.to_ufis])
+        roads, ufis, is_from = roads[keep], ufis[keep], is_from[keep]
+
+        # ends sorted by node, then road
+        order = np.lexsort((roads, ufis))
+        self.end_roads = roads[order]
+        self.end_is_from = is_from[order]
+        end_ufis = ufis[order]
+
+        self.nodes, starts = np.unique(end_ufis, return_index=True)
+        self.offsets = np.concatenate([starts, [len(end_ufis)]]).astype(np.int64)
+        self.end_nodes = np.repeat(np.arange(len(self.nodes)), np.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def degrees(self):
+        return np.diff(self.offsets)
+
+    def node_index(self, ufis):
+        # index of each ufi in nodes, -1 when not a node
+        ufis = np.asarray(ufis, dtype=np.int64)
+        idx = np.clip(np.searchsorted(self.nodes, ufis), 0, max(len(self.nodes) - 1, 0))
+        found = (len(self.nodes) > 0) & (self.nodes[idx] == ufis)
+        return np.where(found, idx, -1)
+
+    def end_pairs(self, nodes=None):
+        # (from ends, to ends) for every ordered pair of distinct road ends at each node,
+        # built per degree with one permutation array per degree.
+        degrees = self.degrees
+        node_mask = degrees > 1
+        if nodes is not None:
+            selected = np.zeros(len(self.nodes), dtype=bool)
+            selected[nodes] = True
+            node_mask &= selected
+
+        from_ends = []
+        to_ends = []
+        for degree in np.unique(degrees[node_mask]).tolist():
+            perm = np.array(list(itertools.permutations(range(degree), 2)), dtype=np.int64)
+            ends = self.offsets[np.flatnonzero(node_mask & (degrees == degree))][:, None] + np.arange(degree)
+            from_ends.append(ends[:, perm[:, 0]].ravel())
+            to_ends.append(ends[:, perm[:, 1]].ravel())
+
+        if not from_ends:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(from_ends), np.concatenate(to_ends)
+
+
+# rule bits
+# CONNECTOR_ONLY: the node's connector roads (CONPFI1, CONPFI2) only turn into each other
+CONNECTOR_ONLY = 1
+
+# FEATURE_TYPE_CODE (lower case) -> rule bits
+TURN_RULES = {
+    'tunnel': CONNECTOR_ONLY,
+}
+
+
+class TurnRestrictions(object):
+
+    def __init__(self, node_known, node_rules, end_connector):
+        # per node: has ROAD_INFRASTRUCTURE, rule bits. per road end: is a connector road of its node
+        self.node_known = node_known
+        self.node_rules = node_rules
+        self.end_connector = end_connector
+
+    @classmethod
+    def compile(cls, graph, ufis, ftcs, conpfi1s, conpfi2s, rules=TURN_RULES):
+
+        node_known = np.zeros(len(graph), dtype=bool)
+        node_rules = np.zeros(len(graph), dtype=np.int8)
+        conpfi1 = np.full(len(graph), -1, dtype=np.int64)
+        conpfi2 = np.full(len(graph), -1, dtype=np.int64)
+
+        nodes = graph.node_index(ufis)
+        found = nodes >= 0
+        node_known[nodes[found]] = True
+        node_rules[nodes[found]] = np.array([rules.get(str(ftc).lower(), 0) for ftc in ftcs], dtype=np.int8)[found]
+        conpfi1[nodes[found]] = np.array([-1 if c is None else c for c in conpfi1s], dtype=np.int64)[found]
+        conpfi2[nodes[found]] = np.array([-1 if c is None else c for c in conpfi2s], dtype=np.int64)[found]
+
+        end_pfis = graph.pfis[graph.end_roads]
+        end_connector = (end_pfis == conpfi1[graph.end_nodes]) | (end_pfis == conpfi2[graph.end_nodes])
+        return cls(node_known, node_rules, end_connector)
+
+    def allowed(self, from_ends, to_ends, end_nodes):
+        nodes = end_nodes[from_ends]
+        connector_only = (self.node_rules[nodes] & CONNECTOR_ONLY) != 0
+        return (self.node_known[nodes] &
+                (~connector_only | (self.end_connector[from_ends] == self.end_connector[to_ends])))
@@ -0,0 +1,234 @@
+'''
+ROAD topology built from geometry, in process.
+
+Road ends (first / last vertex) are snapped on a tolerance grid (0.01m, the
+XYTolerance the geometric network was built with): an end snaps to the
+nearest ROAD_INFRASTRUCTURE point within the tolerance, looked up in its own
+and the 8 neighbouring grid cells. Ends with no ROAD_INFRASTRUCTURE within
+the tolerance are snapped to each other into new (unnamed) nodes.
+
+The geometric connectivity (components of the snapped network) is compared
+with the attribute connectivity (FROM_UFI / TO_UFI, road_connectivity):
+  - a road end is a mismatch when it snaps to another node than its
+    FROM_UFI / TO_UFI, or to no ROAD_INFRASTRUCTURE, or its FROM_UFI / TO_UFI
+    is null. Null ends are left out of the attribute connectivity.
+  - a road is disconnected when it is not in the component of the seeds,
+    geometrically or by attribute
+'''
+import os
+import logging
+
+import numpy as np
+import arcpy
+
+import dev as gis
+
+import road_connectivity
+import road_geometry
+
+
+TOLERANCE = 0.01
+# FROM_UFI / TO_UFI read for a null, UFIs are positive
+NULL_UFI = -1
+
+
+class SnapGrid(object):
+
+    def __init__(self, xs, ys, tolerance=TOLERANCE):
+
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        self.tolerance = tolerance
+
+        keys = self.cell_keys(*self.cells(self.xs, self.ys))
+        self.order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[self.order]
+        # most points in one cell
+        self.max_count = int(np.unique(self.keys, return_counts=True)[1].max()) if len(self.keys) else 0
+
+    def __len__(self):
+        return len(self.xs)
+
+    def cells(self, xs, ys):
+        return (np.floor(xs / self.tolerance).astype(np.int64),
+                np.floor(ys / self.tolerance).astype(np.int64))
+
+    @staticmethod
+    def cell_keys(cols, rows):
+        return cols * (2 ** 32) + (rows + 2 ** 31)
+
+    def pairs(self, xs, ys):
+        # (query index, point index) of every point within the tolerance of each query point
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        queries = [np.zeros(0, dtype=np.int64)]
+        points = [np.zeros(0, dtype=np.int64)]
+        if len(self.keys) == 0:
+            return queries[0], points[0]
+
+        cols, rows = self.cells(xs, ys)
+        for dc in (-1, 0, 1):
+            for dr in (-1, 0, 1):
+                keys = self.cell_keys(cols + dc, rows + dr)
+                starts = np.searchsorted(self.keys, keys)
+                for n in xrange(self.max_count):
+                    pos = np.minimum(starts + n, len(self.keys) - 1)
+                    query = np.flatnonzero((starts + n < len(self.keys)) & (self.keys[pos] == keys))
+                    point = self.order[pos[query]]
+                    near = np.hypot(xs[query] - self.xs[point], ys[query] - self.ys[point]) <= self.tolerance
+                    queries.append(query[near])
+                    points.append(point[near])
+        return np.concatenate(queries), np.concatenate(points)
+
+    def nearest(self, xs, ys):
+        # index of the nearest point within the tolerance, -1 when none
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        query, point = self.pairs(xs, ys)
+        dists = np.hypot(xs[query] - self.xs[point], ys[query] - self.ys[point])
+        order = np.lexsort((point, dists, query))
+        query = query[order]
+        point = point[order]
+        first = np.concatenate([[True], query[1:] != query[:-1]]) if len(query) else np.zeros(0, dtype=bool)
+        nearest = np.full(len(xs), -1, dtype=np.int64)
+        nearest[query[first]] = point[first]
+        return nearest
+
+
+class RoadTopology(object):
+
+    def __init__(self, node_ufis, node_xs, node_ys,
+                 pfis, from_ufis, to_ufis, from_xs, from_ys, to_xs, to_ys,
+                 patch_from_ufis=(), patch_to_ufis=(), tolerance=TOLERANCE, from_null=None, to_null=None):
+
+        self.node_ufis = np.asarray(node_ufis, dtype=np.int64)
+        self.pfis = np.asarray(pfis, dtype=np.int64)
+        self.from_ufis = np.asarray(from_ufis, dtype=np.int64)
+        self.to_ufis = np.asarray(to_ufis, dtype=np.int64)
+        num_roads = len(self.pfis)
+        num_nodes = len(self.node_ufis)
+        # FROM_UFI / TO_UFI is null
+        self.from_null = np.zeros(num_roads, dtype=bool) if from_null is None else np.asarray(from_null, dtype=bool)
+        self.to_null = np.zeros(num_roads, dtype=bool) if to_null is None else np.asarray(to_null, dtype=bool)
+
+        # snap road ends to ROAD_INFRASTRUCTURE
+        end_xs = np.concatenate([np.asarray(from_xs, dtype=np.float64), np.asarray(to_xs, dtype=np.float64)])
+        end_ys = np.concatenate([np.asarray(from_ys, dtype=np.float64), np.asarray(to_ys, dtype=np.float64)])
+        end_nodes = SnapGrid(node_xs, node_ys, tolerance).nearest(end_xs, end_ys)
+
+        # snap the other ends to each other
+        unmatched = np.flatnonzero(end_nodes < 0)
+        self.num_unnamed = 0
+        if len(unmatched):
+            union_find = road_connectivity.UnionFind(len(unmatched))
+            query, point = SnapGrid(end_xs[unmatched], end_ys[unmatched], tolerance).pairs(end_xs[unmatched], end_ys[unmatched])
+            union_find.union_edges(query.tolist(), point.tolist())
+            _, clusters = np.unique(union_find.roots(), return_inverse=True)
+            end_nodes[unmatched] = num_nodes + clusters
+            self.num_unnamed = int(clusters.max()) + 1
+
+        self.from_nodes = end_nodes[:num_roads]
+        self.to_nodes = end_nodes[num_roads:]
+        # snapped UFI of each road end, -1 when snapped to an unnamed node
+        node_ufis = np.concatenate([self.node_ufis, np.full(self.num_unnamed, -1, dtype=np.int64)])
+        self.geom_from_ufis = node_ufis[self.from_nodes]
+        self.geom_to_ufis = node_ufis[self.to_nodes]
+
+        # geometric components, ROAD_PATCH joins its FROM_UFI / TO_UFI nodes
+        patch_from = self.node_index(patch_from_ufis)
+        patch_to = self.node_index(patch_to_ufis)
+        patch_known = (patch_from >= 0) & (patch_to >= 0)
+        union_find = road_connectivity.UnionFind(num_nodes + self.num_unnamed)
+        union_find.union_edges(self.from_nodes.tolist(), self.to_nodes.tolist())
+        union_find.union_edges(patch_from[patch_known].tolist(), patch_to[patch_known].tolist())
+        _, self.node_components = np.unique(union_find.roots(), return_inverse=True)
+
+        # attribute components, each null end is its own placeholder node (below -1) so
+        # null ends join nothing
+        placeholders = -2 - np.arange(2 * num_roads, dtype=np.int64)
+        self.attribute = road_connectivity.RoadConnectivity(
+            self.node_ufis, self.pfis,
+            np.where(self.from_null, placeholders[:num_roads], self.from_ufis),
+            np.where(self.to_null, placeholders[num_roads:], self.to_ufis),
+            patch_from_ufis, patch_to_ufis)
+
+    def __len__(self):
+        return len(self.pfis)
+
+    def node_index(self, ufis):
+        # index of each ufi in node_ufis, -1 when not a node
+        ufis = np.asarray(ufis, dtype=np.int64)
+        order = np.argsort(self.node_ufis, kind='mergesort')
+        sorted_ufis = self.node_ufis[order]
+        idx = np.clip(np.searchsorted(sorted_ufis, ufis), 0, max(len(sorted_ufis) - 1, 0))
+        found = (len(sorted_ufis) > 0) & (sorted_ufis[idx] == ufis)
+        return np.where(found, order[idx], -1)
+
+    @property
+    def road_components(self):
+        return self.node_components[self.from_nodes]
+
+    @property
+    def from_mismatch(self):
+        return (self.geom_from_ufis != self.from_ufis) | self.from_null
+
+    @property
+    def to_mismatch(self):
+        return (self.geom_to_ufis != self.to_ufis) | self.to_null
+
+    def connected_nodes(self, seed_ufis):
+        # per ROAD_INFRASTRUCTURE node, geometrically in the component of any seed UFI
+        seeds = self.node_index(seed_ufis)
+        components = np.zeros(self.node_components.max() + 1 if len(self.node_components) else 0, dtype=bool)
+        components[self.node_components[seeds[seeds >= 0]]] = True
+        return components[self.node_components[:len(self.node_ufis)]]
+
+    def connected_roads(self, seed_ufis):
+        # per road, geometrically in the component of any seed UFI
+        seeds = self.node_index(seed_ufis)
+        return np.in1d(self.road_components, self.node_components[seeds[seeds >= 0]])
+
+    @classmethod
+    def from_tables(cls, estamap_version, with_patch=False, tolerance=TOLERANCE):
+
+        em = gis.ESTAMAP(estamap_version)
+
+        logging.info('reading ROAD_INFRASTRUCTURE')
+        nodes = arcpy.da.FeatureClassToNumPyArray(in_table=os.path.join(em.sde, 'ROAD_INFRASTRUCTURE'),
+                                                  field_names=['UFI', 'SHAPE@X', 'SHAPE@Y'])
+
+        logging.info('reading ROAD')
+        # null FROM_UFI / TO_UFI read as NULL_UFI, tracked as masks
+        roads = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD'),
+                                           field_names=['PFI', 'FROM_UFI', 'TO_UFI'],
+                                           null_value={'FROM_UFI': NULL_UFI, 'TO_UFI': NULL_UFI},
+                                           sql_clause=(None, 'ORDER BY PFI'))
+        vertices = road_geometry.RoadVertices.from_feature_class(estamap_version)
+        # roads without geometry have no ends
+        ends = np.searchsorted(vertices.pfis, roads['PFI'])
+        ends = np.clip(ends, 0, max(len(vertices) - 1, 0))
+        has_geometry = (len(vertices) > 0) & (vertices.pfis[ends] == roads['PFI'])
+        roads = roads[has_geometry]
+        ends = ends[has_geometry]
+        logging.info('roads without geometry: {}'.format(int(np.count_nonzero(~has_geometry))))
+
+        patch_from_ufis, patch_to_ufis = (), ()
+        if with_patch:
+            logging.info('reading ROAD_PATCH')
+            patches = arcpy.da.TableToNumPyArray(in_table=os.path.join(em.sde, 'ROAD_PATCH'),
+                                                 field_names=['FROM_UFI', 'TO_UFI'],
+                                                 where_clause='MERGE_TRANSPORT = 1')
+            patch_from_ufis, patch_to_ufis = patches['FROM_UFI'], patches['TO_UFI']
+
+        from_null = roads['FROM_UFI'] == NULL_UFI
+        to_null = roads['TO_UFI'] == NULL_UFI
+        logging.info('null FROM_UFI: {}, null TO_UFI: {}'.format(int(np.count_nonzero(from_null)),
+                                                                int(np.count_nonzero(to_null))))
+
+        logging.info('snapping road ends: {}, tolerance: {}'.format(len(roads), tolerance))
+        first = vertices.first[ends]
+        last = vertices.last[ends]
+        return cls(nodes['UFI'], nodes['SHAPE@X'], nodes['SHAPE@Y'],
+                   roads['PFI'], roads['FROM_UFI'], roads['TO_UFI'],
+                   vertices.xs[first], vertices.ys[first], vertices.xs[last], vertices.ys[last],
+                   patch_from_ufis, patch_to_ufis, tolerance, from_null, to_null)
@@ -0,0 +1,291 @@
+'''
+Cross street traversal engine.
+
+From each end of a road the network is walked (a connecting road with the same
+RNID, else the road closest to straight ahead) until a connecting road is a
+cross street: named, not a TUNNEL and without the base road's RNID.
+
+Walks are memoized by (road, node, base RNID). A walk reaching a state already
+walked for the same base RNID reuses that chain suffix instead of walking it
+again. Each walk keeps a visited set of (road, node) states and stops at the
+first repeated state (LOOP) instead of running to the step limit.
+
+XStreetNetwork holds everything a traversal step looks up, built once from
+ROAD, ROAD_ALIAS and ROAD_TURN: the turns out of each (ufi, from_pfi) sorted by
+abs(angle) and by closeness to 180 degrees, and per road the nodes, RNIDs
+(by ALIAS_NUMBER), RNID set and FEATURE_TYPE_CODE.
+
+Roads are independent given the (read only) network, so with processes > 1
+the roads are split into PFI ranges, the network is sent once to each worker
+process (each with its own memo) and the rows are returned in PFI order.
+'''
+import logging
+import multiprocessing
+
+import numpy as np
+
+
+UNNAMED_RNID = 1312
+MAX_ORDER = 50
+
+
+class XStreetNetwork(object):
+
+    def __init__(self, pfis, from_ufis, to_ufis, ftcs,
+                 alias_pfis, alias_rnids, alias_nums,
+                 turn_ufis, turn_from_pfis, turn_to_pfis, turn_angles):
+
+        self.pfis = [int(pfi) for pfi in pfis]
+        self.road_index = dict((pfi, n) for n, pfi in enumerate(self.pfis))
+        self.from_ufis = [int(ufi) for ufi in from_ufis]
+        self.to_ufis = [int(ufi) for ufi in to_ufis]
+        self.ftcs = [str(ftc) for ftc in ftcs]
+
+        # rnids per road, by alias number
+        alias_roads = np.array([self.road_index.get(int(pfi), -1) for pfi in alias_pfis], dtype=np.int64)
+        alias_rnids = np.asarray(alias_rnids, dtype=np.int64)
+        alias_nums = np.asarray(alias_nums, dtype=np.int64)
+        found = alias_roads >= 0
+        alias_roads, alias_rnids, alias_nums = alias_roads[found], alias_rnids[found], alias_nums[found]
+        order = np.lexsort((alias_nums, alias_roads))
+        offsets = np.searchsorted(alias_roads[order], np.arange(len(self.pfis) + 1))
+        rnids = alias_rnids[order].tolist()
+        self.rnids = [tuple(rnids[start:end]) for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        self.rnid_sets = [frozenset(road_rnids) for road_rnids in self.rnids]
+
+        # turns out of (ufi, from_pfi), by abs(angle) and by closeness to 180
+        turn_ufis = np.asarray(turn_ufis, dtype=np.int64)
+        turn_from_pfis = np.asarray(turn_from_pfis, dtype=np.int64)
+        turn_to_pfis = np.asarray(turn_to_pfis, dtype=np.int64)
+        turn_angles = np.asarray(turn_angles, dtype=np.float64)
+        self.connections = self._group_turns(turn_ufis, turn_from_pfis, turn_to_pfis, turn_angles,
+                                             np.abs(turn_angles))
+        self.connections_180 = self._group_turns(turn_ufis, turn_from_pfis, turn_to_pfis, turn_angles,
+                                                 np.abs(180 - np.abs(turn_angles)))
+
+    @staticmethod
+    def _group_turns(ufis, from_pfis, to_pfis, angles, sort_key):
+        order = np.lexsort((to_pfis, sort_key, from_pfis, ufis))
+        ufis, from_pfis = ufis[order], from_pfis[order]
+        starts = np.flatnonzero((ufis[1:] != ufis[:-1]) | (from_pfis[1:] != from_pfis[:-1])) + 1
+        starts = np.concatenate([[0], starts, [len(order)]]).tolist()
+        connections = list(zip(to_pfis[order].tolist(), angles[order].tolist()))
+        ufis = ufis.tolist()
+        from_pfis = from_pfis.tolist()
+        groups = {}
+        for start, end in zip(starts[:-1], starts[1:]):
+            groups[(ufis[start], from_pfis[start])] = tuple(connections[start:end])
+        return groups
+
+    def connecting(self, ufi, pfi):
+        return self.connections.get((ufi, pfi), ())
+
+    def connecting_180(self, ufi, pfi):
+        return self.connections_180.get((ufi, pfi), ())
+
+    def road_nodes(self, pfi):
+        n = self.road_index[pfi]
+        return self.from_ufis[n], self.to_ufis[n]
+
+    def road_rnids(self, pfi):
+        return self.rnids[self.road_index[pfi]]
+
+    def primary_rnid(self, pfi):
+        return self.rnids[self.road_index[pfi]][0]
+
+    def road_rnid_set(self, pfi):
+        return self.rnid_sets[self.road_index[pfi]]
+
+    def road_ftc(self, pfi):
+        return self.ftcs[self.road_index[pfi]]
+
+    def road_altnode(self, pfi, ufi):
+        n = self.road_index[pfi]
+        if ufi == self.from_ufis[n]:
+            return self.to_ufis[n]
+        return self.from_ufis[n]
+
+
+class XStreetTraversal(object):
+
+    def __init__(self, network):
+        self.network = network
+        # (pfi, ufi, base rnid) -> (rows, start, end, xstreet, loop_index)
+        self.memo = {}
+        self.memo_hits = 0
+
+    def next_traversal(self, pfi, ufi):
+        network = self.network
+        traversal_pfis_sort_180 = network.connecting_180(ufi, pfi)
+
+        # 1. road has SAME_RNID and PFI is not UNNAMED
+        pfi_rnid = network.primary_rnid(pfi)
+        if pfi_rnid != UNNAMED_RNID:
+            for con_pfi, con_angle in traversal_pfis_sort_180:
+                if pfi_rnid in network.road_rnid_set(con_pfi):
+                    return 'SAME_RNID', con_pfi, network.road_altnode(con_pfi, ufi)
+
+        # 2. road angle closest to 180 degrees
+        traversal_pfi = traversal_pfis_sort_180[0][0]
+        return 'CLOSE_TO_180', traversal_pfi, network.road_altnode(traversal_pfi, ufi)
+
+    def find_xstreet(self, connecting, base_rnid):
+        network = self.network
+        for con_pfi, con_angle in connecting:
+            con_rnids = network.road_rnid_set(con_pfi)
+            if UNNAMED_RNID in con_rnids:
+                # road is UNNAMED
+                continue
+            if base_rnid in con_rnids:
+                # road has same RNID
+                continue
+            if network.road_ftc(con_pfi) == 'TUNNEL':
+                # road type is a TUNNEL
+                continue
+            return con_pfi, network.primary_rnid(con_pfi)
+        return None, None
+
+    def splice(self, rows, visited, memo, desc):
+        # append a memoized chain suffix to rows, returns (end, xstreet, loop_index) or None if unusable
+        memo_rows, start, end, xstreet, loop_index = memo
+        suffix = list(memo_rows[start:])
+        depth = len(rows)
+
+        # suffix state already in this walk
+        for n, (pfi, ufi, num_connecting, _) in enumerate(suffix):
+            if (pfi, ufi) in visited:
+                suffix = suffix[:n]
+                end, xstreet, loop_index = 'LOOP', (None, None), visited[(pfi, ufi)]
+                break
+        else:
+            if end == 'MORE_THAN_50' and depth < start:
+                # suffix was cut by the step limit closer to its start than this walk needs
+                return None
+            if end == 'LOOP':
+                loop_index = loop_index - start + depth
+
+        if depth + len(suffix) > MAX_ORDER + 2:
+            suffix = suffix[:MAX_ORDER + 2 - depth]
+            end, xstreet, loop_index = 'MORE_THAN_50', (None, None), None
+
+        if suffix:
+            suffix[0] = suffix[0][:3] + (desc,)
+        rows.extend(suffix)
+        self.memo_hits += 1
+        return end, xstreet, loop_index
+
+    def walk(self, pfi, ufi, base_rnid):
+        # returns (rows, end, (xstreet_pfi, xstreet_rnid)), rows [(traversal_pfi, traversal_ufi, num_connecting, desc)]
+
+        rows = []
+        visited = {}
+        desc = 'BEGIN'
+        xstreet = (None, None)
+        loop_index = None
+
+        while True:
+
+            memo = self.memo.get((pfi, ufi, base_rnid))
+            if memo is not None:
+                spliced = self.splice(rows, visited, memo, desc)
+                if spliced is not None:
+                    end, xstreet, loop_index = spliced
+                    break
+
+            visited[(pfi, ufi)] = len(rows)
+            connecting = self.network.connecting(ufi, pfi)
+            rows.append((pfi, ufi, len(connecting), desc))
+
+            if len(connecting) == 0:
+                end = 'ROAD_END'
+                break
+
+            xstreet = self.find_xstreet(connecting, base_rnid)
+            if xstreet[0] is not None:
+                end = 'XSTREET'
+                break
+
+            desc, pfi, ufi = self.next_traversal(pfi, ufi)
+
+            if (pfi, ufi) in visited:
+                end = 'LOOP'
+                loop_index = visited[(pfi, ufi)]
+                break
+
+            if len(rows) - 1 > MAX_ORDER:
+                # exit if traversal too long
+                end = 'MORE_THAN_50'
+                break
+
+        rows = tuple(rows)
+        for n, (row_pfi, row_ufi, _, _) in enumerate(rows):
+            if end == 'LOOP' and n > loop_index:
+                # states on the loop have a different suffix when walked from themselves
+                break
+            key = (row_pfi, row_ufi, base_rnid)
+            existing = self.memo.get(key)
+            if existing is None or existing[2] == 'MORE_THAN_50':
+                self.memo[key] = (rows, n, end, xstreet, loop_index)
+
+        return rows, end, xstreet
+
+    def process_node(self, pfi, ufi, node_type, base_rnid):
+        # returns (xstreet_pfi, xstreet_rnid, traversal rows for ROAD_XSTREET_TRAVERSAL)
+        rows, end, (xstreet_pfi, xstreet_rnid) = self.walk(pfi, ufi, base_rnid)
+
+        traversal = [[pfi, node_type, order, traversal_pfi, traversal_ufi, num_connecting, desc]
+                     for order, (traversal_pfi, traversal_ufi, num_connecting, desc) in enumerate(rows)]
+        if end == 'XSTREET':
+            traversal.append(traversal[-1][:6] + ['XSTREET'])
+        return xstreet_pfi, xstreet_rnid, traversal
+
+
+def process_road(engine, pfi):
+    # returns (ROAD_XSTREET row, FROM traversal rows, TO traversal rows)
+    network = engine.network
+    pfi_rnid = network.primary_rnid(pfi)
+    from_ufi, to_ufi = network.road_nodes(pfi)
+    from_xstreet_pfi, from_xstreet_rnid, from_traversal = engine.process_node(pfi, from_ufi, 'FROM', pfi_rnid)
+    to_xstreet_pfi, to_xstreet_rnid, to_traversal = engine.process_node(pfi, to_ufi, 'TO', pfi_rnid)
+    return ([pfi, pfi_rnid,
+             from_ufi, from_xstreet_rnid, from_xstreet_pfi,
+             to_ufi, to_xstreet_rnid, to_xstreet_pfi],
+            from_traversal, to_traversal)
+
+
+_worker_engine = None
+
+
+def init_worker(network):
+    global _worker_engine
+    _worker_engine = XStreetTraversal(network)
+
+
+def process_roads(pfis):
+    memo_hits = _worker_engine.memo_hits
+    results = [process_road(_worker_engine, pfi) for pfi in pfis]
+    return results, _worker_engine.memo_hits - memo_hits
+
+
+def iter_xstreets(network, processes=1, chunk_size=5000):
+    # yields process_road results for every road of the network, in network PFI order
+    if processes <= 1:
+        engine = XStreetTraversal(network)
+        for pfi in network.pfis:
+            yield process_road(engine, pfi)
+        logging.info('memo hits: {}'.format(engine.memo_hits))
+        return
+
+    chunks = [network.pfis[start:start + chunk_size] for start in xrange(0, len(network.pfis), chunk_size)]
+    logging.info('processing {} road chunks, processes: {}'.format(len(chunks), processes))
+    memo_hits = 0
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(network,))
+    try:
+        for results, hits in pool.imap(process_roads, chunks):
+            memo_hits += hits
+            for result in results:
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+    logging.info('memo hits: {}'.format(memo_hits))